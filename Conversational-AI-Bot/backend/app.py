@@ -1,87 +1,281 @@
 import os
-import io
-import base64
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+import json
+import time
+from urllib.parse import quote
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
-import speech_recognition as sr
-from gtts import gTTS
+
+import audio
+import llm
+import memory
+import stt
+import tts
+import uploads
+from streaming import SentenceChunker, iterate_in_executor
 
 load_dotenv()
 
-app = FastAPI(title="Conversational AI Bot - Backend")
+# Blocking stages run on their own pools so a slow request never stalls the event loop.
+# Decoding/recognition is CPU-heavy, gTTS calls are network-bound. Groq calls are
+# natively async on a pooled client (see llm.py) and need no threads.
+STT_WORKERS = int(os.getenv("STT_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "16"))
+# Longest utterance accepted over /ws/converse; frames past it are dropped.
+WS_MAX_UTTERANCE_S = float(os.getenv("WS_MAX_UTTERANCE_S", "60"))
+
+stt_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+# One thread keeps conversation store access (and its SQLite connection) serialized.
+memory_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+
+conversations = memory.ConversationStore()
+
+
+async def run_blocking(executor: ThreadPoolExecutor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+_transcriber: stt.BatchingTranscriber | None = None
+
+
+def get_transcriber() -> stt.BatchingTranscriber:
+    global _transcriber
+    if _transcriber is None:
+        _transcriber = stt.BatchingTranscriber(stt.get_backend(), stt_executor, max_in_flight=STT_WORKERS)
+    return _transcriber
+
 
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    uploads.configure_spooling()
+    # Load the STT model before serving so the first request does not pay for it.
+    await run_blocking(stt_executor, stt.get_backend)
+    yield
+    await llm.aclose()
+    for executor in (stt_executor, tts_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+    memory_executor.shutdown(wait=True)
+    conversations.close()
+
+
+app = FastAPI(title="Conversational AI Bot - Backend", lifespan=lifespan)
+
+# Added before CORS so that 413 responses still carry CORS headers.
+app.add_middleware(uploads.BodySizeLimit, max_bytes=uploads.MAX_UPLOAD_BYTES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Reply-Text", "X-Transcript", "X-Conversation-Id", "Server-Timing"],
 )
 
-def transcribe_file_bytes(file_bytes: bytes) -> str:
-    r = sr.Recognizer()
-    with sr.AudioFile(io.BytesIO(file_bytes)) as source:
-        audio = r.record(source)
+
+class StageTimer:
+    """Per-stage wall time of one request, reported in the ``Server-Timing`` header.
+
+    Stages are ``memory`` (conversation store), ``decode`` (audio decoding and
+    VAD), ``stt``, ``llm`` and ``tts`` (until the first audio chunk is ready).
+    ``total`` covers everything up to the response headers.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def header(self) -> str:
+        stages = {**self.stages, "total": (time.perf_counter() - self.started) * 1000}
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in stages.items())
+
+
+async def transcribe_upload(file: UploadFile, timer: StageTimer) -> tuple[stt.STTResult, audio.Preprocessed]:
+    # Decode straight from Starlette's spooled file, in blocks, rather than reading the upload into memory.
     try:
-        return r.recognize_google(audio, language="en-US")
-    except sr.UnknownValueError:
-        return "Could not understand audio"
-    except sr.RequestError as e:
-        raise RuntimeError(f"Speech API error: {e}")
+        with timer.stage("decode"):
+            prepared = await run_blocking(stt_executor, audio.preprocess, file.file)
+    except audio.AudioTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Unsupported or corrupt audio: {e}")
+    # Silence has already been cut, so engines only spend time on speech.
+    with timer.stage("stt"):
+        return await get_transcriber().transcribe_clips(prepared.clips), prepared
 
 
 @app.post("/transcribe")
-async def transcribe(file: UploadFile = File(...)):
-    contents = await file.read()
+async def transcribe(response: Response, file: UploadFile = File(...)):
+    timer = StageTimer()
     try:
-        text = transcribe_file_bytes(contents)
-        return {"text": text}
+        result, prepared = await transcribe_upload(file, timer)
+        response.headers["Server-Timing"] = timer.header()
+        return {
+            "text": result.text,
+            "engine": result.engine,
+            "audio_seconds": round(prepared.source_seconds, 3),
+            "speech_seconds": round(result.audio_seconds, 3),
+            "segments": len(prepared.clips),
+            "rtf": round(result.rtf, 3),
+        }
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def generate_reply(text: str, max_tokens: int | None = None, context: list | None = None) -> str:
+    return await llm.complete(text, max_tokens, context)
+
+
+# -----------------------------
+# Conversation memory
+# -----------------------------
+_summarizing: set[str] = set()
+_background: set[asyncio.Task] = set()
+
+
+async def open_conversation(conversation_id: str | None) -> tuple[str, list]:
+    """Resolve (or start) a conversation and return its id with the history to send along."""
+    if not conversation_id:
+        conversation = await run_blocking(memory_executor, conversations.create)
+        return conversation.id, []
+    context = await run_blocking(memory_executor, conversations.context, conversation_id)
+    if context is None:
+        raise HTTPException(status_code=404, detail="Conversation not found or expired")
+    return conversation_id, context
+
+
+async def _fold_history(conversation_id: str) -> None:
+    try:
+        snapshot = await run_blocking(memory_executor, conversations.snapshot, conversation_id)
+        overflow = await run_blocking(memory_executor, conversations.pending_overflow, conversation_id)
+        if snapshot is None or not overflow:
+            return
+        summary = await llm.summarize(snapshot["summary"], overflow)
+        await run_blocking(memory_executor, conversations.fold, conversation_id, summary, overflow)
+    except Exception as e:
+        # The turns stay in place and are retried after the next exchange.
+        print(f"Summarization failed for {conversation_id}: {e}")
+    finally:
+        _summarizing.discard(conversation_id)
+
+
+async def remember(conversation_id: str, user_text: str, reply_text: str) -> None:
+    # An echoed fallback is not a real exchange; storing it would feed it back to the model next turn.
+    if user_text == stt.UNINTELLIGIBLE or reply_text == llm.fallback_reply(user_text):
+        return
+    await run_blocking(
+        memory_executor,
+        conversations.append,
+        conversation_id,
+        memory.Turn("user", user_text),
+        memory.Turn("assistant", reply_text),
+    )
+    # Summarize off the request path; at most one summarization per conversation at a time.
+    if conversation_id not in _summarizing:
+        _summarizing.add(conversation_id)
+        task = asyncio.create_task(_fold_history(conversation_id))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+@app.post("/conversations", status_code=201)
+async def create_conversation():
+    conversation = await run_blocking(memory_executor, conversations.create)
+    return {"conversation_id": conversation.id}
+
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    snapshot = await run_blocking(memory_executor, conversations.snapshot, conversation_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Conversation not found or expired")
+    return snapshot
+
+
+@app.delete("/conversations/{conversation_id}", status_code=204)
+async def delete_conversation(conversation_id: str):
+    if not await run_blocking(memory_executor, conversations.delete, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found or expired")
+    return Response(status_code=204)
+
+
+@app.get("/memory/stats")
+async def memory_stats():
+    return await run_blocking(memory_executor, conversations.stats)
+
+
+@app.get("/stt/stats")
+async def stt_stats():
+    transcriber = get_transcriber()
+    return {"engine": transcriber.backend.name, **transcriber.stats.snapshot()}
+
+
+@app.get("/tts/stats")
+async def tts_stats():
+    return tts.get_speaker().stats()
+
+
 @app.post("/respond")
-async def respond(payload: dict, max_tokens: int | None = None):
+async def respond(payload: dict, response: Response, max_tokens: int | None = Query(None, ge=1)):
     text = payload.get("text")
     if not text:
         raise HTTPException(status_code=400, detail="Missing 'text' in payload")
+    timer = StageTimer()
+    with timer.stage("memory"):
+        conversation_id, context = await open_conversation(payload.get("conversation_id"))
+    with timer.stage("llm"):
+        reply_text = await generate_reply(text, max_tokens, context)
+    with timer.stage("memory"):
+        await remember(conversation_id, text, reply_text)
+    response.headers["Server-Timing"] = timer.header()
+    return {"text": reply_text, "conversation_id": conversation_id}
 
-    try:
 
-        from groq import Groq
+def speech_chunks(text: str):
+    """Yield audio sentence by sentence, from the phrase cache where possible."""
+    yield from tts.get_speaker().stream(text)
 
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 
-        env_default = 500
-        token_limit = max_tokens if (max_tokens is not None) else env_default
+def text_to_speech_bytes(text: str) -> bytes:
+    return tts.get_speaker().synthesize(text)
 
-        chat_completion = client.chat.completions.create(
-            messages=[
-            {"role": "system", "content": "You are a helpful assistant. Respond concisely and in English."},
-            {"role": "user", "content": text.strip()},
-            ],
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
-            max_tokens=token_limit,
-            temperature=0.7,
-            top_p=1.0,
-        )
 
-        choice = chat_completion.choices[0]
-        reply = getattr(choice.message, "content", None) or choice.message.content if hasattr(choice, 'message') else getattr(choice, 'text', '')
-        return {"text": reply}
-    except Exception as e:
-        print(f"GROQ error: {e}")
-        return {"text": f"(fallback) I heard: {text}"}
+async def speech_response(text: str, timer: StageTimer, headers: dict | None = None) -> StreamingResponse:
+    """Stream synthesized speech as chunked audio.
+
+    The first chunk is awaited before the response starts, so a TTS failure can
+    still be reported with a proper status instead of a truncated body.
+    """
+    chunks = iterate_in_executor(tts_executor, speech_chunks, text)
+    with timer.stage("tts"):
+        first = await anext(chunks, b"")
+    headers = {**(headers or {}), "Server-Timing": timer.header()}
 
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
 
-def text_to_mp3_bytes(text: str) -> bytes:
-    mp3_io = io.BytesIO()
-    tts = gTTS(text=text, lang="en")
-    tts.write_to_fp(mp3_io)
-    mp3_io.seek(0)
-    return mp3_io.read()
+    return StreamingResponse(body(), media_type=tts.get_speaker().engine.media_type, headers=headers)
+
+
+def text_header(text: str) -> str:
+    # Header values must be latin-1; percent-encode so any reply survives the trip.
+    return quote(text, safe=" ,.?!:;'-")
 
 
 @app.post("/tts")
@@ -90,32 +284,226 @@ async def tts_endpoint(payload: dict):
     if not text:
         raise HTTPException(status_code=400, detail="Missing 'text' in payload")
     try:
-        mp3_bytes = text_to_mp3_bytes(text)
-        mp3_b64 = base64.b64encode(mp3_bytes).decode("utf-8")
-        return {"audio_base64": mp3_b64}
+        return await speech_response(text, StageTimer())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/converse")
-async def converse(file: UploadFile = File(...)):
-    contents = await file.read()
+async def converse(
+    file: UploadFile = File(...),
+    max_tokens: int | None = Form(None, ge=1),
+    conversation_id: str | None = Form(None),
+):
+    timer = StageTimer()
+    context: list = []
+    if conversation_id:
+        # An unknown id is rejected before the upload is decoded.
+        with timer.stage("memory"):
+            conversation_id, context = await open_conversation(conversation_id)
     try:
-        user_text = transcribe_file_bytes(contents)
+        user_text = (await transcribe_upload(file, timer))[0].text
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not conversation_id and user_text != stt.UNINTELLIGIBLE:
+        # A new conversation is only started by an upload that produced speech, so rejected
+        # or silent uploads do not leave empty conversations behind.
+        with timer.stage("memory"):
+            conversation_id, context = await open_conversation(None)
 
-    resp = await respond({"text": user_text})
-    reply_text = resp.get("text", "")
-
+    # A lower max_tokens gives a shorter reply, which is also quicker to synthesize.
+    with timer.stage("llm"):
+        reply_text = await generate_reply(user_text, max_tokens, context)
+    headers = {
+        "X-Reply-Text": text_header(reply_text),
+        "X-Transcript": text_header(user_text),
+    }
+    if conversation_id:
+        with timer.stage("memory"):
+            await remember(conversation_id, user_text, reply_text)
+        headers["X-Conversation-Id"] = conversation_id
     try:
-        mp3_bytes = text_to_mp3_bytes(reply_text)
-        mp3_b64 = base64.b64encode(mp3_bytes).decode("utf-8")
+        return await speech_response(reply_text, timer, headers)
     except Exception as e:
-        mp3_b64 = ""
         print(f"TTS error: {e}")
+        # The reply text is still useful without audio.
+        headers["Server-Timing"] = timer.header()
+        return Response(b"", media_type=tts.get_speaker().engine.media_type, headers=headers)
+
+
+# -----------------------------
+# Streaming conversation
+# -----------------------------
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+async def _receive_utterance(websocket: WebSocket, stream, send_lock: asyncio.Lock) -> None:
+    """Feed binary frames to the STT stream until the client sends ``end``.
+
+    Buffered streams decode partials on a background task so frames keep being
+    read meanwhile; a partial that comes due while one is running is skipped.
+    """
+    last_partial = None
+    truncated = False
+    partial_task: asyncio.Task | None = None
+
+    async def send_partial(text: str | None) -> None:
+        nonlocal last_partial
+        if text and text != last_partial:
+            last_partial = text
+            async with send_lock:
+                await websocket.send_json({"type": "partial", "text": text})
 
-    return JSONResponse({"text": reply_text, "audio_base64": mp3_b64})
+    async def decode_partial() -> None:
+        try:
+            text = await run_blocking(stt_executor, stream.partial)
+        except Exception as e:
+            # Partials are best effort; the final transcript decodes everything again.
+            print(f"Partial transcript failed: {e}")
+            return
+        await send_partial(text)
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                if stream.duration >= WS_MAX_UTTERANCE_S:
+                    if not truncated:
+                        truncated = True
+                        async with send_lock:
+                            await websocket.send_json(
+                                {"type": "error", "detail": f"Utterance longer than {WS_MAX_UTTERANCE_S:g}s; audio truncated"}
+                            )
+                    continue
+                await send_partial(await run_blocking(stt_executor, stream.accept, message["bytes"]))
+                if stream.partial_due() and (partial_task is None or partial_task.done()):
+                    partial_task = asyncio.create_task(decode_partial())
+            elif message.get("text") is not None:
+                try:
+                    event = json.loads(message["text"])
+                except ValueError:
+                    event = {}
+                if event.get("type") == "end":
+                    return
+    finally:
+        # No partial may arrive after the transcript.
+        if partial_task is not None:
+            partial_task.cancel()
+
+
+async def _send_audio(websocket: WebSocket, queue: asyncio.Queue, send_lock: asyncio.Lock, timings: dict, since: float) -> None:
+    """Send synthesized sentences in order as each finishes."""
+    audio_format = tts.get_speaker().engine.format
+    while (item := await queue.get()) is not None:
+        seq, sentence, synthesis = item
+        try:
+            audio = await synthesis
+        except Exception as e:
+            print(f"TTS error: {e}")
+            continue
+        timings.setdefault("first_audio_ms", _elapsed_ms(since))
+        # Header and payload go out back to back so token messages never land between them.
+        async with send_lock:
+            await websocket.send_json({"type": "audio", "seq": seq, "text": sentence, "format": audio_format})
+            await websocket.send_bytes(audio)
+
+
+async def stream_turn(websocket: WebSocket, max_tokens: int | None, conversation_id: str, context: list) -> None:
+    backend = await run_blocking(stt_executor, stt.get_backend)
+    stream = backend.open_stream()
+    send_lock = asyncio.Lock()
+    await _receive_utterance(websocket, stream, send_lock)
+
+    ended = time.perf_counter()
+    timings: dict = {}
+    try:
+        result = await run_blocking(stt_executor, stream.finish)
+    except RuntimeError as e:
+        async with send_lock:
+            await websocket.send_json({"type": "error", "detail": str(e)})
+        return
+    timings["stt_ms"] = _elapsed_ms(ended)
+    async with send_lock:
+        await websocket.send_json(
+            {"type": "transcript", "text": result.text, "engine": result.engine, "audio_seconds": round(result.audio_seconds, 3)}
+        )
+
+    # Each sentence is synthesized as soon as it is complete; the sender task keeps them in order.
+    queue: asyncio.Queue = asyncio.Queue()
+    sender = asyncio.create_task(_send_audio(websocket, queue, send_lock, timings, ended))
+    pending = []
+
+    def speak(seq: int, sentence: str) -> None:
+        synthesis = asyncio.ensure_future(run_blocking(tts_executor, text_to_speech_bytes, sentence))
+        pending.append(synthesis)
+        queue.put_nowait((seq, sentence, synthesis))
+
+    chunker = SentenceChunker()
+    reply = []
+    try:
+        async for token in llm.stream(result.text, max_tokens, context):
+            timings.setdefault("first_token_ms", _elapsed_ms(ended))
+            reply.append(token)
+            async with send_lock:
+                await websocket.send_json({"type": "token", "text": token})
+            for sentence in chunker.feed(token):
+                speak(len(pending), sentence)
+        tail = chunker.flush()
+        if tail:
+            speak(len(pending), tail)
+        queue.put_nowait(None)
+        await sender
+    finally:
+        if not sender.done():
+            sender.cancel()
+            for synthesis in pending:
+                synthesis.cancel()
+
+    timings["total_ms"] = _elapsed_ms(ended)
+    await remember(conversation_id, result.text, "".join(reply))
+    async with send_lock:
+        await websocket.send_json(
+            {"type": "done", "text": "".join(reply), "sentences": len(pending), "conversation_id": conversation_id, **timings}
+        )
+
+
+@app.websocket("/ws/converse")
+async def ws_converse(websocket: WebSocket):
+    await websocket.accept()
+    conversation_id = None
+    try:
+        # One connection can carry several utterances, each opened by a "start" message.
+        while True:
+            try:
+                event = json.loads(await websocket.receive_text())
+            except (ValueError, KeyError):
+                event = {}
+            if event.get("type") != "start":
+                await websocket.send_json({"type": "error", "detail": "Expected a JSON 'start' message"})
+                continue
+            max_tokens = event.get("max_tokens")
+            if max_tokens is not None and not isinstance(max_tokens, int):
+                await websocket.send_json({"type": "error", "detail": "'max_tokens' must be an integer"})
+                continue
+            try:
+                # Turns on one connection share a conversation unless the client names another.
+                conversation_id, context = await open_conversation(event.get("conversation_id") or conversation_id)
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail})
+                continue
+            try:
+                await stream_turn(websocket, max_tokens, conversation_id, context)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # A failed turn is reported and the connection stays open for the next one.
+                print(f"Streaming turn failed: {e}")
+                await websocket.send_json({"type": "error", "detail": "Turn failed; please try again"})
+    except WebSocketDisconnect:
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+"""Upload decoding and speech-only PCM for the STT backends.
+
+``preprocess`` turns an uploaded file into 16 kHz mono 16-bit clips that
+contain only speech:
+
+1. Decode: PCM WAV through the standard library, other formats through
+   ``soundfile`` (WAV/FLAC/OGG/AIFF, and MP3 with libsndfile >= 1.1), and
+   anything else, or when soundfile is missing, through ``ffmpeg``. Input is
+   read from a file in blocks and downmixed as it goes; anything longer than
+   ``MAX_AUDIO_SECONDS`` is rejected.
+2. Downmix to mono and resample to 16 kHz with NumPy: a windowed-sinc
+   low-pass when downsampling, then linear interpolation.
+3. An energy voice-activity detector drops leading/trailing silence and
+   collapses long pauses to ``VAD_KEEP_SILENCE_MS``.
+4. The speech is packed into clips of at most ``VAD_MAX_CLIP_S`` seconds,
+   cut at pauses, so local engines get batched decodes that fit their window.
+"""
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from typing import BinaryIO, List, Tuple, Union
+
+import numpy as np
+
+from stt import SAMPLE_RATE, AudioClip
+
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "30"))
+# A frame is speech when it is this many dB above the estimated noise floor.
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "12"))
+# Frames quieter than this are never speech, however quiet the recording is.
+VAD_MIN_SPEECH_DBFS = float(os.getenv("VAD_MIN_SPEECH_DBFS", "-55"))
+# Anything within this many dB of the loudest frame counts as speech. This matters when the
+# clip has no real silence and the "noise floor" is the quietest speech.
+VAD_DYNAMIC_RANGE_DB = 30.0
+VAD_PAD_MS = int(os.getenv("VAD_PAD_MS", "200"))
+VAD_KEEP_SILENCE_MS = int(os.getenv("VAD_KEEP_SILENCE_MS", "300"))
+VAD_MAX_CLIP_S = float(os.getenv("VAD_MAX_CLIP_S", "25"))
+FFMPEG_TIMEOUT_S = float(os.getenv("FFMPEG_TIMEOUT_S", "60"))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
+
+
+@dataclass
+class Preprocessed:
+    clips: List[AudioClip]
+    source_seconds: float
+
+    @property
+    def speech_seconds(self) -> float:
+        return sum(clip.duration for clip in self.clips)
+
+
+# -----------------------------
+# Decoding
+# -----------------------------
+class AudioTooLong(ValueError):
+    pass
+
+
+def _check_duration(frames: float, rate: int, max_seconds: float) -> None:
+    if rate and frames / rate > max_seconds:
+        raise AudioTooLong(f"Audio is longer than the {max_seconds:g}s limit")
+
+
+def _pcm_to_float(frames: bytes, width: int) -> np.ndarray:
+    if width == 1:
+        return (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 2:
+        return np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    if width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+        return ((ints << 8) >> 8).astype(np.float32) / 8388608
+    if width == 4:
+        return np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    raise ValueError(f"Unsupported WAV sample width {width}")
+
+
+def _decode_wave(source: BinaryIO, max_seconds: float) -> Tuple[np.ndarray, int]:
+    blocks = []
+    with wave.open(source, "rb") as reader:
+        channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+        _check_duration(reader.getnframes(), rate, max_seconds)
+        read = 0
+        # Downmix one second at a time, so only mono samples are ever held, never the whole raw upload.
+        while frames := reader.readframes(rate):
+            blocks.append(_pcm_to_float(frames, width).reshape(-1, channels).mean(axis=1))
+            read += blocks[-1].size
+            _check_duration(read, rate, max_seconds)  # the header length can be a placeholder
+    return (np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)), rate
+
+
+def _decode_soundfile(source: BinaryIO, max_seconds: float) -> Tuple[np.ndarray, int]:
+    import soundfile as sf
+
+    blocks = []
+    with sf.SoundFile(source) as audio_file:
+        rate = audio_file.samplerate
+        if audio_file.frames > 0:
+            _check_duration(audio_file.frames, rate, max_seconds)
+        read = 0
+        for block in audio_file.blocks(blocksize=rate, dtype="float32", always_2d=True):
+            blocks.append(block.mean(axis=1))
+            read += blocks[-1].size
+            _check_duration(read, rate, max_seconds)
+    return (np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)), rate
+
+
+def _decode_ffmpeg(source: BinaryIO, max_seconds: float) -> Tuple[np.ndarray, int]:
+    binary = shutil.which("ffmpeg")
+    if binary is None:
+        raise ValueError("format needs ffmpeg, which is not installed")
+    try:
+        # A spooled upload that has rolled over to disk is handed to ffmpeg by descriptor.
+        stdin, payload = source.fileno(), None
+    except (AttributeError, OSError):
+        stdin, payload = subprocess.PIPE, source.read()
+    # ffmpeg resamples and downmixes itself, so its output skips straight to VAD.
+    proc = subprocess.Popen(
+        [binary, "-nostdin", "-v", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdin=stdin,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    limit = int(max_seconds * SAMPLE_RATE) * 2
+    deadline = time.monotonic() + FFMPEG_TIMEOUT_S
+    try:
+        if payload is not None:
+            # Small uploads only (they fit in the spool), so handing them over in one go is fine.
+            out, err = proc.communicate(payload, timeout=FFMPEG_TIMEOUT_S)
+        else:
+            # The capped read blocks until ffmpeg writes or exits; the timer kills a stuck ffmpeg,
+            # which ends the read, so the whole decode stays within FFMPEG_TIMEOUT_S.
+            timed_out = threading.Event()
+
+            def expire() -> None:
+                timed_out.set()
+                proc.kill()
+
+            watchdog = threading.Timer(FFMPEG_TIMEOUT_S, expire)
+            watchdog.start()
+            try:
+                out = proc.stdout.read(limit + 2)
+                if timed_out.is_set():
+                    raise subprocess.TimeoutExpired(proc.args, FFMPEG_TIMEOUT_S)
+                if len(out) > limit:
+                    raise AudioTooLong(f"Audio is longer than the {max_seconds:g}s limit")
+                err = proc.communicate(timeout=max(0.0, deadline - time.monotonic()))[1]
+            finally:
+                watchdog.cancel()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if len(out) > limit:
+        raise AudioTooLong(f"Audio is longer than the {max_seconds:g}s limit")
+    if proc.returncode != 0 or not out:
+        raise ValueError(err.decode("utf-8", "replace").strip() or "ffmpeg could not decode the upload")
+    return np.frombuffer(out, dtype="<i2").astype(np.float32) / 32768, SAMPLE_RATE
+
+
+def decode(source: BinaryIO, max_seconds: float = MAX_AUDIO_SECONDS) -> Tuple[np.ndarray, int]:
+    """Return mono float32 samples and their sample rate, reading ``source`` in blocks.
+
+    Raises ``AudioTooLong`` past ``max_seconds`` (checked against the header
+    where there is one, and again while reading) and ``ValueError`` for
+    anything that cannot be decoded.
+    """
+    head = source.read(12)
+    source.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        try:
+            return _decode_wave(source, max_seconds)
+        except AudioTooLong:
+            raise
+        except (wave.Error, ValueError, EOFError):
+            source.seek(0)  # e.g. float or ADPCM WAV; the general decoders handle those
+    try:
+        return _decode_soundfile(source, max_seconds)
+    except AudioTooLong:
+        raise
+    except Exception:
+        pass  # soundfile not installed, or libsndfile does not know the format (e.g. MP3 on older builds)
+    source.seek(0)
+    return _decode_ffmpeg(source, max_seconds)
+
+
+# -----------------------------
+# Resampling
+# -----------------------------
+def _lowpass(samples: np.ndarray, cutoff: float, taps: int = 63) -> np.ndarray:
+    """Windowed-sinc FIR; ``cutoff`` is a fraction of the source sample rate."""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel.astype(np.float32), mode="same")
+
+
+def to_mono_16k(samples: np.ndarray, rate: int) -> np.ndarray:
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    if rate == SAMPLE_RATE or mono.size == 0:
+        return mono.astype(np.float32)
+    if rate > SAMPLE_RATE:
+        # Remove content above the new Nyquist frequency first, or it aliases into the speech band.
+        mono = _lowpass(mono, 0.5 * SAMPLE_RATE / rate)
+    count = int(round(mono.size * SAMPLE_RATE / rate))
+    # Linear interpolation by index arithmetic: unlike np.interp this needs no float64 copy of the source grid.
+    positions = np.arange(count, dtype=np.float64) * (rate / SAMPLE_RATE)
+    left = np.minimum(positions.astype(np.int64), mono.size - 1)
+    right = np.minimum(left + 1, mono.size - 1)
+    frac = (positions - left).astype(np.float32)
+    del positions
+    return (mono[left] * (1 - frac) + mono[right] * frac).astype(np.float32, copy=False)
+
+
+# -----------------------------
+# Voice activity
+# -----------------------------
+def speech_regions(samples: np.ndarray) -> List[Tuple[int, int]]:
+    """Sample ranges judged to be speech, padded by ``VAD_PAD_MS`` on each side."""
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    count = samples.size // frame
+    if count == 0:
+        return []
+    frames = samples[: count * frame].reshape(count, frame)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = min(noise_floor + VAD_THRESHOLD_DB, energy_db.max() - VAD_DYNAMIC_RANGE_DB)
+    speech = energy_db > max(threshold, VAD_MIN_SPEECH_DBFS)
+    if not speech.any():
+        return []
+    # Dilate the mask so word onsets, trailing consonants and short dips stay in.
+    pad = max(1, VAD_PAD_MS // VAD_FRAME_MS)
+    speech = np.convolve(speech.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode="same") > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    return [(int(start) * frame, min(int(end) * frame, samples.size)) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def _to_pcm(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def pack_clips(samples: np.ndarray, regions: List[Tuple[int, int]]) -> List[AudioClip]:
+    """Join speech regions with short pauses into clips no longer than ``VAD_MAX_CLIP_S``."""
+    gap = np.zeros(SAMPLE_RATE * VAD_KEEP_SILENCE_MS // 1000, dtype=np.float32)
+    limit = int(VAD_MAX_CLIP_S * SAMPLE_RATE)
+    clips: List[AudioClip] = []
+    parts: List[np.ndarray] = []
+    length = 0
+    for start, end in regions:
+        # Regions longer than a clip are cut at the limit; the rest carries on as its own region.
+        for offset in range(start, end, limit):
+            region = samples[offset:min(end, offset + limit)]
+            if parts and length + gap.size + region.size > limit:
+                clips.append(AudioClip(_to_pcm(np.concatenate(parts))))
+                parts, length = [], 0
+            if parts:
+                parts.append(gap)
+                length += gap.size
+            parts.append(region)
+            length += region.size
+    if parts:
+        clips.append(AudioClip(_to_pcm(np.concatenate(parts))))
+    return clips
+
+
+def preprocess(source: Union[bytes, BinaryIO], max_seconds: float = MAX_AUDIO_SECONDS) -> Preprocessed:
+    """Decode an upload (bytes or a seekable file) into speech-only 16 kHz clips.
+
+    Raises ``AudioTooLong`` or ``ValueError`` as ``decode`` does.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    samples, rate = decode(source, max_seconds)
+    mono = to_mono_16k(samples, rate)
+    return Preprocessed(pack_clips(mono, speech_regions(mono)), mono.size / SAMPLE_RATE)
@@ -0,0 +1,123 @@
+"""Shared async Groq client for reply generation.
+
+One ``AsyncGroq`` client is reused for the whole process. Its httpx pool keeps
+TLS connections alive between requests instead of handshaking for each
+reply. Timeouts are split into connect and read, and the SDK retries
+connection errors, 429s and 5xx responses with exponential backoff, honouring
+``Retry-After``, up to ``GROQ_MAX_RETRIES`` times. If Groq is still unreachable
+the caller gets the old echo-style fallback.
+"""
+import os
+from typing import AsyncIterator, Optional
+
+import httpx
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
+DEFAULT_MAX_TOKENS = int(os.getenv("GROQ_MAX_TOKENS", "500"))
+GROQ_TIMEOUT_S = float(os.getenv("GROQ_TIMEOUT_S", "30"))
+GROQ_CONNECT_TIMEOUT_S = float(os.getenv("GROQ_CONNECT_TIMEOUT_S", "5"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "2"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "32"))
+GROQ_KEEPALIVE_S = float(os.getenv("GROQ_KEEPALIVE_S", "60"))
+
+SYSTEM_PROMPT = "You are a helpful assistant. Respond concisely and in English."
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a voice conversation between a user and an assistant."
+    " Merge the new turns into the existing summary. Keep names, facts, preferences and open"
+    " questions; drop small talk. Reply with the updated summary only, in at most five sentences."
+)
+SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "200"))
+
+_client = None
+
+
+def get_client():
+    """The process-wide client; created on first use inside the running event loop."""
+    global _client
+    if _client is None:
+        from groq import AsyncGroq
+
+        _client = AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            max_retries=GROQ_MAX_RETRIES,
+            timeout=httpx.Timeout(GROQ_TIMEOUT_S, connect=GROQ_CONNECT_TIMEOUT_S),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=GROQ_MAX_CONNECTIONS,
+                    max_keepalive_connections=GROQ_MAX_CONNECTIONS,
+                    keepalive_expiry=GROQ_KEEPALIVE_S,
+                ),
+            ),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def reply_messages(text: str, context: Optional[list] = None) -> list:
+    """System prompt, earlier conversation (summary and recent turns) if any, then the new message."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(context or []),
+        {"role": "user", "content": text.strip()},
+    ]
+
+
+def fallback_reply(text: str) -> str:
+    return f"(fallback) I heard: {text}"
+
+
+def _params(text: str, max_tokens: Optional[int], context: Optional[list]) -> dict:
+    return {
+        "messages": reply_messages(text, context),
+        "model": GROQ_MODEL,
+        "max_tokens": max_tokens if max_tokens is not None else DEFAULT_MAX_TOKENS,
+        "temperature": 0.7,
+        "top_p": 1.0,
+    }
+
+
+async def complete(text: str, max_tokens: Optional[int] = None, context: Optional[list] = None) -> str:
+    try:
+        completion = await get_client().chat.completions.create(**_params(text, max_tokens, context))
+        return completion.choices[0].message.content or ""
+    except Exception as e:
+        print(f"GROQ error: {e}")
+        return fallback_reply(text)
+
+
+async def stream(text: str, max_tokens: Optional[int] = None, context: Optional[list] = None) -> AsyncIterator[str]:
+    """Yield reply tokens as Groq produces them; falls back like ``complete``."""
+    emitted = False
+    try:
+        chunks = await get_client().chat.completions.create(**_params(text, max_tokens, context), stream=True)
+        async for chunk in chunks:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                emitted = True
+                yield delta
+    except Exception as e:
+        print(f"GROQ error: {e}")
+        # Once tokens have gone out the reply is already underway; only fall back from a clean start.
+        if not emitted:
+            yield fallback_reply(text)
+
+
+async def summarize(summary: str, turns: list) -> str:
+    """Fold ``turns`` (``memory.Turn``) into ``summary``. Errors propagate so the caller keeps the turns."""
+    transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+    completion = await get_client().chat.completions.create(
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+        ],
+        model=GROQ_MODEL,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+    )
+    return (completion.choices[0].message.content or "").strip() or summary
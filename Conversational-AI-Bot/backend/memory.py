@@ -0,0 +1,241 @@
+"""Conversation memory for multi-turn voice chats.
+
+Conversations live in an in-memory LRU bounded by ``MEMORY_MAX_CONVERSATIONS``.
+They expire ``MEMORY_TTL_S`` seconds after their last turn. With
+``MEMORY_DB_PATH`` set, every change is also written to SQLite, so
+conversations survive restarts and can be reloaded after they fall out of
+memory.
+
+The prompt never grows without bound. Only the most recent turns that fit in
+``MEMORY_HISTORY_TOKENS`` are sent with a request. Once older turns outside
+that window add up to ``MEMORY_SUMMARIZE_TOKENS``, they are folded into a
+running summary, and the summary is sent in their place. ``MEMORY_MAX_TURNS``
+is a hard cap in case summarization keeps failing.
+
+Methods block (SQLite) and are meant to run on a single-thread executor.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+MEMORY_TTL_S = float(os.getenv("MEMORY_TTL_S", "3600"))
+MEMORY_MAX_CONVERSATIONS = int(os.getenv("MEMORY_MAX_CONVERSATIONS", "1000"))
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", "")
+MEMORY_HISTORY_TOKENS = int(os.getenv("MEMORY_HISTORY_TOKENS", "1200"))
+MEMORY_SUMMARIZE_TOKENS = int(os.getenv("MEMORY_SUMMARIZE_TOKENS", "300"))
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "64"))
+_SWEEP_INTERVAL_S = 60.0
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+@dataclass
+class Turn:
+    role: str
+    content: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.content)
+
+
+@dataclass
+class Conversation:
+    id: str
+    created_at: float
+    updated_at: float
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+    def window_start(self, budget: int = MEMORY_HISTORY_TOKENS) -> int:
+        """Index of the oldest turn that still fits in the history budget."""
+        used = 0
+        for i in range(len(self.turns) - 1, -1, -1):
+            used += self.turns[i].tokens
+            if used > budget:
+                return i + 1
+        return 0
+
+    def context(self) -> List[dict]:
+        """Summary plus recent turns, ready to go between the system prompt and the new message."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        messages.extend({"role": turn.role, "content": turn.content} for turn in self.turns[self.window_start():])
+        return messages
+
+    def overflow(self) -> List[Turn]:
+        """Turns that have left the history window and should be folded into the summary."""
+        return self.turns[: self.window_start()]
+
+    def to_dict(self) -> dict:
+        return {
+            "conversation_id": self.id,
+            "summary": self.summary,
+            "turns": [{"role": turn.role, "content": turn.content} for turn in self.turns],
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class ConversationStore:
+    def __init__(
+        self,
+        ttl_s: float = MEMORY_TTL_S,
+        max_conversations: int = MEMORY_MAX_CONVERSATIONS,
+        db_path: str = MEMORY_DB_PATH,
+    ) -> None:
+        self.ttl_s = ttl_s
+        self.max_conversations = max_conversations
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._swept_at = 0.0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY, summary TEXT NOT NULL, turns TEXT NOT NULL,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_conversations_updated_at ON conversations (updated_at)")
+            self._db.commit()
+
+    # ---- persistence ----
+    def _persist(self, conversation: Conversation) -> None:
+        if self._db is None:
+            return
+        turns = json.dumps([[turn.role, turn.content] for turn in conversation.turns])
+        self._db.execute(
+            "INSERT INTO conversations (id, summary, turns, created_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET summary = excluded.summary, turns = excluded.turns,"
+            " updated_at = excluded.updated_at",
+            (conversation.id, conversation.summary, turns, conversation.created_at, conversation.updated_at),
+        )
+        self._db.commit()
+
+    def _load(self, conversation_id: str) -> Optional[Conversation]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT summary, turns, created_at, updated_at FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        summary, turns, created_at, updated_at = row
+        return Conversation(conversation_id, created_at, updated_at, summary, [Turn(*turn) for turn in json.loads(turns)])
+
+    # ---- eviction ----
+    def _expired(self, conversation: Conversation, now: float) -> bool:
+        return now - conversation.updated_at > self.ttl_s
+
+    def _evict(self, now: float) -> None:
+        # The cache is ordered by last activity, so expired entries are all at the front.
+        while self._cache:
+            oldest = next(iter(self._cache.values()))
+            if not self._expired(oldest, now) and len(self._cache) <= self.max_conversations:
+                break
+            # Over capacity only drops the in-memory copy; a persisted conversation can still be reloaded.
+            self._cache.popitem(last=False)
+        if self._db is not None and now - self._swept_at > _SWEEP_INTERVAL_S:
+            self._swept_at = now
+            self._db.execute("DELETE FROM conversations WHERE updated_at < ?", (now - self.ttl_s,))
+            self._db.commit()
+
+    def _get(self, conversation_id: str, now: float) -> Optional[Conversation]:
+        conversation = self._cache.get(conversation_id)
+        if conversation is not None:
+            return None if self._expired(conversation, now) else conversation
+        conversation = self._load(conversation_id)
+        if conversation is None or self._expired(conversation, now):
+            return None
+        self._cache[conversation_id] = conversation
+        # A reload adds an entry, so trim back to max_conversations (never the entry just loaded).
+        self._cache.move_to_end(conversation_id)
+        self._evict(now)
+        return conversation
+
+    # ---- API ----
+    def create(self) -> Conversation:
+        now = time.time()
+        conversation = Conversation(uuid.uuid4().hex, now, now)
+        with self._lock:
+            self._cache[conversation.id] = conversation
+            self._persist(conversation)
+            self._evict(now)
+        return conversation
+
+    def snapshot(self, conversation_id: str) -> Optional[dict]:
+        with self._lock:
+            conversation = self._get(conversation_id, time.time())
+            return conversation.to_dict() if conversation else None
+
+    def context(self, conversation_id: str) -> Optional[List[dict]]:
+        with self._lock:
+            conversation = self._get(conversation_id, time.time())
+            return conversation.context() if conversation else None
+
+    def append(self, conversation_id: str, *turns: Turn) -> Optional[Conversation]:
+        now = time.time()
+        with self._lock:
+            conversation = self._get(conversation_id, now)
+            if conversation is None:
+                return None
+            conversation.turns.extend(turns)
+            del conversation.turns[:-MEMORY_MAX_TURNS]
+            conversation.updated_at = now
+            self._cache.move_to_end(conversation_id)
+            self._persist(conversation)
+            self._evict(now)
+            return conversation
+
+    def pending_overflow(self, conversation_id: str) -> List[Turn]:
+        """Turns to fold into the summary, or an empty list while there are too few to bother."""
+        with self._lock:
+            conversation = self._get(conversation_id, time.time())
+            if conversation is None:
+                return []
+            overflow = conversation.overflow()
+            return overflow if sum(turn.tokens for turn in overflow) >= MEMORY_SUMMARIZE_TOKENS else []
+
+    def fold(self, conversation_id: str, summary: str, folded: List[Turn]) -> None:
+        """Replace ``folded`` (the oldest turns) with ``summary``. Turns added meanwhile are kept."""
+        with self._lock:
+            conversation = self._get(conversation_id, time.time())
+            if conversation is None or conversation.turns[: len(folded)] != folded:
+                return  # expired, or the history changed underneath the summarizer
+            conversation.summary = summary
+            del conversation.turns[: len(folded)]
+            self._persist(conversation)
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            found = self._cache.pop(conversation_id, None) is not None
+            if self._db is not None:
+                found = self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0 or found
+                self._db.commit()
+            return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "max_conversations": self.max_conversations,
+                "ttl_s": self.ttl_s,
+                "persistent": self._db is not None,
+            }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
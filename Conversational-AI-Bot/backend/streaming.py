@@ -0,0 +1,79 @@
+"""Helpers for the streaming voice pipeline.
+
+``SentenceChunker`` cuts an LLM token stream into sentences so speech
+synthesis can start before the reply is complete. ``iterate_in_executor``
+runs a blocking generator (the sentence-by-sentence TTS of a reply) on a
+thread pool and exposes it as an async iterator.
+"""
+import asyncio
+import re
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+# Fragments shorter than this are held back and joined to the next sentence,
+# so "Hi." or "1." does not become its own TTS request.
+MIN_SENTENCE_CHARS = 12
+
+_BOUNDARY_RE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+class SentenceChunker:
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS) -> None:
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text; return the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _BOUNDARY_RE.finditer(self._buffer):
+            sentence = self._buffer[start:match.start()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+
+_DONE = object()
+
+
+async def iterate_in_executor(executor: Executor, gen_fn: Callable[..., Iterator], *args) -> AsyncIterator:
+    """Drive ``gen_fn(*args)`` on ``executor`` and yield its items on the event loop.
+
+    ``speech_response`` uses it to stream a reply's audio while later sentences
+    are still being synthesized. If the consumer stops early (e.g. the client disconnected) the producer is
+    told to stop at its next item, so it does not keep a worker busy.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in gen_fn(*args):
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:  # re-raised on the loop side
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
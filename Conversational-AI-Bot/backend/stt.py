@@ -0,0 +1,412 @@
+"""Pluggable speech-to-text backends with micro-batched decoding.
+
+``STT_BACKEND`` selects the engine:
+
+- ``google``: Google Web Speech via ``speech_recognition``. This is the
+  original path; it needs the network and decodes one clip per request.
+- ``whisper``: local CPU faster-whisper (CTranslate2, int8 by default). Clips
+  up to 30 s that arrive together are decoded in one batched ``generate`` call.
+- ``vosk``: local Kaldi model from ``VOSK_MODEL_PATH``; clips in a batch
+  share the loaded model, and streams are decoded natively as audio arrives.
+
+Uploads reach the backends as speech-only 16 kHz clips (see ``audio.py``).
+The model is loaded once (at startup when possible). Concurrent requests are
+gathered for up to ``STT_BATCH_WINDOW_MS`` into batches of at most
+``STT_MAX_BATCH`` clips. Every result reports its real-time factor (decode
+time / audio time).
+"""
+import abc
+import asyncio
+import importlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "en-US")
+STT_BATCH_WINDOW_MS = float(os.getenv("STT_BATCH_WINDOW_MS", "15"))
+STT_MAX_BATCH = int(os.getenv("STT_MAX_BATCH", "8"))
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base.en")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_THREADS = int(os.getenv("WHISPER_THREADS", "0"))
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk")
+# Local engines without native streaming decode the recent audio this often to emit partials.
+STT_STREAM_PARTIAL_S = float(os.getenv("STT_STREAM_PARTIAL_S", "1.5"))
+# Longest stretch of audio one partial decode covers; older audio is committed and not decoded again.
+STT_STREAM_WINDOW_S = float(os.getenv("STT_STREAM_WINDOW_S", "10"))
+
+SAMPLE_RATE = 16000
+UNINTELLIGIBLE = "Could not understand audio"
+
+
+@dataclass
+class AudioClip:
+    """16 kHz mono signed 16-bit little-endian PCM."""
+
+    pcm: bytes
+    sample_rate: int = SAMPLE_RATE
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / 2 / self.sample_rate
+
+    def samples(self):
+        import numpy as np
+
+        return np.frombuffer(self.pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+@dataclass
+class STTResult:
+    text: str
+    engine: str
+    audio_seconds: float
+    decode_seconds: float
+    batch_size: int
+
+    @property
+    def rtf(self) -> float:
+        return self.decode_seconds / self.audio_seconds if self.audio_seconds else 0.0
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+class STTBackend(abc.ABC):
+    name = "base"
+    max_batch = 1
+    # Seconds of new audio between partial transcripts while streaming; None disables partials.
+    partial_interval_s: Optional[float] = None
+
+    def load(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def transcribe_batch(self, clips: List[AudioClip]) -> List[str]:
+        """One transcript per clip, in order; ``UNINTELLIGIBLE`` when nothing was recognised."""
+
+    def open_stream(self) -> "BufferedStream":
+        return BufferedStream(self)
+
+
+class BufferedStream:
+    """Incremental recognition for engines without a native streaming API.
+
+    Audio is accumulated as it arrives. When partials are enabled, ``partial``
+    decodes only the audio since the last committed segment; once that reaches
+    ``STT_STREAM_WINDOW_S`` its text is committed, so each partial costs at most
+    one window however long the utterance gets. ``finish`` decodes the whole
+    buffer once. Methods block and are meant to run on the STT executor; one
+    ``partial`` at a time may overlap ``accept`` on another thread.
+    """
+
+    def __init__(self, backend: STTBackend) -> None:
+        self.backend = backend
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._last_partial = 0.0
+        self._committed: List[str] = []
+        self._committed_bytes = 0
+
+    @property
+    def duration(self) -> float:
+        return len(self._buffer) / 2 / SAMPLE_RATE
+
+    def accept(self, pcm: bytes) -> Optional[str]:
+        """Add audio; engines with native streaming return a partial transcript here."""
+        with self._lock:
+            self._buffer.extend(pcm)
+        return None
+
+    def partial_due(self) -> bool:
+        interval = self.backend.partial_interval_s
+        return interval is not None and self.duration - self._last_partial >= interval
+
+    def partial(self) -> Optional[str]:
+        with self._lock:
+            self._last_partial = self.duration
+            start = self._committed_bytes
+            tail = bytes(self._buffer[start:])
+        clip = AudioClip(tail)
+        text = self.backend.transcribe_batch([clip])[0]
+        if text == UNINTELLIGIBLE:
+            text = ""
+        parts = self._committed + ([text] if text else [])
+        if clip.duration >= STT_STREAM_WINDOW_S:
+            self._committed, self._committed_bytes = parts, start + len(tail)
+        return " ".join(parts) or None
+
+    def finish(self) -> STTResult:
+        with self._lock:
+            clip = AudioClip(bytes(self._buffer))
+        started = time.perf_counter()
+        text = self.backend.transcribe_batch([clip])[0] if self._buffer else UNINTELLIGIBLE
+        return STTResult(text, self.backend.name, clip.duration, time.perf_counter() - started, 1)
+
+
+class GoogleBackend(STTBackend):
+    name = "google"
+
+    def transcribe_batch(self, clips: List[AudioClip]) -> List[str]:
+        import speech_recognition as sr
+
+        r = sr.Recognizer()
+        texts = []
+        for clip in clips:
+            try:
+                texts.append(r.recognize_google(sr.AudioData(clip.pcm, clip.sample_rate, 2), language=STT_LANGUAGE))
+            except sr.UnknownValueError:
+                texts.append(UNINTELLIGIBLE)
+            except sr.RequestError as e:
+                raise RuntimeError(f"Speech API error: {e}")
+        return texts
+
+
+class WhisperBackend(STTBackend):
+    name = "whisper"
+    max_batch = STT_MAX_BATCH
+    partial_interval_s = STT_STREAM_PARTIAL_S
+    _WINDOW_SECONDS = 30.0
+
+    def __init__(self) -> None:
+        self._model = None
+        self._tokenizer = None
+
+    def load(self) -> None:
+        from faster_whisper import WhisperModel
+        from faster_whisper.tokenizer import Tokenizer
+
+        self._model = WhisperModel(
+            WHISPER_MODEL, device="cpu", compute_type=WHISPER_COMPUTE_TYPE, cpu_threads=WHISPER_THREADS
+        )
+        self._tokenizer = Tokenizer(
+            self._model.hf_tokenizer,
+            self._model.model.is_multilingual,
+            task="transcribe",
+            language=STT_LANGUAGE.split("-")[0],
+        )
+
+    def transcribe_batch(self, clips: List[AudioClip]) -> List[str]:
+        texts: List[Optional[str]] = [None] * len(clips)
+        short = [i for i, clip in enumerate(clips) if clip.duration <= self._WINDOW_SECONDS]
+        if len(short) > 1:
+            try:
+                for i, text in zip(short, self._generate([clips[i] for i in short])):
+                    texts[i] = text
+            except Exception as e:
+                print(f"Batched whisper decode failed, decoding clips one by one: {e}")
+        for i, clip in enumerate(clips):
+            if texts[i] is None:
+                segments, _ = self._model.transcribe(clip.samples(), language=self._tokenizer.language_code, beam_size=1)
+                texts[i] = " ".join(segment.text.strip() for segment in segments)
+        return [text or UNINTELLIGIBLE for text in texts]
+
+    def _generate(self, clips: List[AudioClip]) -> List[str]:
+        """One encoder/decoder pass for several sub-30 s clips, each padded to a full window."""
+        import numpy as np
+        from faster_whisper.audio import pad_or_trim
+
+        frames = self._model.feature_extractor.nb_max_frames
+        features = np.stack(
+            [pad_or_trim(self._model.feature_extractor(clip.samples()), frames) for clip in clips]
+        )
+        encoded = self._model.encode(features)
+        prompt = list(self._tokenizer.sot_sequence) + [self._tokenizer.no_timestamps]
+        results = self._model.model.generate(encoded, [prompt] * len(clips), beam_size=1, max_length=224)
+        eot = self._tokenizer.eot
+        return [
+            self._tokenizer.decode([token for token in result.sequences_ids[0] if token < eot]).strip()
+            for result in results
+        ]
+
+
+class VoskBackend(STTBackend):
+    name = "vosk"
+    max_batch = STT_MAX_BATCH
+
+    def __init__(self) -> None:
+        self._model = None
+
+    def load(self) -> None:
+        from vosk import Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self._model = Model(VOSK_MODEL_PATH)
+
+    def transcribe_batch(self, clips: List[AudioClip]) -> List[str]:
+        from vosk import KaldiRecognizer
+
+        texts = []
+        for clip in clips:
+            recognizer = KaldiRecognizer(self._model, clip.sample_rate)
+            recognizer.AcceptWaveform(clip.pcm)
+            texts.append(json.loads(recognizer.FinalResult()).get("text") or UNINTELLIGIBLE)
+        return texts
+
+    def open_stream(self) -> "VoskStream":
+        return VoskStream(self)
+
+
+class VoskStream(BufferedStream):
+    """Native streaming: each chunk advances the Kaldi decoder, so finishing costs only the tail."""
+
+    def __init__(self, backend: VoskBackend) -> None:
+        super().__init__(backend)
+        from vosk import KaldiRecognizer
+
+        self._recognizer = KaldiRecognizer(backend._model, SAMPLE_RATE)
+        self._segments: List[str] = []
+        self._bytes = 0
+
+    @property
+    def duration(self) -> float:
+        return self._bytes / 2 / SAMPLE_RATE
+
+    def accept(self, pcm: bytes) -> Optional[str]:
+        self._bytes += len(pcm)
+        if self._recognizer.AcceptWaveform(pcm):
+            segment = json.loads(self._recognizer.Result()).get("text")
+            if segment:
+                self._segments.append(segment)
+            return " ".join(self._segments) or None
+        partial = json.loads(self._recognizer.PartialResult()).get("partial")
+        return " ".join(self._segments + [partial]) if partial else None
+
+    def finish(self) -> STTResult:
+        started = time.perf_counter()
+        tail = json.loads(self._recognizer.FinalResult()).get("text")
+        text = " ".join(self._segments + ([tail] if tail else [])) or UNINTELLIGIBLE
+        return STTResult(text, self.backend.name, self.duration, time.perf_counter() - started, 1)
+
+
+BACKENDS = {"google": GoogleBackend, "whisper": WhisperBackend, "vosk": VoskBackend}
+
+
+# -----------------------------
+# Micro-batching
+# -----------------------------
+class STTStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.audio_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def record(self, batch_size: int, audio_seconds: float, decode_seconds: float) -> None:
+        with self._lock:
+            self.requests += batch_size
+            self.batches += 1
+            self.audio_seconds += audio_seconds
+            self.decode_seconds += decode_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "audio_seconds": round(self.audio_seconds, 2),
+                "decode_seconds": round(self.decode_seconds, 2),
+                "rtf": round(self.decode_seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+            }
+
+
+class BatchingTranscriber:
+    """Collects concurrent requests for a short window and decodes them together."""
+
+    def __init__(self, backend: STTBackend, executor: Executor, max_in_flight: int) -> None:
+        self.backend = backend
+        self.executor = executor
+        self.stats = STTStats()
+        self._queue: "asyncio.Queue[Tuple[AudioClip, asyncio.Future]]" = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._worker: Optional[asyncio.Task] = None
+
+    async def transcribe(self, clip: AudioClip) -> STTResult:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((clip, future))
+        return await future
+
+    async def transcribe_clips(self, clips: List[AudioClip]) -> STTResult:
+        """Transcribe the speech segments of one utterance and join them in order."""
+        if not clips:
+            return STTResult(UNINTELLIGIBLE, self.backend.name, 0.0, 0.0, 0)
+        results = await asyncio.gather(*(self.transcribe(clip) for clip in clips))
+        texts = [result.text for result in results if result.text != UNINTELLIGIBLE]
+        return STTResult(
+            " ".join(texts) or UNINTELLIGIBLE,
+            self.backend.name,
+            sum(result.audio_seconds for result in results),
+            sum(result.decode_seconds for result in results),
+            max(result.batch_size for result in results),
+        )
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + STT_BATCH_WINDOW_MS / 1000
+            while len(batch) < self.backend.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[AudioClip, asyncio.Future]]) -> None:
+        clips = [clip for clip, _ in batch]
+        try:
+            started = time.perf_counter()
+            texts = await asyncio.get_running_loop().run_in_executor(self.executor, self.backend.transcribe_batch, clips)
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        total_audio = sum(clip.duration for clip in clips)
+        self.stats.record(len(clips), total_audio, elapsed)
+        for (clip, future), text in zip(batch, texts):
+            # Batch time is shared out in proportion to each clip's length.
+            share = elapsed * (clip.duration / total_audio) if total_audio else elapsed / len(clips)
+            if not future.done():
+                future.set_result(STTResult(text, self.backend.name, clip.duration, share, len(clips)))
+
+
+_backend: Optional[STTBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> STTBackend:
+    """Instantiate and load the configured backend once per process."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if ":" in STT_BACKEND:
+                    # "module:attr" plugs in an out-of-tree backend, e.g. the bench stand-in.
+                    module, attr = STT_BACKEND.split(":", 1)
+                    backend = getattr(importlib.import_module(module), attr)()
+                elif STT_BACKEND in BACKENDS:
+                    backend = BACKENDS[STT_BACKEND]()
+                else:
+                    raise RuntimeError(f"Unknown STT_BACKEND {STT_BACKEND!r}; choose from {', '.join(BACKENDS)}")
+                started = time.perf_counter()
+                backend.load()
+                print(f"STT backend {backend.name} ready in {time.perf_counter() - started:.2f}s")
+                _backend = backend
+    return _backend
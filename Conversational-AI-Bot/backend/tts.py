@@ -0,0 +1,267 @@
+"""Text-to-speech engines behind a content-addressed phrase cache.
+
+``TTS_ENGINE`` selects the synthesizer:
+
+- ``gtts``: Google Translate TTS via ``gTTS`` (network, MP3). ``TTS_VOICE`` is
+  the Google domain that sets the accent, e.g. ``com`` or ``co.uk``.
+- ``espeak``: the local ``espeak-ng`` (or ``espeak``) binary (offline, WAV).
+  ``TTS_VOICE`` is an espeak voice such as ``en-us``.
+
+Text is split into sentences. Each sentence is stored on disk under the SHA-256
+of (engine, voice, language, text), and replies are stitched together from
+these pieces, so repeated phrases cost a file read and only novel sentences are
+synthesized. The store is an LRU bounded by ``TTS_CACHE_MAX_MB``; file mtimes
+carry recency across restarts.
+"""
+import abc
+import hashlib
+import importlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from streaming import SentenceChunker
+
+TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts")
+TTS_LANG = os.getenv("TTS_LANG", "en")
+TTS_VOICE = os.getenv("TTS_VOICE", "")
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "tts_cache"))
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "256"))
+ESPEAK_RATE = int(os.getenv("ESPEAK_RATE", "170"))
+
+
+# -----------------------------
+# Engines
+# -----------------------------
+class TTSEngine(abc.ABC):
+    name = "base"
+    format = "mp3"
+    media_type = "audio/mpeg"
+    voice = ""
+
+    @abc.abstractmethod
+    def synthesize(self, text: str) -> bytes:
+        """Audio for ``text`` in this engine's ``format``."""
+
+
+class GTTSEngine(TTSEngine):
+    name = "gtts"
+
+    def __init__(self) -> None:
+        self.voice = TTS_VOICE or "com"
+
+    def synthesize(self, text: str) -> bytes:
+        from gtts import gTTS
+
+        return b"".join(gTTS(text=text, lang=TTS_LANG, tld=self.voice).stream())
+
+
+class EspeakEngine(TTSEngine):
+    name = "espeak"
+    format = "wav"
+    media_type = "audio/wav"
+
+    def __init__(self) -> None:
+        self.voice = TTS_VOICE or TTS_LANG
+        self._binary = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def synthesize(self, text: str) -> bytes:
+        if self._binary is None:
+            raise RuntimeError("TTS_ENGINE=espeak needs espeak-ng or espeak on PATH")
+        # Text goes through stdin so it is never parsed as command-line options.
+        proc = subprocess.run(
+            [self._binary, "--stdout", "-v", self.voice, "-s", str(ESPEAK_RATE)],
+            input=text.encode("utf-8"),
+            capture_output=True,
+            check=True,
+            timeout=60,
+        )
+        # espeak streams a WAV header with placeholder sizes; rewrite it so the cached file is valid.
+        return stitch([proc.stdout], "wav")
+
+
+ENGINES = {"gtts": GTTSEngine, "espeak": EspeakEngine}
+
+
+def stitch(parts: List[bytes], fmt: str) -> bytes:
+    """Join per-sentence audio into one file."""
+    if fmt == "mp3":
+        # MP3 is a sequence of self-contained frames, so parts concatenate cleanly (gTTS does the same).
+        return b"".join(parts)
+    out = io.BytesIO()
+    writer = None
+    for part in parts:
+        with wave.open(io.BytesIO(part)) as reader:
+            if writer is None:
+                writer = wave.open(out, "wb")
+                writer.setparams(reader.getparams())
+            writer.writeframes(reader.readframes(reader.getnframes()))
+    if writer is not None:
+        writer.close()
+    return out.getvalue()
+
+
+def split_sentences(text: str) -> List[str]:
+    chunker = SentenceChunker()
+    sentences = chunker.feed(" ".join(text.split()))
+    tail = chunker.flush()
+    return sentences + [tail] if tail else sentences
+
+
+# -----------------------------
+# Phrase cache
+# -----------------------------
+class PhraseCache:
+    """Disk-backed LRU of synthesized sentences, bounded by total bytes."""
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, name: str) -> Path:
+        return self.root / name[:2] / name
+
+    def _load(self) -> None:
+        # Oldest mtime first, so the existing store resumes in LRU order.
+        files = []
+        for path in self.root.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            self._path(name).unlink(missing_ok=True)
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = self._path(name)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self._bytes -= self._entries.pop(name, 0)
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class Speaker:
+    """Sentence-level synthesis through the phrase cache. Methods block; run them on the TTS pool."""
+
+    def __init__(self, engine: TTSEngine, cache: Optional[PhraseCache]) -> None:
+        self.engine = engine
+        self.cache = cache
+
+    def _key(self, sentence: str) -> str:
+        raw = "\0".join((self.engine.name, self.engine.voice, TTS_LANG, sentence))
+        return f"{hashlib.sha256(raw.encode('utf-8')).hexdigest()}.{self.engine.format}"
+
+    def sentence_audio(self, sentence: str) -> bytes:
+        if self.cache is None:
+            return self.engine.synthesize(sentence)
+        key = self._key(sentence)
+        data = self.cache.get(key)
+        if data is None:
+            data = self.engine.synthesize(sentence)
+            self.cache.put(key, data)
+        return data
+
+    def stream(self, text: str) -> Iterator[bytes]:
+        """Yield audio as sentences become available.
+
+        MP3 goes out sentence by sentence. A WAV header has to state the total
+        length, so WAV replies are stitched first and sent as one piece.
+        """
+        sentences = split_sentences(text)
+        if self.engine.format == "mp3":
+            for sentence in sentences:
+                yield self.sentence_audio(sentence)
+        elif sentences:
+            yield stitch([self.sentence_audio(sentence) for sentence in sentences], self.engine.format)
+
+    def synthesize(self, text: str) -> bytes:
+        return stitch([self.sentence_audio(sentence) for sentence in split_sentences(text)], self.engine.format)
+
+    def stats(self) -> dict:
+        return {"engine": self.engine.name, "voice": self.engine.voice, "cache": self.cache.snapshot() if self.cache else None}
+
+
+_speaker: Optional[Speaker] = None
+_speaker_lock = threading.Lock()
+
+
+def get_speaker() -> Speaker:
+    global _speaker
+    if _speaker is None:
+        with _speaker_lock:
+            if _speaker is None:
+                if ":" in TTS_ENGINE:
+                    # "module:attr" plugs in an out-of-tree engine, e.g. the bench stand-in.
+                    module, attr = TTS_ENGINE.split(":", 1)
+                    engine = getattr(importlib.import_module(module), attr)()
+                elif TTS_ENGINE in ENGINES:
+                    engine = ENGINES[TTS_ENGINE]()
+                else:
+                    raise RuntimeError(f"Unknown TTS_ENGINE {TTS_ENGINE!r}; choose from {', '.join(ENGINES)}")
+                max_bytes = int(TTS_CACHE_MAX_MB * 1024 * 1024)
+                cache = PhraseCache(TTS_CACHE_DIR, max_bytes) if max_bytes > 0 else None
+                _speaker = Speaker(engine, cache)
+    return _speaker
@@ -0,0 +1,89 @@
+"""Request size limits for audio uploads.
+
+Starlette's multipart parser already spools each uploaded file into a
+``SpooledTemporaryFile``. The file stays in memory up to ``UPLOAD_SPOOL_MB``
+and moves to disk beyond that, so handlers read it from ``UploadFile.file``
+in blocks instead of calling ``await file.read()``. ``BodySizeLimit`` caps the
+request body at ``MAX_UPLOAD_MB``. It rejects a declared ``Content-Length``
+up front and stops chunked bodies as soon as they cross the limit, so an
+oversized upload is never fully received or written to disk.
+"""
+import json
+import os
+
+from fastapi import HTTPException
+from starlette.formparsers import MultiPartParser
+
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "25"))
+UPLOAD_SPOOL_MB = float(os.getenv("UPLOAD_SPOOL_MB", "1"))
+
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+def configure_spooling() -> None:
+    """Set the size at which Starlette moves an uploaded file from memory to a temporary file.
+
+    FastAPI parses ``File(...)`` parameters itself and offers no per-request
+    spool size, so this sets the parser's class default. It is called from the
+    app's lifespan rather than on import, so merely importing this module does
+    not change Starlette for other apps in the process.
+    """
+    MultiPartParser.max_file_size = int(UPLOAD_SPOOL_MB * 1024 * 1024)
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(status_code=413, detail=f"Upload exceeds the {max_bytes / 1024 / 1024:g} MB limit")
+
+
+class BodySizeLimit:
+    """ASGI middleware that rejects HTTP request bodies larger than ``max_bytes`` with 413."""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # An HTTPException passes through FastAPI's body parsing unchanged and becomes the 413.
+                    raise UploadTooLarge(self.max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            # Raised outside a route's body parsing (e.g. a handler streaming request.stream()).
+            if response_started:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": UploadTooLarge(self.max_bytes).detail}).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
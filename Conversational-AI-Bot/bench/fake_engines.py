@@ -0,0 +1,46 @@
+"""Stand-in STT and TTS engines with configurable latency, for benchmarks.
+
+The backend loads them through its ``module:attr`` plug-in hook:
+
+    STT_BACKEND=bench.fake_engines:FakeSTT
+    TTS_ENGINE=bench.fake_engines:FakeTTS
+
+They sleep instead of working, so a run measures the server's own overhead and
+scheduling around a known engine cost. They import the backend's ``stt`` and
+``tts`` modules and only work inside the backend process.
+"""
+import os
+import time
+from typing import List
+
+import stt
+import tts
+
+# STT cost: a fixed cost per batch plus FAKE_STT_RTF seconds per second of speech.
+FAKE_STT_BASE_MS = float(os.getenv("FAKE_STT_BASE_MS", "80"))
+FAKE_STT_RTF = float(os.getenv("FAKE_STT_RTF", "0.05"))
+FAKE_STT_MAX_BATCH = int(os.getenv("FAKE_STT_MAX_BATCH", "8"))
+# TTS cost: a fixed cost per sentence (a request to the engine) plus a cost per character.
+FAKE_TTS_BASE_MS = float(os.getenv("FAKE_TTS_BASE_MS", "120"))
+FAKE_TTS_MS_PER_CHAR = float(os.getenv("FAKE_TTS_MS_PER_CHAR", "1.5"))
+
+# About 15 characters of speech per second at 32 kbit/s.
+_MP3_BYTES_PER_CHAR = 4000 // 15
+
+
+class FakeSTT(stt.STTBackend):
+    name = "fake"
+    max_batch = FAKE_STT_MAX_BATCH
+
+    def transcribe_batch(self, clips: List[stt.AudioClip]) -> List[str]:
+        # A batched engine pays the fixed cost once and the per-second cost for every clip.
+        time.sleep(FAKE_STT_BASE_MS / 1000 + FAKE_STT_RTF * sum(clip.duration for clip in clips))
+        return [f"Please answer a benchmark question about {clip.duration:.1f} seconds of speech." for clip in clips]
+
+
+class FakeTTS(tts.TTSEngine):
+    name = "fake"
+
+    def synthesize(self, text: str) -> bytes:
+        time.sleep((FAKE_TTS_BASE_MS + FAKE_TTS_MS_PER_CHAR * len(text)) / 1000)
+        return bytes(len(text) * _MP3_BYTES_PER_CHAR)
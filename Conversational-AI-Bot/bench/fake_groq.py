@@ -0,0 +1,103 @@
+"""Local OpenAI/Groq-compatible chat completions server for benchmarks.
+
+Serves ``POST /openai/v1/chat/completions`` (the path the Groq SDK calls) with
+a configurable time-to-first-token and token rate, streamed or not. Point the
+backend at it with ``GROQ_BASE_URL=http://127.0.0.1:<port>``.
+
+    python -m bench.fake_groq --port 9137 --ttft-ms 200 --tokens-per-sec 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TTFT_MS = float(os.getenv("FAKE_GROQ_TTFT_MS", "200"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_GROQ_TOKENS_PER_SEC", "300"))
+COMPLETION_TOKENS = int(os.getenv("FAKE_GROQ_COMPLETION_TOKENS", "60"))
+JITTER = float(os.getenv("FAKE_GROQ_JITTER", "0.1"))
+# Words per sentence, so replies split into several TTS sentences like real ones.
+SENTENCE_WORDS = 12
+
+app = FastAPI(title="Fake Groq")
+_WORDS = "sure the voice pipeline answers quickly when every stage overlaps with the next one".split()
+
+
+def _delay(seconds: float) -> float:
+    return max(0.0, seconds * random.uniform(1 - JITTER, 1 + JITTER))
+
+
+def _reply_words(n_tokens: int) -> list:
+    words = [random.choice(_WORDS) for _ in range(n_tokens)]
+    for i in range(SENTENCE_WORDS - 1, n_tokens, SENTENCE_WORDS):
+        words[i] += "."
+    words[-1] = words[-1].rstrip(".") + "."
+    return words
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    n_tokens = max(1, min(COMPLETION_TOKENS, body.get("max_tokens") or COMPLETION_TOKENS))
+    words = _reply_words(n_tokens)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens}
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    if body.get("stream"):
+        async def events():
+            await asyncio.sleep(_delay(TTFT_MS / 1000))
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1.0 / TOKENS_PER_SEC)
+            done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(TTFT_MS / 1000 + n_tokens / TOKENS_PER_SEC))
+    return JSONResponse({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def main() -> None:
+    global TTFT_MS, TOKENS_PER_SEC, COMPLETION_TOKENS
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9137)
+    parser.add_argument("--ttft-ms", type=float, default=TTFT_MS)
+    parser.add_argument("--tokens-per-sec", type=float, default=TOKENS_PER_SEC)
+    parser.add_argument("--completion-tokens", type=int, default=COMPLETION_TOKENS)
+    args = parser.parse_args()
+    TTFT_MS, TOKENS_PER_SEC, COMPLETION_TOKENS = args.ttft_ms, args.tokens_per_sec, args.completion_tokens
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""WAV fixtures for the voice pipeline benchmark.
+
+Real recordings can be passed to ``bench.run --fixtures DIR``. Without them,
+speech-like clips are synthesized: voiced syllables (a gliding pitch with
+harmonics) separated by short and long pauses, over a low noise floor. The
+backend's VAD keeps the syllables and shortens the pauses, so they load the
+pipeline like an utterance of the same length. Output is deterministic per
+length.
+"""
+import array
+import math
+import random
+import wave
+from pathlib import Path
+from typing import List
+
+SAMPLE_RATE = 16000
+DEFAULT_LENGTHS_S = (1.0, 3.0, 8.0, 20.0)
+
+
+def speech_like(seconds: float, seed: int = 0) -> bytes:
+    """16-bit mono PCM at 16 kHz."""
+    rng = random.Random(seed)
+    total = int(seconds * SAMPLE_RATE)
+    samples = array.array("h", (int(rng.gauss(0, 20)) for _ in range(total)))
+    pos = int(0.2 * SAMPLE_RATE)  # leading silence
+    while pos < total - int(0.2 * SAMPLE_RATE):
+        length = min(int(rng.uniform(0.12, 0.3) * SAMPLE_RATE), total - pos)
+        pitch = rng.uniform(100, 220)
+        glide = rng.uniform(-0.3, 0.3)
+        phase = 0.0
+        for i in range(length):
+            envelope = math.sin(math.pi * i / length)
+            phase += 2 * math.pi * pitch * (1 + glide * i / length) / SAMPLE_RATE
+            voiced = math.sin(phase) + 0.5 * math.sin(2 * phase) + 0.25 * math.sin(3 * phase)
+            samples[pos + i] = max(-32768, min(32767, samples[pos + i] + int(6000 * envelope * voiced)))
+        # Mostly short gaps between syllables, sometimes a pause between phrases.
+        pos += length + int((rng.uniform(0.05, 0.12) if rng.random() < 0.85 else rng.uniform(0.4, 0.8)) * SAMPLE_RATE)
+    return samples.tobytes()
+
+
+def write_wav(path: Path, pcm: bytes) -> None:
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(SAMPLE_RATE)
+        out.writeframes(pcm)
+
+
+def ensure_fixtures(directory: Path, lengths_s=DEFAULT_LENGTHS_S) -> List[Path]:
+    """Synthesize any missing fixtures into ``directory`` and return their paths, shortest first."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for seconds in sorted(lengths_s):
+        path = directory / f"speech_{seconds:g}s.wav"
+        if not path.exists():
+            write_wav(path, speech_like(seconds, seed=int(seconds * 1000)))
+        paths.append(path)
+    return paths
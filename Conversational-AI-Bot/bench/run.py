@@ -0,0 +1,378 @@
+"""Voice pipeline benchmark.
+
+Boots the fake Groq server and the real backend with stand-in STT and TTS
+engines (``bench/fake_engines.py``), each with a configurable delay. WAV
+fixtures are replayed as multi-turn conversations at several concurrency
+levels. The harness reports end-to-end latency, time to first audio, and a
+per-stage breakdown taken from the backend's ``Server-Timing`` header (HTTP)
+or ``done`` message (WebSocket). Results are written as JSON named after the
+current commit, so runs can be compared.
+
+    python -m bench.run                                   # /converse at 1, 8 and 32 conversations
+    python -m bench.run --modes http,ws --turns 3
+    python -m bench.run --fixtures ~/recordings --stt-rtf 0.3 --tts-base-ms 400
+
+WebSocket turns send the whole utterance at once instead of in real time, so
+their latency is counted from the ``end`` message, as the backend does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from bench.fixtures import SAMPLE_RATE, ensure_fixtures
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# 100 ms of 16 kHz 16-bit mono per WebSocket frame, like a browser recorder.
+WS_FRAME_BYTES = SAMPLE_RATE // 10 * 2
+
+
+@dataclass
+class Fixture:
+    name: str
+    data: bytes
+    seconds: float
+    # Raw PCM for WebSocket turns; None unless the file is 16 kHz mono 16-bit.
+    pcm: Optional[bytes]
+
+
+def load_fixture(path: Path) -> Fixture:
+    data = path.read_bytes()
+    seconds, pcm = 0.0, None
+    try:
+        with wave.open(str(path), "rb") as reader:
+            seconds = reader.getnframes() / reader.getframerate()
+            if (reader.getnchannels(), reader.getsampwidth(), reader.getframerate()) == (1, 2, SAMPLE_RATE):
+                pcm = reader.readframes(reader.getnframes())
+    except (wave.Error, EOFError):
+        pass  # compressed formats still go to /converse; the backend decodes them
+    return Fixture(path.name, data, seconds, pcm)
+
+
+class Recorder:
+    """Latency samples (ms) for one mode at one concurrency level."""
+
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+        self.stages: Dict[str, List[float]] = {}
+        self.by_fixture: Dict[str, Dict[str, List[float]]] = {}
+        self.fixture_seconds: Dict[str, float] = {}
+        self.turns = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def record(self, fixture: Fixture, e2e_ms: float, ttfa_ms: Optional[float], stages: Dict[str, float]) -> None:
+        self.turns += 1
+        self.fixture_seconds[fixture.name] = fixture.seconds
+        per_fixture = self.by_fixture.setdefault(fixture.name, {})
+        for metric, value in (("e2e", e2e_ms), ("ttfa", ttfa_ms)):
+            if value is not None:
+                self.samples.setdefault(metric, []).append(value)
+                per_fixture.setdefault(metric, []).append(value)
+        for name, value in stages.items():
+            self.stages.setdefault(name, []).append(value)
+
+    def summary(self) -> Dict[str, Any]:
+        wall = time.perf_counter() - self.started
+        return {
+            "turns": self.turns,
+            "errors": self.errors,
+            "wall_s": round(wall, 3),
+            "turns_per_s": round(self.turns / wall, 2) if wall else 0.0,
+            "e2e_ms": distribution(self.samples.get("e2e", [])),
+            "ttfa_ms": distribution(self.samples.get("ttfa", [])),
+            "stages_ms": {name: distribution(values) for name, values in self.stages.items()},
+            "by_fixture": {
+                name: {f"{metric}_ms": distribution(values) for metric, values in metrics.items()}
+                for name, metrics in sorted(self.by_fixture.items(), key=lambda item: self.fixture_seconds[item[0]])
+            },
+        }
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def distribution(samples: List[float]) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "p50": round(percentile(ordered, 50), 1),
+        "p95": round(percentile(ordered, 95), 1),
+        "p99": round(percentile(ordered, 99), 1),
+        "max": round(ordered[-1], 1) if ordered else 0.0,
+    }
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """``decode;dur=3.1, stt;dur=85.0`` -> ``{"decode": 3.1, "stt": 85.0}``."""
+    stages = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                stages[name] = float(value)
+    return stages
+
+
+def _ms_since(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+async def bounded(concurrency: int, jobs: List[Callable[[], Awaitable[Any]]]) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            await job()
+
+    await asyncio.gather(*(run(job) for job in jobs))
+
+
+# -----------------------------
+# Conversations
+# -----------------------------
+async def http_conversation(client: httpx.AsyncClient, rec: Recorder, fixtures: List[Fixture], args) -> None:
+    """A few /converse turns in one conversation; the reply is read to the end like a player would."""
+    conversation_id = None
+    for fixture in fixtures:
+        data = {"max_tokens": str(args.max_tokens)}
+        if conversation_id:
+            data["conversation_id"] = conversation_id
+        started = time.perf_counter()
+        ttfa_ms = None
+        try:
+            async with client.stream("POST", "/converse", files={"file": (fixture.name, fixture.data)}, data=data) as response:
+                async for chunk in response.aiter_bytes():
+                    if chunk and ttfa_ms is None:
+                        ttfa_ms = _ms_since(started)
+        except httpx.HTTPError as e:
+            print(f"/converse failed: {e!r}", file=sys.stderr)
+            rec.errors += 1
+            continue
+        if response.status_code != 200:
+            rec.errors += 1
+            continue
+        conversation_id = response.headers.get("x-conversation-id", conversation_id)
+        rec.record(fixture, _ms_since(started), ttfa_ms, parse_server_timing(response.headers.get("server-timing", "")))
+
+
+async def ws_conversation(rec: Recorder, fixtures: List[Fixture], args) -> None:
+    """The same turns over /ws/converse, one connection per conversation."""
+    import websockets
+
+    url = args.backend_url.replace("http://", "ws://", 1) + "/ws/converse"
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            for fixture in fixtures:
+                await ws.send(json.dumps({"type": "start", "max_tokens": args.max_tokens}))
+                for start in range(0, len(fixture.pcm), WS_FRAME_BYTES):
+                    await ws.send(fixture.pcm[start:start + WS_FRAME_BYTES])
+                await ws.send(json.dumps({"type": "end"}))
+                started = time.perf_counter()
+                ttfa_ms = None
+                while True:
+                    message = await ws.recv()
+                    if isinstance(message, bytes):
+                        if ttfa_ms is None:
+                            ttfa_ms = _ms_since(started)
+                        continue
+                    event = json.loads(message)
+                    if event["type"] == "error":
+                        rec.errors += 1
+                        break
+                    if event["type"] == "done":
+                        stages = {key[:-3]: event[key] for key in ("stt_ms", "first_token_ms", "first_audio_ms", "total_ms") if key in event}
+                        rec.record(fixture, _ms_since(started), ttfa_ms, stages)
+                        break
+    except (OSError, websockets.WebSocketException) as e:
+        print(f"/ws/converse failed: {e!r}", file=sys.stderr)
+        rec.errors += 1
+
+
+async def drive(args, fixtures: List[Fixture]) -> Dict[str, Any]:
+    ws_fixtures = [fixture for fixture in fixtures if fixture.pcm is not None]
+    if "ws" in args.modes and len(ws_fixtures) < len(fixtures):
+        print("ws: skipping fixtures that are not 16 kHz mono 16-bit WAV", file=sys.stderr)
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=args.backend_url, timeout=300.0, limits=limits) as client:
+        for mode in args.modes:
+            pool = fixtures if mode == "http" else ws_fixtures
+            results[mode] = {}
+            for level in args.concurrency:
+                print(f"running {mode} x{level} ...", flush=True)
+                rec = Recorder()
+                conversations = max(level, args.conversations)
+
+                def job(i: int) -> Callable[[], Awaitable[None]]:
+                    # Rotate fixtures so every level replays the same mix of lengths.
+                    turns = [pool[(i + turn) % len(pool)] for turn in range(args.turns)]
+                    if mode == "http":
+                        return lambda: http_conversation(client, rec, turns, args)
+                    return lambda: ws_conversation(rec, turns, args)
+
+                await bounded(level, [job(i) for i in range(conversations)])
+                results[mode][str(level)] = rec.summary()
+        stats = {path: (await client.get(path)).json() for path in ("/stt/stats", "/tts/stats", "/memory/stats")}
+    return {"runs": results, "backend_stats": stats}
+
+
+def scaling(runs: Dict[str, Any]) -> Dict[str, Any]:
+    """p50 end-to-end latency and throughput at each level relative to the lowest level."""
+    out = {}
+    for mode, levels in runs.items():
+        base = next(iter(levels.values()))
+        out[mode] = {
+            level: {
+                "e2e_p50_x": round(result["e2e_ms"]["p50"] / (base["e2e_ms"]["p50"] or 1e-9), 2),
+                "turns_per_s_x": round(result["turns_per_s"] / (base["turns_per_s"] or 1e-9), 2),
+            }
+            for level, result in levels.items()
+        }
+    return out
+
+
+# -----------------------------
+# Process management
+# -----------------------------
+def spawn(cmd: List[str], cwd: Path, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(cmd, cwd=cwd, env={**os.environ, **env})
+
+
+def wait_ready(url: str, timeout_s: float = 60.0) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(runs: Dict[str, Any]) -> None:
+    stage_names = sorted({name for levels in runs.values() for r in levels.values() for name in r["stages_ms"]})
+    print(
+        f"\n{'mode':<5} {'conc':>4} {'turns':>6} {'err':>4} {'turns/s':>8} {'e2e p50':>9} {'e2e p95':>9} {'ttfa p50':>9} {'ttfa p95':>9}  "
+        + " ".join(f"{name:>11}" for name in stage_names)
+    )
+    for mode, levels in runs.items():
+        for level, r in levels.items():
+            stages = " ".join(f"{r['stages_ms'][name]['p50'] if name in r['stages_ms'] else '-':>11}" for name in stage_names)
+            print(
+                f"{mode:<5} {level:>4} {r['turns']:>6} {r['errors']:>4} {r['turns_per_s']:>8} {r['e2e_ms']['p50']:>9} "
+                f"{r['e2e_ms']['p95']:>9} {r['ttfa_ms']['p50']:>9} {r['ttfa_ms']['p95']:>9}  {stages}"
+            )
+    print("(stage columns are p50 ms)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Conversational AI Bot voice pipeline benchmark")
+    parser.add_argument("--modes", default="http", help="comma list of http (/converse) and ws (/ws/converse)")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma list of parallel conversation counts")
+    parser.add_argument("--conversations", type=int, default=16, help="conversations per level (at least the level)")
+    parser.add_argument("--turns", type=int, default=2, help="turns per conversation")
+    parser.add_argument("--max-tokens", type=int, default=60)
+    parser.add_argument("--fixtures", type=Path, default=None, help="directory of recordings (.wav, .flac, ...) to use instead of synthetic speech")
+    parser.add_argument("--stt-base-ms", type=float, default=80)
+    parser.add_argument("--stt-rtf", type=float, default=0.05, help="fake STT seconds per second of speech")
+    parser.add_argument("--ttft-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-sec", type=float, default=300)
+    parser.add_argument("--tts-base-ms", type=float, default=120, help="fake TTS cost per sentence")
+    parser.add_argument("--tts-ms-per-char", type=float, default=1.5)
+    parser.add_argument("--tts-cache", action="store_true", help="keep the phrase cache on (off by default so TTS cost is measured)")
+    parser.add_argument("--backend-port", type=int, default=8766)
+    parser.add_argument("--fake-groq-port", type=int, default=9137)
+    parser.add_argument("--out", type=Path, default=RESULTS_DIR)
+    args = parser.parse_args()
+    args.modes = [m.strip() for m in args.modes.split(",")]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.backend_url = f"http://127.0.0.1:{args.backend_port}"
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="voicebot-bench-"))
+    if args.fixtures:
+        paths = sorted(p for p in args.fixtures.iterdir() if p.is_file())
+    else:
+        paths = ensure_fixtures(tmpdir / "fixtures")
+    fixtures = [load_fixture(path) for path in paths]
+    if not fixtures:
+        parser.error(f"no fixtures in {args.fixtures}")
+
+    fake = spawn(
+        [sys.executable, "-m", "bench.fake_groq", "--port", str(args.fake_groq_port),
+         "--ttft-ms", str(args.ttft_ms), "--tokens-per-sec", str(args.tokens_per_sec)],
+        ROOT,
+        {},
+    )
+    # The backend runs from backend/ like `python app.py`; ROOT on PYTHONPATH makes the bench engines importable.
+    backend = spawn(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.backend_port), "--log-level", "warning"],
+        ROOT / "backend",
+        {
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")])),
+            "GROQ_API_KEY": "bench",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{args.fake_groq_port}",
+            "STT_BACKEND": "bench.fake_engines:FakeSTT",
+            "TTS_ENGINE": "bench.fake_engines:FakeTTS",
+            "FAKE_STT_BASE_MS": str(args.stt_base_ms),
+            "FAKE_STT_RTF": str(args.stt_rtf),
+            "FAKE_TTS_BASE_MS": str(args.tts_base_ms),
+            "FAKE_TTS_MS_PER_CHAR": str(args.tts_ms_per_char),
+            "TTS_CACHE_DIR": str(tmpdir / "tts_cache"),
+            "TTS_CACHE_MAX_MB": "256" if args.tts_cache else "0",
+            "MEMORY_DB_PATH": "",
+        },
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{args.fake_groq_port}/health")
+        wait_ready(f"{args.backend_url}/docs")
+        results = asyncio.run(drive(args, fixtures))
+    finally:
+        backend.terminate()
+        fake.terminate()
+        backend.wait(10)
+        fake.wait(10)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "fixtures": [{"name": f.name, "seconds": round(f.seconds, 2), "bytes": len(f.data)} for f in fixtures],
+        "runs": results["runs"],
+        "scaling": scaling(results["runs"]),
+        "backend_stats": results["backend_stats"],
+    }
+    args.out.mkdir(parents=True, exist_ok=True)
+    out_path = args.out / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{report['revision']}.json"
+    out_path.write_text(json.dumps(report, indent=2))
+    print_table(results["runs"])
+    print(f"\nwrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
-import base64
 import requests
+from urllib.parse import unquote
 import streamlit as st
 from dotenv import load_dotenv
 from audio_recorder_streamlit import audio_recorder
@@ -23,6 +23,28 @@ st.sidebar.title("Controls")
 
 max_tokens = st.sidebar.slider("Max tokens (reply length)", min_value=50, max_value=10000, value=500, step=50)
 
+# The backend remembers earlier turns under this id; clearing it starts a fresh conversation.
+if st.sidebar.button("New conversation"):
+    st.session_state.pop("conversation_id", None)
+if st.session_state.get("conversation_id"):
+    st.sidebar.caption(f"Conversation: {st.session_state['conversation_id'][:8]}")
+
+
+def converse(files):
+    data = {"max_tokens": str(max_tokens)}
+    if st.session_state.get("conversation_id"):
+        data["conversation_id"] = st.session_state["conversation_id"]
+    r = requests.post(f"{BACKEND_URL}/converse", files=files, data=data, timeout=120)
+    if r.status_code == 404 and "conversation_id" in data:
+        # The conversation expired on the server; carry on in a new one.
+        st.session_state.pop("conversation_id", None)
+        data.pop("conversation_id")
+        r = requests.post(f"{BACKEND_URL}/converse", files=files, data=data, timeout=120)
+    r.raise_for_status()
+    st.session_state["conversation_id"] = r.headers.get("X-Conversation-Id")
+    return r
+
+
 tab1, tab2 = st.tabs(["🎤 Record Audio", "📁 Upload Audio"])
 
 with tab1:
@@ -43,22 +65,17 @@ with tab1:
             with st.spinner("Processing your recording..."):
                 files = {"file": ("recording.wav", audio_bytes)}
                 try:
-                    data = {"max_tokens": str(max_tokens)}
-                    r = requests.post(f"{BACKEND_URL}/converse", files=files, data=data, timeout=120)
-                    r.raise_for_status()
-                    data = r.json()
+                    r = converse(files)
                     st.subheader("✨ AI Reply")
-                    st.write(data.get("text"))
-                    audio_b64 = data.get("audio_base64")
-                    if audio_b64:
-                        audio_bytes_reply = base64.b64decode(audio_b64)
-                        st.audio(audio_bytes_reply, format="audio/mp3")
+                    st.write(unquote(r.headers.get("X-Reply-Text", "")))
+                    if r.content:
+                        st.audio(r.content, format=r.headers.get("Content-Type", "audio/mpeg"))
                 except Exception as e:
                     st.error(f"Error: {e}")
 
 with tab2:
     st.markdown("### Upload an audio file")
-    uploaded = st.file_uploader("Upload a WAV/FLAC/AIFF audio file", type=["wav", "flac", "aiff", "mp3"])
+    uploaded = st.file_uploader("Upload a WAV/FLAC/OGG/AIFF/MP3 audio file", type=["wav", "flac", "ogg", "aiff", "mp3", "m4a"])
     
     if uploaded is not None:
         st.write("Uploaded file:", uploaded.name)
@@ -68,15 +85,10 @@ with tab2:
             with st.spinner("Processing your upload..."):
                 files = {"file": (uploaded.name, uploaded.getvalue())}
                 try:
-                    data = {"max_tokens": str(max_tokens)}
-                    r = requests.post(f"{BACKEND_URL}/converse", files=files, data=data, timeout=120)
-                    r.raise_for_status()
-                    data = r.json()
+                    r = converse(files)
                     st.subheader("✨ AI Reply")
-                    st.write(data.get("text"))
-                    audio_b64 = data.get("audio_base64")
-                    if audio_b64:
-                        audio_bytes_reply = base64.b64decode(audio_b64)
-                        st.audio(audio_bytes_reply, format="audio/mp3")
+                    st.write(unquote(r.headers.get("X-Reply-Text", "")))
+                    if r.content:
+                        st.audio(r.content, format=r.headers.get("Content-Type", "audio/mpeg"))
                 except Exception as e:
                     st.error(f"Error: {e}")
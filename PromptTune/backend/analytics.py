@@ -0,0 +1,171 @@
+"""Analytics event writer and rollup-backed summaries.
+
+Raw events stay in ``analytics``. Every write also increments per-day counters
+in ``analytics_rollups`` within the same transaction, so dashboard queries read
+one row per (day, scope) instead of scanning events.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import dialect_insert
+
+BUCKETS = ("day", "week", "month")
+GROUPS = ("none", "prompt", "persona")
+REBUILD_BATCH_SIZE = 1000
+
+RollupKey = Tuple[UUID, date, str]
+
+
+def _event_day(created_at: datetime) -> date:
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.date()
+
+
+def _scopes(prompt_id: Optional[UUID], persona_id: Optional[UUID]) -> List[str]:
+    scopes = ["all"]
+    if prompt_id:
+        scopes.append(f"prompt:{prompt_id}")
+    if persona_id:
+        scopes.append(f"persona:{persona_id}")
+    return scopes
+
+
+def _accumulate(totals: Dict[RollupKey, List[int]], user_id: UUID, prompt_id, persona_id, rating, created_at) -> None:
+    day = _event_day(created_at)
+    for scope in _scopes(prompt_id, persona_id):
+        counters = totals.setdefault((user_id, day, scope), [0, 0, 0])
+        counters[0] += 1
+        if rating is not None:
+            counters[1] += 1
+            counters[2] += rating
+
+
+def _apply(db: Session, totals: Dict[RollupKey, List[int]]) -> None:
+    if not totals:
+        return
+    rows = [
+        {"user_id": user_id, "day": day, "scope": scope, "events": events, "rated": rated, "rating_sum": rating_sum}
+        for (user_id, day, scope), (events, rated, rating_sum) in totals.items()
+    ]
+    table = models.AnalyticsRollup.__table__
+    insert = dialect_insert(db)
+    if insert is not None:
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day, table.c.scope],
+            set_={
+                "events": table.c.events + stmt.excluded.events,
+                "rated": table.c.rated + stmt.excluded.rated,
+                "rating_sum": table.c.rating_sum + stmt.excluded.rating_sum,
+            },
+        )
+        db.execute(stmt)
+        return
+    for row in rows:
+        rollup = (
+            db.query(models.AnalyticsRollup)
+            .filter_by(user_id=row["user_id"], day=row["day"], scope=row["scope"])
+            .with_for_update()
+            .first()
+        )
+        if rollup is None:
+            db.add(models.AnalyticsRollup(**row))
+        else:
+            rollup.events += row["events"]
+            rollup.rated += row["rated"]
+            rollup.rating_sum += row["rating_sum"]
+
+
+def record_events(db: Session, events: Iterable[models.Analytics]) -> List[models.Analytics]:
+    """Add raw events and bump their rollups; the caller commits."""
+    events = list(events)
+    totals: Dict[RollupKey, List[int]] = {}
+    for event in events:
+        event.created_at = event.created_at or datetime.utcnow()
+        _accumulate(totals, event.user_id, event.prompt_id, event.persona_id, event.rating, event.created_at)
+    db.add_all(events)
+    # Pre-aggregated so each rollup key appears once per statement (ON CONFLICT cannot touch a row twice).
+    _apply(db, totals)
+    return events
+
+
+def rebuild_rollups(db: Session, user_id: Optional[UUID] = None) -> int:
+    """Recompute rollups from raw events, e.g. after a backfill. Returns the number of events read."""
+    rollups = db.query(models.AnalyticsRollup)
+    events = db.query(
+        models.Analytics.user_id,
+        models.Analytics.prompt_id,
+        models.Analytics.persona_id,
+        models.Analytics.rating,
+        models.Analytics.created_at,
+    )
+    if user_id is not None:
+        rollups = rollups.filter(models.AnalyticsRollup.user_id == user_id)
+        events = events.filter(models.Analytics.user_id == user_id)
+    rollups.delete(synchronize_session=False)
+
+    totals: Dict[RollupKey, List[int]] = {}
+    count = 0
+    for row in events.execution_options(stream_results=True, yield_per=REBUILD_BATCH_SIZE):
+        _accumulate(totals, *row)
+        count += 1
+    items = list(totals.items())
+    for start in range(0, len(items), REBUILD_BATCH_SIZE):
+        _apply(db, dict(items[start:start + REBUILD_BATCH_SIZE]))
+    return count
+
+
+def _bucket_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def summarize(
+    db: Session,
+    user_id: UUID,
+    bucket: str,
+    group_by: str,
+    start: date,
+    end: date,
+    key: Optional[UUID] = None,
+) -> List[Dict[str, Any]]:
+    query = db.query(models.AnalyticsRollup).filter(
+        models.AnalyticsRollup.user_id == user_id,
+        models.AnalyticsRollup.day >= start,
+        models.AnalyticsRollup.day <= end,
+    )
+    if group_by == "none":
+        query = query.filter(models.AnalyticsRollup.scope == "all")
+    elif key is not None:
+        query = query.filter(models.AnalyticsRollup.scope == f"{group_by}:{key}")
+    else:
+        query = query.filter(models.AnalyticsRollup.scope.like(f"{group_by}:%"))
+
+    grouped: Dict[Tuple[date, Optional[str]], List[int]] = {}
+    for rollup in query:
+        group_key = None if group_by == "none" else rollup.scope.split(":", 1)[1]
+        counters = grouped.setdefault((_bucket_start(rollup.day, bucket), group_key), [0, 0, 0])
+        counters[0] += rollup.events
+        counters[1] += rollup.rated
+        counters[2] += rollup.rating_sum
+
+    return [
+        {
+            "bucket_start": bucket_start,
+            "key": group_key,
+            "events": events,
+            "rated": rated,
+            "avg_rating": round(rating_sum / rated, 3) if rated else None,
+        }
+        for (bucket_start, group_key), (events, rated, rating_sum) in sorted(
+            grouped.items(), key=lambda item: (item[0][0], item[0][1] or "")
+        )
+    ]
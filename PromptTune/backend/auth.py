@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 
 from . import models, schemas
 from .db import get_db
+from .telemetry import set_trace_user, traced
 
 # Use PBKDF2-SHA256 to avoid bcrypt backend issues and allow long passwords
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -37,6 +38,7 @@ def create_access_token(subject: UUID, expires_delta: Optional[timedelta] = None
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+@traced("get_current_user")
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,4 +56,5 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
     user = db.get(models.User, UUID(user_id))
     if user is None:
         raise credentials_exception
+    set_trace_user(str(user.id))
     return user
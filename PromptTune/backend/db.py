@@ -1,7 +1,8 @@
 import os
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -18,3 +19,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def dialect_insert(db: Session):
+    """``insert`` construct with ON CONFLICT support for the bound dialect, or None if unsupported."""
+    return {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(db.get_bind().dialect.name)
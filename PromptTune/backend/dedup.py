@@ -0,0 +1,171 @@
+"""Near-duplicate detection for saved prompts with MinHash + LSH.
+
+Each prompt is reduced to a MinHash signature over word shingles; signatures
+are split into bands and bucketed, so candidate duplicates are found by a few
+bucket lookups rather than a scan of the library. Candidates are then checked
+against the estimated Jaccard similarity. Indexes are per user, built lazily
+from the database on first use and kept current on create/update/delete.
+
+Each index is tagged with a cheap version of the user's library (prompt count
+and latest ``updated_at``). A lookup whose version differs rebuilds the index,
+so writes made by other workers are picked up.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+import numpy as np
+
+NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+NUM_BANDS = int(os.getenv("DEDUP_BANDS", "32"))
+SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+DUPLICATE_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+MAX_INDEXED_USERS = int(os.getenv("DEDUP_MAX_INDEXED_USERS", "500"))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, np.iinfo(np.int64).max, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, np.iinfo(np.int64).max, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> Set[bytes]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words).encode("utf-8")} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8") for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> np.ndarray:
+    shingles = _shingles(text)
+    if not shingles:
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s, digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # Universal hashing of every shingle under every permutation at once: (a*x + b) mod p, truncated to 32 bits.
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class LSHIndex:
+    def __init__(self, num_bands: int = NUM_BANDS) -> None:
+        self.rows = NUM_PERM // num_bands
+        self.num_bands = num_bands
+        self._buckets: List[Dict[bytes, Set[UUID]]] = [{} for _ in range(num_bands)]
+        self._signatures: Dict[UUID, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.num_bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: UUID, text: str) -> None:
+        self.remove(key)
+        signature = minhash(text)
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, set()).add(key)
+
+    def remove(self, key: UUID) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def query(self, text: str, threshold: float = DUPLICATE_THRESHOLD, exclude: Optional[UUID] = None) -> List[Tuple[UUID, float]]:
+        signature = minhash(text)
+        candidates: Set[UUID] = set()
+        for band, band_key in self._band_keys(signature):
+            candidates |= self._buckets[band].get(band_key, set())
+        candidates.discard(exclude)
+        scored = [(key, similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted([item for item in scored if item[1] >= threshold], key=lambda item: -item[1])
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+
+class DedupRegistry:
+    """Per-user LSH indexes, loaded lazily, rebuilt when stale and evicted least-recently-used."""
+
+    def __init__(self, max_users: int = MAX_INDEXED_USERS) -> None:
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[UUID, Tuple[LSHIndex, Hashable]]" = OrderedDict()
+        self._max_users = max_users
+
+    def index_for(self, user_id: UUID, load: Callable[[], Iterable[Tuple[UUID, str]]], version: Hashable) -> LSHIndex:
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and entry[1] == version:
+                self._indexes.move_to_end(user_id)
+                return entry[0]
+        index = LSHIndex()
+        for prompt_id, text in load():
+            index.add(prompt_id, text)
+        with self._lock:
+            self._indexes[user_id] = (index, version)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self._max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def similar(
+        self,
+        user_id: UUID,
+        load: Callable[[], Iterable[Tuple[UUID, str]]],
+        version: Hashable,
+        text: str,
+        threshold: float = DUPLICATE_THRESHOLD,
+        exclude: Optional[UUID] = None,
+    ) -> List[Tuple[UUID, float]]:
+        index = self.index_for(user_id, load, version)
+        with self._lock:
+            return index.query(text, threshold=threshold, exclude=exclude)
+
+    # ``expected`` is the library version read before this worker's write and ``version`` the one
+    # read after it. The change is applied in place only if the index was current before the write;
+    # otherwise another worker's write may be missing, so the index is dropped and rebuilt on demand.
+    def upsert(self, user_id: UUID, prompt_id: UUID, text: str, expected: Hashable, version: Hashable) -> None:
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is None:
+                return
+            if entry[1] != expected:
+                del self._indexes[user_id]
+                return
+            entry[0].add(prompt_id, text)
+            self._indexes[user_id] = (entry[0], version)
+
+    def remove(self, user_id: UUID, prompt_id: UUID, expected: Hashable, version: Hashable) -> None:
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is None:
+                return
+            if entry[1] != expected:
+                del self._indexes[user_id]
+                return
+            entry[0].remove(prompt_id)
+            self._indexes[user_id] = (entry[0], version)
+
+    def forget(self, user_id: UUID) -> None:
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+
+registry = DedupRegistry()
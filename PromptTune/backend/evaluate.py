@@ -0,0 +1,298 @@
+"""Offline evaluation of the optimize -> chat pipeline.
+
+Reads a JSONL dataset of raw prompts and runs each case through the same
+optimizer the API uses. The optimized prompt then answers a simulated user
+turn, and the reply is scored against the optimizer's own checklist. Scores go
+to ``Analytics`` through the rollup writer, tagged with the run id.
+
+Cases run on a bounded thread pool. Each finished case is appended to a JSONL
+checkpoint, and a rerun with the same checkpoint skips cases that already
+succeeded, so long runs can be interrupted and resumed.
+
+    python -m backend.evaluate --dataset cases.jsonl --user-email eval@example.com \\
+        --run-id persona-v2 --persona product-manager --workers 8
+    # against the local stand-in LLM from bench/
+    python -m backend.evaluate ... --base-url http://127.0.0.1:9100
+
+Dataset lines: ``{"id": "...", "raw_prompt": "...", "goal": ..., "audience": ...,
+"style": ..., "test_input": "..."}``; only ``raw_prompt`` is required.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+DEFAULT_TEST_INPUT = "Carry out the task described in your instructions for a typical request."
+JUDGE_SYSTEM = (
+    "You are a strict evaluator. For each numbered checklist item, decide whether the response"
+    ' satisfies it. Reply with JSON only: {"results": [true, false, ...]} in checklist order.'
+)
+_CONTENT_WORD_RE = re.compile(r"[a-z]{4,}")
+
+
+def case_id(case: Dict[str, Any]) -> str:
+    return str(case.get("id") or hashlib.sha1(case["raw_prompt"].encode("utf-8")).hexdigest()[:16])
+
+
+def iter_cases(path: Path, done: Set[str], limit: Optional[int]) -> Iterator[Dict[str, Any]]:
+    yielded = 0
+    with path.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if case_id(case) in done:
+                continue
+            if limit is not None and yielded >= limit:
+                return
+            yielded += 1
+            yield case
+
+
+def load_checkpoint(path: Path) -> Set[str]:
+    done: Set[str] = set()
+    if path.exists():
+        with path.open("r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted run
+                if record.get("status") == "ok":
+                    done.add(record["case_id"])
+    return done
+
+
+# -----------------------------
+# Scoring
+# -----------------------------
+def lexical_score(checklist: List[str], reply: str) -> List[bool]:
+    """Cheap fallback: an item passes when most of its content words appear in the reply."""
+    reply_words = set(_CONTENT_WORD_RE.findall(reply.lower()))
+    results = []
+    for item in checklist:
+        words = set(_CONTENT_WORD_RE.findall(item.lower()))
+        results.append(bool(words) and len(words & reply_words) / len(words) >= 0.5)
+    return results
+
+
+def judge_score(pipeline, checklist: List[str], reply: str, model: str) -> Optional[List[bool]]:
+    items = "\n".join(f"{i + 1}. {item}" for i, item in enumerate(checklist))
+    messages = [
+        {"role": "system", "content": JUDGE_SYSTEM},
+        {"role": "user", "content": f"Checklist:\n{items}\n\nResponse:\n{reply}"},
+    ]
+    raw = pipeline.call_groq_chat(messages, model=model, response_format={"type": "json_object"})
+    try:
+        results = json.loads(raw).get("results")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(results, list) or len(results) != len(checklist):
+        return None
+    return [bool(result) for result in results]
+
+
+# -----------------------------
+# Pipeline
+# -----------------------------
+def run_case(
+    pipeline,
+    case: Dict[str, Any],
+    persona_name: Optional[str],
+    persona_instructions: Optional[str],
+    scorer: str,
+    judge_model: str,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    parsed, model = pipeline.optimize_prompt(
+        case["raw_prompt"],
+        goal=case.get("goal"),
+        audience=case.get("audience"),
+        style=case.get("style"),
+        persona_name=persona_name,
+        persona_instructions=persona_instructions,
+    )
+    optimize_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    test_input = case.get("test_input") or DEFAULT_TEST_INPUT
+    chat_model = pipeline.choose_model(parsed["optimized_prompt"] + "\n" + test_input, persona_instructions)
+    reply = pipeline.call_groq_chat(
+        [
+            {"role": "system", "content": pipeline.compose_system_prompt(persona_instructions, parsed["optimized_prompt"])},
+            {"role": "user", "content": test_input},
+        ],
+        model=chat_model,
+    )
+    chat_ms = (time.perf_counter() - started) * 1000
+
+    checklist = parsed["checklist"]
+    results, used = None, scorer
+    if checklist and scorer == "judge":
+        results = judge_score(pipeline, checklist, reply, judge_model)
+    if results is None:
+        results, used = lexical_score(checklist, reply), "lexical"
+    score = sum(results) / len(results) if results else None
+    return {
+        "case_id": case_id(case),
+        "status": "ok",
+        "model": model,
+        "chat_model": chat_model,
+        "scorer": used,
+        "checklist": checklist,
+        "passed": sum(results),
+        "total": len(results),
+        "score": score,
+        "optimize_ms": round(optimize_ms, 1),
+        "chat_ms": round(chat_ms, 1),
+    }
+
+
+def _write_result(db, user_id, persona_id, run_id: str, result: Dict[str, Any]) -> None:
+    from backend import analytics, models
+
+    score = result["score"]
+    event = models.Analytics(
+        user_id=user_id,
+        persona_id=persona_id,
+        # Map the checklist pass rate onto the 1-5 rating scale used by user feedback.
+        rating=1 + round(4 * score) if score is not None else None,
+        metrics={"eval_run": run_id, **{k: v for k, v in result.items() if k not in ("status", "checklist")}},
+        note=f"eval:{run_id}",
+    )
+    analytics.record_events(db, [event])
+    db.commit()
+
+
+def _resolve(db, email: str, persona_ref: Optional[str]) -> Tuple[Any, Any]:
+    from sqlalchemy import or_
+
+    from backend import models
+
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if user is None:
+        raise SystemExit(f"No user with email {email}; register one first")
+    if not persona_ref:
+        return user, None
+    query = db.query(models.Persona).filter(
+        or_(models.Persona.user_id == user.id, models.Persona.is_default.is_(True))
+    )
+    persona = query.filter(
+        or_(models.Persona.slug == persona_ref, models.Persona.name == persona_ref)
+    ).first()
+    if persona is None:
+        try:
+            from uuid import UUID
+
+            persona = query.filter(models.Persona.id == UUID(persona_ref)).first()
+        except ValueError:
+            pass
+    if persona is None:
+        raise SystemExit(f"Persona {persona_ref!r} not found for {email}")
+    return user, persona
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Evaluate optimized prompts against their checklists")
+    parser.add_argument("--dataset", type=Path, required=True)
+    parser.add_argument("--user-email", required=True, help="Account the Analytics rows are written for")
+    parser.add_argument("--run-id", required=True)
+    parser.add_argument("--persona", help="Persona slug, name or id")
+    parser.add_argument("--checkpoint", type=Path, help="Defaults to eval_runs/<run-id>.jsonl")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--scorer", choices=("judge", "lexical"), default="judge")
+    parser.add_argument("--judge-model", help="Defaults to the large model")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint to use instead of Groq (e.g. bench/fake_groq)")
+    args = parser.parse_args()
+
+    if args.base_url:
+        os.environ["GROQ_BASE_URL"] = args.base_url
+        os.environ.setdefault("GROQ_API_KEY", "eval")
+    os.environ.setdefault("WARM_UP_ON_STARTUP", "0")
+
+    from backend import main as pipeline
+    from backend.db import SessionLocal
+
+    checkpoint = args.checkpoint or Path("eval_runs") / f"{args.run_id}.jsonl"
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    done = load_checkpoint(checkpoint)
+    if done:
+        print(f"Resuming {args.run_id}: {len(done)} cases already scored")
+
+    db = SessionLocal()
+    user, persona = _resolve(db, args.user_email, args.persona)
+    # Plain values only: ORM instances expire on commit and must not be refreshed from worker threads.
+    user_id = user.id
+    persona_id, persona_name, persona_instructions = (
+        (persona.id, persona.name, persona.instructions) if persona else (None, None, None)
+    )
+    judge_model = args.judge_model or pipeline.LARGE_MODEL
+    scores: List[float] = []
+    latencies: List[float] = []
+    failures = 0
+
+    # Keep at most 2x workers cases in flight so the dataset is streamed, not loaded.
+    cases = iter_cases(args.dataset, done, args.limit)
+    in_flight: Dict[Future, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="eval") as executor, checkpoint.open(
+        "a", encoding="utf-8"
+    ) as out:
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < args.workers * 2:
+                case = next(cases, None)
+                if case is None:
+                    exhausted = True
+                    break
+                future = executor.submit(
+                    run_case, pipeline, case, persona_name, persona_instructions, args.scorer, judge_model
+                )
+                in_flight[future] = case
+            if not in_flight:
+                break
+            finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in finished:
+                case = in_flight.pop(future)
+                try:
+                    result = future.result()
+                    _write_result(db, user_id, persona_id, args.run_id, result)
+                    if result["score"] is not None:
+                        scores.append(result["score"])
+                    latencies.append(result["optimize_ms"] + result["chat_ms"])
+                except Exception as e:
+                    db.rollback()
+                    failures += 1
+                    result = {"case_id": case_id(case), "status": "error", "error": str(e)[:500]}
+                # Checkpoint only after the Analytics row is committed, so a resumed run never skips unsaved work.
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    db.close()
+
+    summary = {
+        "run_id": args.run_id,
+        "scored": len(scores),
+        "failed": failures,
+        "mean_score": round(statistics.fmean(scores), 4) if scores else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "checkpoint": str(checkpoint),
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
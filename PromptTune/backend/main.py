@@ -1,14 +1,20 @@
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from uuid import UUID
 
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field
 from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 # Lazy imports for heavy deps
@@ -32,18 +38,34 @@ if not loaded_any:
     # Fall back to default search (current working directory + parents)
     load_dotenv()
 
-from backend import models, schemas
+from backend import analytics, dedup, models, schemas, transfer, versioning
 from backend.auth import (
     create_access_token,
     get_current_user,
     get_password_hash,
     verify_password,
 )
-from backend.db import engine, get_db
+from backend.db import SessionLocal, engine, get_db
+from backend.parsing import (
+    StructuredParseError,
+    parse_lenient,
+    parse_llm_output,
+    repair_instruction,
+)
+from backend.persona_registry import registry as persona_registry
+from backend.prompting import compile_meta_prompt, template_cache_info
+from backend.ratelimit import admit_llm_request, rate_limit
+from backend.routing import LARGE_MODEL, MODEL_STATS, choose_model
+from backend.retrieval import start_retrieval, warm_up
+from backend.singleflight import make_key, optimize_flight
+from backend.telemetry import CACHE_REQUESTS, EXPORTER, REGISTRY, TelemetryMiddleware, record_cache, span, traced
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "prompt-patterns")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+VECTORSTORE_FACTORY = os.getenv("VECTORSTORE_FACTORY")
+OPTIMIZE_JSON_MODE = os.getenv("OPTIMIZE_JSON_MODE", "0") == "1"
 ALLOWED_ORIGINS = [origin.strip() for origin in os.getenv(
     "CORS_ALLOW_ORIGINS",
     "http://localhost:5173,http://127.0.0.1:5173",
@@ -53,7 +75,23 @@ ORIGIN_REGEX = os.getenv(
     r"https?://((localhost|127\.0\.0\.1|192\.168\.\d{1,3}\.\d{1,3}|10\.\d{1,3}\.\d{1,3}\.\d{1,3}|172\.(1[6-9]|2[0-9]|3[0-1])\.\d{1,3}\.\d{1,3}))(:\d+)?$",
 )
 
-app = FastAPI(title="PromptTune API", version="0.1.0")
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "1") == "1"
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Parse the persona catalogue (and pre-compile its templates) and sync the built-in rows
+    # before the first request, so generation never sees rows from an older catalogue.
+    with SessionLocal() as db:
+        persona_registry.sync(db)
+    if WARM_UP_ON_STARTUP:
+        # Build the lexical index and open upstream clients in the background so the first
+        # /optimize does not pay for them; startup itself is not delayed.
+        threading.Thread(target=warm_up, args=(get_vectorstore, get_groq_client), daemon=True).start()
+    yield
+
+
+app = FastAPI(title="PromptTune API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -62,132 +100,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
+app.add_middleware(TelemetryMiddleware)
 
 models.Base.metadata.create_all(bind=engine)
 
 # -----------------------------
-# Minimal in-memory session store (last N messages)
+# Session cache (last N messages) backed by the chat_messages table
 # -----------------------------
-SESSION_MEMORY: Dict[str, Dict[str, List[Dict[str, str]]]] = {}
+# The database is the source of truth; the cache only saves re-reading the
+# tail of hot sessions. Each entry remembers the newest message id it holds so
+# a turn served by another worker is detected and the entry is re-hydrated.
+SESSION_MEMORY: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
 MAX_HISTORY = 20
+MAX_CACHED_SESSIONS = int(os.getenv("MAX_CACHED_SESSIONS", "1000"))
+_session_lock = threading.Lock()
+
+
+def _cache_session(key: Tuple[str, str], history: List[Dict[str, str]], last_id: Optional[int]) -> None:
+    with _session_lock:
+        SESSION_MEMORY[key] = {"history": history[-MAX_HISTORY:], "last_id": last_id}
+        SESSION_MEMORY.move_to_end(key)
+        while len(SESSION_MEMORY) > MAX_CACHED_SESSIONS:
+            SESSION_MEMORY.popitem(last=False)
+
+
+def get_session_history(user_id: str, session: Optional[models.ChatSession], db: Session) -> List[Dict[str, str]]:
+    if session is None:
+        return []
+    key = (user_id, session.session_id)
+    last_id = (
+        db.query(func.max(models.ChatMessage.id))
+        .filter(models.ChatMessage.session_pk == session.id)
+        .scalar()
+    )
+    with _session_lock:
+        cached = SESSION_MEMORY.get(key)
+        if cached is not None and cached["last_id"] == last_id:
+            SESSION_MEMORY.move_to_end(key)
+            record_cache("session_history", True)
+            return list(cached["history"])
+    record_cache("session_history", False)
+
+    rows = (
+        db.query(models.ChatMessage)
+        .filter(models.ChatMessage.session_pk == session.id)
+        .order_by(models.ChatMessage.id.desc())
+        .limit(MAX_HISTORY)
+        .all()
+    )
+    history = [{"role": row.role, "content": row.content} for row in reversed(rows)]
+    _cache_session(key, history, last_id)
+    return history
 
 
-def get_session_history(user_id: str, session_id: str) -> List[Dict[str, str]]:
-    user_sessions = SESSION_MEMORY.setdefault(user_id, {})
-    return user_sessions.setdefault(session_id, [])
-
-
-DEFAULT_PERSONAS = [
-    {
-        "slug": "product-manager",
-        "name": "Product Manager",
-        "description": "Frames prompts around user value, measurable outcomes, and stakeholder-ready context.",
-        "instructions": (
-            "You are an executive-level Product Manager. Emphasize user value, clear acceptance criteria,"
-            " metric instrumentation, and experiment-friendly outputs. Proactively call out risks,"
-            " open questions, and cross-functional touchpoints."
-        ),
-        "tags": ["roadmap", "strategy", "experiments"],
-    },
-    {
-        "slug": "data-scientist",
-        "name": "Data Scientist",
-        "description": "Optimizes for evidence, reproducibility, and rigorous evaluation steps.",
-        "instructions": (
-            "You are a principal Data Scientist. Demand structured inputs, cite assumptions, enforce"
-            " statistical rigor, and highlight metrics, datasets, and validation procedures."
-            " Encourage ablation-style follow-ups and red-team tests."
-        ),
-        "tags": ["analysis", "metrics", "ml"],
-    },
-    {
-        "slug": "creative-writer",
-        "name": "Creative Writer",
-        "description": "Injects narrative voice, imagery, and pacing guidance for storytelling prompts.",
-        "instructions": (
-            "You are an award-winning Creative Director. Lean into vivid imagery, pacing cues,"
-            " and emotional beats. Ensure prompts specify narrative structure, voice, and editing passes"
-            " so drafts feel publish-ready."
-        ),
-        "tags": ["story", "brand", "voice"],
-    },
-    {
-        "slug": "ux-researcher",
-        "name": "UX Researcher",
-        "description": "Prioritizes user empathy, usability metrics, and hypothesis-driven design for prompts.",
-        "instructions": (
-            "You are an experienced UX Researcher. Ask clarifying questions to reduce ambiguity, map user flows, "
-            "and prefer outputs that are testable with prototypes or A/B tests. Recommend metrics for measuring success."
-        ),
-        "tags": ["ux", "research", "usability"],
-    },
-    {
-        "slug": "customer-support",
-        "name": "Customer Support Agent",
-        "description": "Write responses that are empathetic, concise, and focused on resolving user issues quickly.",
-        "instructions": (
-            "You are a Customer Support Agent. Prioritize empathy, acknowledgement, and clear next steps. "
-            "When needed, provide step-by-step troubleshooting and offer safe fallbacks or escalation paths."
-        ),
-        "tags": ["support", "faq", "triage"],
-    },
-    {
-        "slug": "legal-counsel",
-        "name": "Legal Counsel",
-        "description": "Drafts prompts that are cautious, precise, and minimize legal exposure.",
-        "instructions": (
-            "You are a practical Legal Counsel. Flag legal risk, suggest contract-style clauses, and prefer "
-            "language that reduces ambiguity and ensures compliance with general regulations. Do not provide "
-            "jurisdiction-specific legal advice unless asked."
-        ),
-        "tags": ["legal", "compliance"],
-    },
-    {
-        "slug": "marketing-copywriter",
-        "name": "Marketing Copywriter",
-        "description": "Focuses on conversion-oriented language, clarity, and brand voice cohesion.",
-        "instructions": (
-            "You are a senior Marketing Copywriter. Optimize for clarity, CTA strength, and voice consistency. "
-            "Provide headline, subhead, and 2–3 variations for A/B testing. Call out tone and audience per prompt."
-        ),
-        "tags": ["marketing", "copy", "growth"],
-    },
-    {
-        "slug": "security-analyst",
-        "name": "Security Analyst",
-        "description": "Examines prompts for threat modeling, data leakage, and security hardening.",
-        "instructions": (
-            "You are a Security Analyst. Evaluate prompts for sensitive data exposure, advise safer "
-            "data handling, and recommend constraints to minimize attack surface for generated content."
-        ),
-        "tags": ["security", "privacy", "hardening"],
-    },
-]
-
-
-def ensure_default_personas(db: Session) -> None:
-    existing_slugs = {
-        persona.slug: persona
-        for persona in db.query(models.Persona).filter(models.Persona.is_default.is_(True)).all()
-        if persona.slug
-    }
-    created = False
-    for payload in DEFAULT_PERSONAS:
-        if payload["slug"] in existing_slugs:
-            continue
-        persona = models.Persona(
-            slug=payload["slug"],
-            name=payload["name"],
-            description=payload["description"],
-            instructions=payload["instructions"],
-            tags=payload.get("tags"),
-            is_default=True,
-        )
-        db.add(persona)
-        created = True
-    if created:
+def _get_or_create_chat_session(session_id: str, current_user: models.User, db: Session) -> models.ChatSession:
+    session_record = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
+    if session_record and session_record.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session_record:
+        session_record = models.ChatSession(user_id=current_user.id, session_id=session_id)
+        db.add(session_record)
         db.commit()
+    return session_record
+
+
+def append_session_messages(
+    session: models.ChatSession,
+    current_user: models.User,
+    turn: List[Dict[str, str]],
+    history: List[Dict[str, str]],
+    db: Session,
+) -> None:
+    rows = [
+        models.ChatMessage(session_pk=session.id, user_id=current_user.id, role=m["role"], content=m["content"])
+        for m in turn
+    ]
+    db.add_all(rows)
+    db.commit()
+    _cache_session((str(current_user.id), session.session_id), history + turn, rows[-1].id if rows else None)
 
 
 def _get_persona_for_user(persona_id: UUID, current_user: models.User, db: Session) -> models.Persona:
@@ -210,10 +202,13 @@ def compose_system_prompt(persona_instructions: Optional[str], fallback: str) ->
     return fallback
 
 
+@traced("resolve_persona")
 def resolve_persona(profile: models.Profile, current_user: models.User, db: Session, override_persona_id: Optional[UUID] = None) -> Optional[models.Persona]:
     target_id = override_persona_id or profile.active_persona_id
     if not target_id:
         return None
+    # Cheap unless the catalogue file changed since this process last synced.
+    persona_registry.sync(db)
     try:
         return _get_persona_for_user(target_id, current_user, db)
     except HTTPException:
@@ -240,14 +235,29 @@ def _get_owned_persona(persona_id: UUID, current_user: models.User, db: Session)
 # Core RAG + LLM utilities (lazy init)
 # -----------------------------
 _vectorstore = None
+_vectorstore_lock = threading.Lock()
 _groq_client = None
 _embed = None
 
 
 def get_vectorstore():
-    global _vectorstore, _embed
     if _vectorstore is not None:
         return _vectorstore
+    with _vectorstore_lock:
+        if _vectorstore is not None:
+            return _vectorstore
+        return _init_vectorstore()
+
+
+def _init_vectorstore():
+    global _vectorstore, _embed
+    if VECTORSTORE_FACTORY:
+        # "package.module:callable" returning (vectorstore, embeddings); used by the benchmark stand-ins.
+        import importlib
+
+        module_name, _, attr = VECTORSTORE_FACTORY.partition(":")
+        _vectorstore, _embed = getattr(importlib.import_module(module_name), attr)()
+        return _vectorstore
 
     if not PINECONE_API_KEY:
         raise HTTPException(status_code=500, detail="Pinecone API key missing")
@@ -279,23 +289,42 @@ def get_groq_client():
     try:
         from groq import Groq
 
-        _groq_client = Groq(api_key=GROQ_API_KEY)
+        # base_url=None keeps the SDK default; point it at a local stand-in for benchmarks.
+        _groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL)
         return _groq_client
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to init Groq client: {e}")
 
 
-def call_groq_chat(messages: List[Dict[str, str]], model: str = "llama-3.3-70b-versatile") -> str:
+def call_groq_chat(
+    messages: List[Dict[str, str]],
+    model: str = LARGE_MODEL,
+    response_format: Optional[Dict[str, str]] = None,
+) -> str:
     client = get_groq_client()
-    try:
-        completion = client.chat.completions.create(
-            model=model,
-            temperature=0.2,
-            messages=messages,
+    extra: Dict[str, Any] = {"response_format": response_format} if response_format else {}
+    with span("call_groq_chat", model=model) as attrs:
+        started = time.perf_counter()
+        try:
+            completion = client.chat.completions.create(
+                model=model,
+                temperature=0.2,
+                messages=messages,
+                **extra,
+            )
+        except Exception as e:
+            MODEL_STATS.record(model, time.perf_counter() - started, error=True)
+            raise HTTPException(status_code=500, detail=f"Groq chat failed: {e}")
+
+        usage = getattr(completion, "usage", None)
+        attrs["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+        attrs["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+        MODEL_STATS.record(
+            model,
+            time.perf_counter() - started,
+            prompt_tokens=attrs["prompt_tokens"],
+            completion_tokens=attrs["completion_tokens"],
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Groq chat failed: {e}")
-
     choice = completion.choices[0].message.content if completion.choices else ""
     return choice or ""
 
@@ -307,64 +336,93 @@ def build_meta_prompt(
     patterns: List[Dict[str, Any]],
     persona_name: Optional[str] = None,
     persona_instructions: Optional[str] = None,
+    json_mode: bool = False,
+    instructions_hash: Optional[str] = None,
 ) -> str:
-    pattern_text = "\n\n".join([
-        f"Source: {p.get('source','unknown')}\nExample/Notes: {p.get('snippet','') }" for p in patterns
-    ])
-
-    return f"""
-You are an expert prompt engineer optimizing a raw user prompt using a rigorous 5-step framework: Task, Context, References, Evaluate, Iterate. Improve clarity, constraints, and correctness. Use retrieval examples below as inspiration; do not copy verbatim.
-
-Raw Prompt:
-{raw}
-
-Intent:
-- Goal: {goal or 'n/a'}
-- Audience/Tone: {audience or 'n/a'}
-- Style Prefs: {style or 'n/a'}
-
-Persona Guidance:
-- Persona: {persona_name or 'Generalist'}
-- Instructions: {persona_instructions or 'n/a'}
-
-Retrieved Prompt Patterns & Examples:
-{pattern_text}
-
-Deliverables:
-1) Optimized Prompt (ready to paste)
-2) Rationale (why these changes)
-3) Checklist (3-6 bullet items to self-evaluate outputs)
-
-Format strictly as:
-<optimized> ... </optimized>
-<rationale> ... </rationale>
-<checklist>
-- item 1
-- item 2
-...
-</checklist>
-""".strip()
-
-
-def parse_structured_response(text: str) -> Dict[str, Any]:
-    def extract(tag: str) -> str:
-        start = text.find(f"<{tag}>")
-        end = text.find(f"</{tag}>")
-        if start == -1 or end == -1:
-            return ""
-        return text[start + len(tag) + 2: end].strip()
-
-    optimized = extract("optimized")
-    rationale = extract("rationale")
-    checklist_block = extract("checklist")
-    checklist = []
-    if checklist_block:
-        checklist = [line[2:].strip() for line in checklist_block.splitlines() if line.strip().startswith("-")]
-    return {
-        "optimized_prompt": optimized or text,
-        "rationale": rationale or "",
-        "checklist": checklist,
-    }
+    # Static instructions come first (compiled once per persona) so the prompt prefix is cacheable upstream.
+    with span("build_meta_prompt") as attrs:
+        template = compile_meta_prompt(persona_name, persona_instructions, json_mode, instructions_hash)
+        attrs["prefix_tokens"] = template.prefix_tokens
+        return template.render(raw=raw, goal=goal, audience=audience, style=style, patterns=patterns)
+
+
+def generate_structured(
+    messages: List[Dict[str, str]],
+    json_mode: bool = OPTIMIZE_JSON_MODE,
+    model: str = LARGE_MODEL,
+) -> Dict[str, Any]:
+    """Call the LLM and parse its structured reply, with at most one recovery round-trip.
+
+    A malformed reply from the small model escalates the whole request to the large
+    model. A malformed reply from the large model gets a single follow-up turn quoting
+    the parse error instead of a full re-run; if that also fails, whatever fields can
+    be recovered from the reply are returned, or a 502 if there are none.
+    """
+    response_format = {"type": "json_object"} if json_mode else None
+    result_text = call_groq_chat(messages, model=model, response_format=response_format)
+    try:
+        return parse_llm_output(result_text, json_mode)
+    except StructuredParseError as e:
+        if model != LARGE_MODEL:
+            MODEL_STATS.record_escalation(model)
+            return generate_structured(messages, json_mode, model=LARGE_MODEL)
+        repair_messages = messages + [
+            {"role": "assistant", "content": result_text},
+            {"role": "user", "content": repair_instruction(e, json_mode)},
+        ]
+    repaired_text = call_groq_chat(repair_messages, model=model, response_format=response_format)
+    try:
+        return parse_llm_output(repaired_text, json_mode)
+    except StructuredParseError:
+        pass
+    try:
+        return parse_lenient(repaired_text, json_mode)
+    except StructuredParseError as e:
+        raise HTTPException(status_code=502, detail=f"Model reply could not be parsed: {e}")
+
+
+def optimize_prompt(
+    raw_prompt: str,
+    goal: Optional[str] = None,
+    audience: Optional[str] = None,
+    style: Optional[str] = None,
+    persona_name: Optional[str] = None,
+    persona_instructions: Optional[str] = None,
+    pending_patterns=None,
+    instructions_hash: Optional[str] = None,
+) -> Tuple[Dict[str, Any], str]:
+    """The /optimize pipeline: retrieval, meta-prompt, routing and structured generation.
+
+    Returns the parsed reply and the model that produced it. Callers that have DB work
+    to do first can start retrieval themselves and pass the pending handle in;
+    ``instructions_hash`` is the catalogue hash of a built-in persona, if any.
+    """
+    if pending_patterns is None:
+        pending_patterns = start_retrieval(raw_prompt[:200], get_vectorstore)
+    # Use whatever retrieval finished within the deadline; late results are dropped.
+    patterns = pending_patterns.collect() if pending_patterns else []
+    meta_prompt = build_meta_prompt(
+        raw=raw_prompt,
+        goal=goal,
+        audience=audience,
+        style=style,
+        patterns=patterns,
+        persona_name=persona_name,
+        persona_instructions=persona_instructions,
+        json_mode=OPTIMIZE_JSON_MODE,
+        instructions_hash=instructions_hash,
+    )
+    system_message = compose_system_prompt(persona_instructions, "You are a meticulous prompt optimization assistant.")
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": meta_prompt},
+    ]
+    model = choose_model(raw_prompt, persona_instructions)
+    # Identical concurrent requests (same rendered messages and model) share one upstream call.
+    flight_key = make_key(model, OPTIMIZE_JSON_MODE, messages)
+    parsed, shared = optimize_flight.do(flight_key, lambda: generate_structured(messages, model=model))
+    record_cache("optimize_singleflight", shared)
+    return parsed, model
 
 
 # -----------------------------
@@ -404,6 +462,7 @@ def read_current_user(current_user: models.User = Depends(get_current_user)):
     return current_user
 
 
+@traced("ensure_profile")
 def _ensure_profile(user: models.User, db: Session) -> models.Profile:
     if user.profile is None:
         profile = models.Profile(user_id=user.id)
@@ -416,7 +475,7 @@ def _ensure_profile(user: models.User, db: Session) -> models.Profile:
 
 @app.get("/me/preferences", response_model=schemas.ProfilePreferences)
 def get_preferences(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    ensure_default_personas(db)
+    persona_registry.sync(db)
     profile = _ensure_profile(current_user, db)
     # Only touch relationship when id is set to avoid loading stale objects
     if profile.active_persona_id:
@@ -464,7 +523,7 @@ def list_personas(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    ensure_default_personas(db)
+    persona_registry.sync(db)
     query = db.query(models.Persona).filter(
         or_(models.Persona.user_id == current_user.id, models.Persona.is_default.is_(True))
     )
@@ -477,6 +536,30 @@ def list_personas(
     return personas
 
 
+@app.get("/personas/catalog", response_model=schemas.PersonaCatalogRead)
+def persona_catalog(request: Request, response: Response):
+    """Built-in persona catalogue; the version doubles as an ETag so clients can cache it."""
+    catalog = persona_registry.current()
+    etag = f'"{catalog.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return schemas.PersonaCatalogRead(
+        version=catalog.version,
+        personas=[
+            schemas.PersonaSpecRead(
+                slug=spec.slug,
+                name=spec.name,
+                description=spec.description,
+                tags=list(spec.tags),
+                instruction_hash=spec.instruction_hash,
+                instruction_tokens=spec.instruction_tokens,
+            )
+            for spec in catalog.personas
+        ],
+    )
+
+
 @app.post("/personas", response_model=schemas.PersonaRead)
 def create_persona(
     persona_in: schemas.PersonaCreate,
@@ -529,13 +612,17 @@ def delete_persona(
     return {"status": "deleted"}
 
 
-def _get_prompt_or_404(prompt_id: str, user: models.User, db: Session) -> models.Prompt:
+def _get_prompt_or_404(prompt_id: str, user: models.User, db: Session, for_update: bool = False) -> models.Prompt:
     try:
         prompt_uuid = UUID(prompt_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid prompt id")
 
-    prompt = db.query(models.Prompt).filter(models.Prompt.id == prompt_uuid, models.Prompt.user_id == user.id).first()
+    query = db.query(models.Prompt).filter(models.Prompt.id == prompt_uuid, models.Prompt.user_id == user.id)
+    if for_update:
+        # Serializes concurrent edits so each one is versioned against the one before it.
+        query = query.with_for_update()
+    prompt = query.first()
     if not prompt:
         raise HTTPException(status_code=404, detail="Prompt not found")
     return prompt
@@ -568,12 +655,77 @@ def list_prompts(
     return prompts
 
 
-@app.post("/prompts", response_model=schemas.PromptRead)
+def _prompt_texts(db: Session, user_id: UUID):
+    def load():
+        return db.query(models.Prompt.id, models.Prompt.optimized_prompt).filter(models.Prompt.user_id == user_id).yield_per(500)
+
+    return load
+
+
+def _library_version(db: Session, user_id: UUID) -> Tuple[int, Any]:
+    """Cheap change marker for a user's prompts; it differs after any create, update or delete by any worker."""
+    count, latest = (
+        db.query(func.count(models.Prompt.id), func.max(models.Prompt.updated_at)).filter(models.Prompt.user_id == user_id).one()
+    )
+    return count, latest
+
+
+def _similar_prompts(db: Session, user_id: UUID, text: str, threshold: float, exclude: Optional[UUID] = None, limit: int = 10):
+    version = _library_version(db, user_id)
+    matches = dedup.registry.similar(user_id, _prompt_texts(db, user_id), version, text, threshold=threshold, exclude=exclude)[:limit]
+    if not matches:
+        return []
+    titles = dict(
+        db.query(models.Prompt.id, models.Prompt.title)
+        .filter(models.Prompt.id.in_([prompt_id for prompt_id, _ in matches]), models.Prompt.user_id == user_id)
+        .all()
+    )
+    return [
+        schemas.SimilarPrompt(id=prompt_id, title=titles[prompt_id], similarity=round(score, 3))
+        for prompt_id, score in matches
+        if prompt_id in titles
+    ]
+
+
+def _commit_revision(db: Session) -> None:
+    try:
+        db.commit()
+    except IntegrityError:
+        # Only reachable where FOR UPDATE is a no-op (SQLite): another edit took this version number.
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Prompt was modified concurrently; retry the update")
+
+
+@app.post("/prompts", response_model=schemas.PromptCreateResult)
 def create_prompt(
     prompt_in: schemas.PromptCreate,
+    on_duplicate: str = Query(default="warn", pattern="^(warn|merge|allow)$"),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    duplicates = []
+    if on_duplicate != "allow":
+        duplicates = _similar_prompts(db, current_user.id, prompt_in.optimized_prompt, dedup.DUPLICATE_THRESHOLD)
+
+    if on_duplicate == "merge" and duplicates:
+        # Fold the new text into the closest existing prompt as a new revision instead of adding a row.
+        prompt = _get_prompt_or_404(str(duplicates[0].id), current_user, db, for_update=True)
+        expected = _library_version(db, current_user.id)
+        previous = versioning.snapshot(prompt)
+        prompt.title = prompt_in.title
+        prompt.optimized_prompt = prompt_in.optimized_prompt
+        prompt.rationale = prompt_in.rationale or prompt.rationale
+        prompt.tags = list(dict.fromkeys((prompt.tags or []) + (prompt_in.tags or [])))
+        versioning.record_version(db, prompt, previous=previous)
+        _commit_revision(db)
+        db.refresh(prompt)
+        dedup.registry.upsert(current_user.id, prompt.id, prompt.optimized_prompt, expected, _library_version(db, current_user.id))
+        result = schemas.PromptCreateResult.model_validate(prompt, from_attributes=True)
+        result.near_duplicates = duplicates[1:]
+        result.merged = True
+        return result
+
+    expected = _library_version(db, current_user.id)
     prompt = models.Prompt(
         user_id=current_user.id,
         title=prompt_in.title,
@@ -582,9 +734,14 @@ def create_prompt(
         tags=prompt_in.tags,
     )
     db.add(prompt)
+    db.flush()
+    versioning.record_version(db, prompt, previous=None)
     db.commit()
     db.refresh(prompt)
-    return prompt
+    dedup.registry.upsert(current_user.id, prompt.id, prompt.optimized_prompt, expected, _library_version(db, current_user.id))
+    result = schemas.PromptCreateResult.model_validate(prompt, from_attributes=True)
+    result.near_duplicates = duplicates
+    return result
 
 
 @app.get("/prompts/{prompt_id}", response_model=schemas.PromptRead)
@@ -600,81 +757,258 @@ def update_prompt(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    prompt = _get_prompt_or_404(prompt_id, current_user, db, for_update=True)
     update_data = prompt_in.dict(exclude_unset=True)
+    if update_data.get("optimized_prompt") is None:
+        update_data.pop("optimized_prompt", None)
+    previous = versioning.snapshot(prompt)
+    changed = any(getattr(prompt, key) != value for key, value in update_data.items())
+    expected = _library_version(db, current_user.id) if changed else None
     for key, value in update_data.items():
         setattr(prompt, key, value)
+    if changed:
+        versioning.record_version(db, prompt, previous=previous)
     db.add(prompt)
-    db.commit()
+    _commit_revision(db)
     db.refresh(prompt)
+    if changed:
+        # Any edit bumps updated_at, so the index takes the new library version even for metadata-only changes.
+        dedup.registry.upsert(current_user.id, prompt.id, prompt.optimized_prompt, expected, _library_version(db, current_user.id))
     return prompt
 
 
 @app.delete("/prompts/{prompt_id}")
 def delete_prompt(prompt_id: str, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
     prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    expected = _library_version(db, current_user.id)
     db.delete(prompt)
     db.commit()
+    dedup.registry.remove(current_user.id, prompt.id, expected, _library_version(db, current_user.id))
     return {"status": "deleted"}
 
 
+@app.get("/prompts/{prompt_id}/similar", response_model=List[schemas.SimilarPrompt])
+def similar_prompts(
+    prompt_id: str,
+    threshold: float = Query(default=0.5, ge=0.1, le=1.0),
+    limit: int = Query(default=10, ge=1, le=50),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    return _similar_prompts(db, current_user.id, prompt.optimized_prompt, threshold, exclude=prompt.id, limit=limit)
+
+
+def _version_read(row: models.PromptVersion, **extra: Any) -> Dict[str, Any]:
+    return {
+        "version": row.version,
+        "is_keyframe": row.is_keyframe,
+        "stored_bytes": len(row.payload),
+        "title": row.title,
+        "rationale": row.rationale,
+        "tags": row.tags,
+        "created_at": row.created_at,
+        **extra,
+    }
+
+
+@app.get("/prompts/{prompt_id}/versions", response_model=List[schemas.PromptVersionRead])
+def list_prompt_versions(prompt_id: str, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    rows = (
+        db.query(models.PromptVersion)
+        .filter(models.PromptVersion.prompt_id == prompt.id)
+        .order_by(models.PromptVersion.version.desc())
+        .all()
+    )
+    return [_version_read(row) for row in rows]
+
+
+@app.get("/prompts/{prompt_id}/versions/{version}", response_model=schemas.PromptVersionDetail)
+def read_prompt_version(
+    prompt_id: str,
+    version: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    row = (
+        db.query(models.PromptVersion)
+        .filter(models.PromptVersion.prompt_id == prompt.id, models.PromptVersion.version == version)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return _version_read(row, optimized_prompt=versioning.reconstruct(db, prompt.id, version))
+
+
+@app.get("/prompts/{prompt_id}/diff", response_model=schemas.PromptDiff)
+def diff_prompt_versions(
+    prompt_id: str,
+    from_version: int = Query(..., ge=1),
+    to_version: Optional[int] = Query(default=None, ge=1, description="Defaults to the latest version"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    prompt = _get_prompt_or_404(prompt_id, current_user, db)
+    to_version = to_version or versioning.latest_version(db, prompt.id)
+    old_text = versioning.reconstruct(db, prompt.id, from_version)
+    new_text = versioning.reconstruct(db, prompt.id, to_version)
+    diff = versioning.unified_diff(old_text, new_text, f"v{from_version}", f"v{to_version}")
+    return schemas.PromptDiff(from_version=from_version, to_version=to_version, diff=diff)
+
+
+@app.get("/export")
+def export_library(
+    format: str = Query(default="ndjson", pattern="^(ndjson|jsonl.gz)$"),
+    current_user: models.User = Depends(get_current_user),
+):
+    body = transfer.export_lines(current_user.id)
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    if format == "jsonl.gz":
+        return StreamingResponse(
+            transfer.gzip_stream(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="prompttune-{stamp}.jsonl.gz"'},
+        )
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="prompttune-{stamp}.ndjson"'},
+    )
+
+
+@app.post("/import", response_model=schemas.ImportResult)
+async def import_library(request: Request, current_user: models.User = Depends(get_current_user)):
+    """Body is the raw NDJSON (or gzipped JSONL) produced by ``GET /export``."""
+    return await transfer.import_stream(request.stream(), current_user.id)
+
+
 @app.post("/analytics", response_model=schemas.AnalyticsRead)
 def create_analytics(
     payload: schemas.AnalyticsCreate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    if payload.prompt_id:
+        _get_prompt_or_404(str(payload.prompt_id), current_user, db)
+    if payload.persona_id:
+        _get_persona_for_user(payload.persona_id, current_user, db)
     entry = models.Analytics(
         user_id=current_user.id,
         prompt_id=payload.prompt_id,
+        persona_id=payload.persona_id,
         rating=payload.rating,
         metrics=payload.metrics,
         note=payload.note,
     )
-    db.add(entry)
+    analytics.record_events(db, [entry])
     db.commit()
     db.refresh(entry)
     return entry
+
+
+@app.get("/analytics/summary", response_model=schemas.AnalyticsSummary)
+def analytics_summary(
+    bucket: str = Query(default="day", pattern="^(day|week|month)$"),
+    group_by: str = Query(default="none", pattern="^(none|prompt|persona)$"),
+    start: Optional[date] = Query(default=None, description="Defaults to 90 days before end"),
+    end: Optional[date] = Query(default=None, description="Defaults to today (UTC)"),
+    key: Optional[UUID] = Query(default=None, description="Restrict a grouped summary to one prompt or persona"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=90)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    buckets = analytics.summarize(db, current_user.id, bucket, group_by, start, end, key=key)
+    return schemas.AnalyticsSummary(bucket=bucket, group_by=group_by, start=start, end=end, buckets=buckets)
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/router/stats")
+def router_stats(current_user: models.User = Depends(get_current_user)):
+    return MODEL_STATS.snapshot()
+
+
+def _llm_metrics() -> List[str]:
+    snapshot = MODEL_STATS.snapshot()
+    lines = [
+        "# HELP prompttune_llm_tokens_total LLM tokens by model and kind",
+        "# TYPE prompttune_llm_tokens_total counter",
+    ]
+    for model, stats in snapshot.items():
+        lines.append(f'prompttune_llm_tokens_total{{model="{model}",kind="prompt"}} {stats["prompt_tokens"]}')
+        lines.append(f'prompttune_llm_tokens_total{{model="{model}",kind="completion"}} {stats["completion_tokens"]}')
+    lines += ["# HELP prompttune_llm_calls_total LLM calls by model", "# TYPE prompttune_llm_calls_total counter"]
+    for model, stats in snapshot.items():
+        lines.append(f'prompttune_llm_calls_total{{model="{model}"}} {stats["calls"]}')
+    lines += ["# HELP prompttune_llm_cost_usd_total Estimated LLM spend by model", "# TYPE prompttune_llm_cost_usd_total counter"]
+    for model, stats in snapshot.items():
+        lines.append(f'prompttune_llm_cost_usd_total{{model="{model}"}} {stats["cost_usd"]:.8f}')
+    return lines
+
+
+def _cache_ratio_metrics() -> List[str]:
+    info = template_cache_info()
+    lines = [
+        "# HELP prompttune_cache_hit_ratio Hit ratio per cache since process start",
+        "# TYPE prompttune_cache_hit_ratio gauge",
+    ]
+    ratios = {"meta_prompt_template": (info.hits, info.misses)}
+    for cache in ("session_history", "optimize_singleflight", "retrieval_dense_on_time", "retrieval_lexical_on_time"):
+        ratios[cache] = (CACHE_REQUESTS.value(cache, "hit"), CACHE_REQUESTS.value(cache, "miss"))
+    for cache, (hits, misses) in ratios.items():
+        total = hits + misses
+        lines.append(f'prompttune_cache_hit_ratio{{cache="{cache}"}} {hits / total if total else 0.0}')
+    return lines
+
+
+REGISTRY.register_collector(_llm_metrics)
+REGISTRY.register_collector(_cache_ratio_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/traces")
+def debug_traces(
+    trace_id: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    current_user: models.User = Depends(get_current_user),
+):
+    # Spans carry other users' request paths and timings, so callers only see their own.
+    return EXPORTER.recent(limit=limit, trace_id=trace_id, user_id=str(current_user.id))
+
+
 @app.post("/optimize", response_model=schemas.OptimizeResponse)
 def optimize(
     req: schemas.OptimizeRequest,
-    current_user: models.User = Depends(get_current_user),
+    current_user: models.User = Depends(rate_limit("optimize")),
+    _llm_slot: None = Depends(admit_llm_request),
     db: Session = Depends(get_db),
 ):
+    # Kick off retrieval (embedding + vector search, lexical search) before the DB work so they overlap.
+    pending_patterns = start_retrieval(req.raw_prompt[:200], get_vectorstore)
+
     profile = _ensure_profile(current_user, db)
     persona = resolve_persona(profile, current_user, db, req.persona_id)
-    effective_goal = req.goal or profile.default_goal
-    effective_audience = req.audience or profile.default_audience
-    effective_style = req.style or profile.default_style
-
-    # Retrieve examples/patterns via RAG
-    query_excerpt = req.raw_prompt if len(req.raw_prompt) < 200 else req.raw_prompt[:200]
-    # Build meta-prompt
-    meta_prompt = build_meta_prompt(
-        raw=req.raw_prompt,
-        goal=effective_goal,
-        audience=effective_audience,
-        style=effective_style,
-        patterns=[],
+    parsed, _ = optimize_prompt(
+        req.raw_prompt,
+        goal=req.goal or profile.default_goal,
+        audience=req.audience or profile.default_audience,
+        style=req.style or profile.default_style,
         persona_name=persona.name if persona else None,
         persona_instructions=persona.instructions if persona else None,
+        pending_patterns=pending_patterns,
+        instructions_hash=persona_registry.instruction_hash(persona),
     )
 
-    # Call LLM via Groq
-    base_system_prompt = "You are a meticulous prompt optimization assistant."
-    system_message = compose_system_prompt(persona.instructions if persona else None, base_system_prompt)
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": meta_prompt},
-    ]
-    result_text = call_groq_chat(messages)
-    parsed = parse_structured_response(result_text)
-
     return schemas.OptimizeResponse(
         optimized_prompt=parsed["optimized_prompt"],
         rationale=parsed["rationale"],
@@ -684,7 +1018,8 @@ def optimize(
 @app.post("/chat", response_model=schemas.ChatResponse)
 def chat(
     req: schemas.ChatRequest,
-    current_user: models.User = Depends(get_current_user),
+    current_user: models.User = Depends(rate_limit("chat")),
+    _llm_slot: None = Depends(admit_llm_request),
     db: Session = Depends(get_db),
 ):
     session_id = req.session_id
@@ -696,7 +1031,8 @@ def chat(
 
     profile = _ensure_profile(current_user, db)
     persona = resolve_persona(profile, current_user, db, req.persona_id)
-    history = get_session_history(str(current_user.id), session_id)
+    session_record = _get_or_create_chat_session(session_id, current_user, db)
+    history = get_session_history(str(current_user.id), session_record, db)
 
     payload: List[Dict[str, str]] = []
     base_chat_system = req.system_prompt or "You are a pragmatic prompt simulation assistant."
@@ -708,23 +1044,42 @@ def chat(
     for m in req.messages:
         payload.append({"role": m.role, "content": m.content})
 
-    reply = call_groq_chat(payload)
-
-    for m in req.messages:
-        history.append({"role": m.role, "content": m.content})
-    history.append({"role": "assistant", "content": reply})
-    SESSION_MEMORY[str(current_user.id)][session_id] = history[-MAX_HISTORY:]
+    routed_text = "\n".join([req.system_prompt or ""] + [m.content for m in req.messages])
+    model = choose_model(routed_text, persona.instructions if persona else None, history_turns=len(history))
+    reply = call_groq_chat(payload, model=model)
 
-    session_record = db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).first()
-    if not session_record:
-        session_record = models.ChatSession(user_id=current_user.id, session_id=session_id)
-        db.add(session_record)
-        db.commit()
+    turn = [{"role": m.role, "content": m.content} for m in req.messages]
+    turn.append({"role": "assistant", "content": reply})
+    append_session_messages(session_record, current_user, turn, history, db)
 
     returned_msgs = req.messages + [schemas.ChatMessage(role="assistant", content=reply)]
     return schemas.ChatResponse(reply=reply, messages=returned_msgs)
 
 
+@app.get("/sessions/{session_id}/messages", response_model=schemas.ChatMessagePage)
+def list_session_messages(
+    session_id: str,
+    after: Optional[int] = Query(default=None, description="Return messages with id greater than this cursor"),
+    limit: int = Query(default=50, ge=1, le=200),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    session_record = (
+        db.query(models.ChatSession)
+        .filter(models.ChatSession.session_id == session_id, models.ChatSession.user_id == current_user.id)
+        .first()
+    )
+    if not session_record:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    query = db.query(models.ChatMessage).filter(models.ChatMessage.session_pk == session_record.id)
+    if after is not None:
+        query = query.filter(models.ChatMessage.id > after)
+    rows = query.order_by(models.ChatMessage.id.asc()).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return schemas.ChatMessagePage(messages=rows[:limit], next_cursor=next_cursor)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("backend.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,60 @@
+"""Add analytics.persona_id, create analytics_rollups and backfill it from raw events."""
+from __future__ import annotations
+
+from pathlib import Path
+
+from sqlalchemy import inspect, text
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+if load_dotenv:
+    repo_root = Path(__file__).resolve().parents[2]
+    for candidate in (
+        repo_root / ".env",
+        repo_root / "backend/.env",
+    ):
+        if candidate.exists():
+            load_dotenv(candidate, override=False)
+
+from backend import models
+from backend.analytics import rebuild_rollups
+from backend.db import SessionLocal, engine
+
+
+ADD_COLUMN_SQL = text(
+    """
+    ALTER TABLE analytics
+    ADD COLUMN persona_id UUID NULL
+    REFERENCES personas(id) ON DELETE SET NULL
+    """
+)
+
+
+def column_exists(conn) -> bool:
+    return any(column["name"] == "persona_id" for column in inspect(conn).get_columns("analytics"))
+
+
+def main() -> None:
+    with engine.begin() as conn:
+        if not column_exists(conn):
+            conn.execute(ADD_COLUMN_SQL)
+            print("Added analytics.persona_id column")
+        else:
+            print("analytics.persona_id already exists")
+
+    models.AnalyticsRollup.__table__.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        events = rebuild_rollups(db)
+        db.commit()
+        print(f"Rebuilt analytics_rollups from {events} events")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
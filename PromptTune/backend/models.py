@@ -1,8 +1,8 @@
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, JSON, String, Text
+from sqlalchemy import Boolean, Date, DateTime, ForeignKey, Index, JSON, LargeBinary, String, Text, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -78,6 +78,31 @@ class Prompt(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user: Mapped[User] = relationship(back_populates="prompts")
+    versions: Mapped[list["PromptVersion"]] = relationship(
+        back_populates="prompt",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="PromptVersion.version",
+    )
+
+
+class PromptVersion(Base):
+    """One revision of a prompt: a full-text keyframe or a delta against the previous revision."""
+
+    __tablename__ = "prompt_versions"
+    __table_args__ = (UniqueConstraint("prompt_id", "version", name="uq_prompt_versions_prompt_version"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    prompt_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("prompts.id", ondelete="CASCADE"), index=True)
+    version: Mapped[int] = mapped_column(nullable=False)
+    is_keyframe: Mapped[bool] = mapped_column(Boolean, default=False)
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    title: Mapped[str] = mapped_column(String(255), nullable=False)
+    rationale: Mapped[str | None] = mapped_column(Text, nullable=True)
+    tags: Mapped[list[str] | None] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+    prompt: Mapped[Prompt] = relationship(back_populates="versions")
 
 
 class ChatSession(Base):
@@ -90,6 +115,28 @@ class ChatSession(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
 
     user: Mapped[User] = relationship(back_populates="sessions")
+    messages: Mapped[list["ChatMessage"]] = relationship(
+        back_populates="session",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="ChatMessage.id",
+    )
+
+
+class ChatMessage(Base):
+    """Append-only transcript row; ``id`` doubles as the keyset pagination cursor."""
+
+    __tablename__ = "chat_messages"
+    __table_args__ = (Index("ix_chat_messages_session_cursor", "session_pk", "id"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    session_pk: Mapped[int] = mapped_column(ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    role: Mapped[str] = mapped_column(String(32), nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=datetime.utcnow)
+
+    session: Mapped[ChatSession] = relationship(back_populates="messages")
 
 
 class Analytics(Base):
@@ -98,6 +145,7 @@ class Analytics(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
     prompt_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("prompts.id", ondelete="SET NULL"), nullable=True)
+    persona_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), ForeignKey("personas.id", ondelete="SET NULL"), nullable=True)
     rating: Mapped[int | None] = mapped_column(nullable=True)
     metrics: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     note: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -105,3 +153,22 @@ class Analytics(Base):
 
     user: Mapped[User] = relationship(back_populates="analytics")
     prompt: Mapped[Prompt | None] = relationship()
+
+
+class AnalyticsRollup(Base):
+    """Per-day aggregate of analytics events for one user and scope.
+
+    ``scope`` is ``"all"``, ``"prompt:<id>"`` or ``"persona:<id>"``; every event
+    increments the ``all`` row plus one row per dimension it carries.
+    """
+
+    __tablename__ = "analytics_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "day", "scope", name="uq_analytics_rollups_user_day_scope"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    day: Mapped[date] = mapped_column(Date, nullable=False)
+    scope: Mapped[str] = mapped_column(String(64), nullable=False)
+    events: Mapped[int] = mapped_column(default=0, nullable=False)
+    rated: Mapped[int] = mapped_column(default=0, nullable=False)
+    rating_sum: Mapped[int] = mapped_column(default=0, nullable=False)
@@ -0,0 +1,211 @@
+"""Parsing of the optimizer's structured LLM output.
+
+Two wire formats are supported:
+
+* tagged text (``<optimized>`` / ``<rationale>`` / ``<checklist>``), scanned in a
+  single forward pass by :class:`StructuredResponseParser`, which also accepts
+  the response incrementally as streamed chunks;
+* JSON mode, validated against :class:`schemas.OptimizeResponse`.
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import ValidationError
+
+from . import schemas
+
+TAGS = ("optimized", "rationale", "checklist")
+REQUIRED_TAGS = ("optimized", "checklist")
+
+_BULLET_RE = re.compile(r"^[ \t]*(?:[-*•]|\d+[.)])[ \t]+(.+?)[ \t]*$", re.MULTILINE)
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_JSON_FIELD_RE = r'"{}"\s*:\s*"((?:[^"\\]|\\.)*)'
+# Longest "<tag>" worth waiting for across chunks, with room for stray spaces.
+_MAX_TAG_LEN = max(len(tag) for tag in TAGS) + 8
+
+
+class StructuredParseError(ValueError):
+    """Raised when an LLM reply does not match the requested output format."""
+
+
+def _split_checklist(block: str) -> List[str]:
+    return [match.group(1) for match in _BULLET_RE.finditer(block)]
+
+
+class StructuredResponseParser:
+    """Single-pass scanner for the tagged optimizer format.
+
+    Text can be fed in arbitrary chunks. Each chunk is scanned once: section
+    text is collected in a list as it goes, and only a possibly split tag is
+    carried over to the next chunk, so feeding is linear in the reply length.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[str] = []
+        self._window = ""  # unscanned tail carried between chunks (at most a split tag)
+        self._current: Optional[str] = None
+        self._parts: List[str] = []  # text of the open section so far
+        self.sections: Dict[str, str] = {}
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    @property
+    def complete(self) -> bool:
+        return all(tag in self.sections for tag in TAGS)
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self._scan(self._window + chunk)
+
+    def _scan(self, buf: str) -> None:
+        pos = 0
+        while True:
+            if self._current is None:
+                lt = buf.find("<", pos)
+                if lt == -1:
+                    buf = ""
+                    break
+                # A tag closes within _MAX_TAG_LEN characters; bounding the search keeps
+                # runs of stray "<" linear instead of rescanning the rest of the buffer.
+                gt = buf.find(">", lt + 1, lt + 2 + _MAX_TAG_LEN)
+                if gt == -1:
+                    if len(buf) - lt > _MAX_TAG_LEN + 1:
+                        pos = lt + 1  # a stray "<", not a tag
+                        continue
+                    # Possibly a tag split across chunks; resume from "<" once more text arrives.
+                    buf = buf[lt:]
+                    break
+                name = buf[lt + 1:gt].strip().lower()
+                if name in TAGS and name not in self.sections:
+                    self._current = name
+                    self._parts = []
+                    pos = gt + 1
+                else:
+                    pos = lt + 1
+            else:
+                closing = f"</{self._current}>"
+                end = buf.find(closing, pos)
+                if end == -1:
+                    # Keep enough overlap to catch a closing tag split across chunks.
+                    keep = max(pos, len(buf) - len(closing) + 1)
+                    self._parts.append(buf[pos:keep])
+                    buf = buf[keep:]
+                    break
+                self._parts.append(buf[pos:end])
+                self.sections[self._current] = "".join(self._parts).strip()
+                self._current = None
+                self._parts = []
+                pos = end + len(closing)
+        self._window = buf
+
+    def result(self, strict: bool = True) -> Dict[str, Any]:
+        """Parsed sections; ``strict=False`` tolerates a missing checklist or rationale.
+
+        A reply without an ``<optimized>`` section is never returned as-is, in either mode.
+        """
+        if self._current is not None and self._current not in self.sections:
+            # Unterminated final section (e.g. truncated by max_tokens): keep what we have.
+            self.sections[self._current] = ("".join(self._parts) + self._window).strip()
+        missing = [tag for tag in REQUIRED_TAGS if not self.sections.get(tag)]
+        if missing and (strict or "optimized" in missing):
+            raise StructuredParseError(f"missing or empty <{'>, <'.join(missing)}> section")
+        return {
+            "optimized_prompt": self.sections["optimized"],
+            "rationale": self.sections.get("rationale", ""),
+            "checklist": _split_checklist(self.sections.get("checklist", "")),
+        }
+
+
+def parse_structured_response(text: str, strict: bool = False) -> Dict[str, Any]:
+    parser = StructuredResponseParser()
+    parser.feed(text)
+    return parser.result(strict=strict)
+
+
+def parse_stream(chunks: Iterable[str], strict: bool = True) -> Dict[str, Any]:
+    parser = StructuredResponseParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.result(strict=strict)
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    candidate = _JSON_FENCE_RE.sub("", text.strip())
+    try:
+        parsed = schemas.OptimizeResponse.model_validate_json(candidate)
+    except ValidationError as e:
+        raise StructuredParseError(f"invalid JSON reply: {e.errors()[0].get('msg', e)}") from e
+    if not parsed.optimized_prompt.strip() or not parsed.checklist:
+        raise StructuredParseError("optimized_prompt and checklist must be non-empty")
+    return parsed.model_dump()
+
+
+def parse_llm_output(text: str, json_mode: bool) -> Dict[str, Any]:
+    """Strict parse; JSON replies fall back to the tag scanner when the model ignored JSON mode."""
+    if json_mode and text.lstrip().startswith(("{", "```")):
+        return parse_json_response(text)
+    return parse_structured_response(text, strict=True)
+
+
+def _json_field(text: str, key: str) -> str:
+    match = re.search(_JSON_FIELD_RE.format(key), text)
+    if not match:
+        return ""
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except ValueError:
+        return match.group(1)
+
+
+def salvage_json_response(text: str) -> Dict[str, Any]:
+    """Best-effort fields from a JSON reply that failed validation, e.g. one truncated by max_tokens.
+
+    Raises :class:`StructuredParseError` if not even ``optimized_prompt`` can be recovered.
+    """
+    candidate = _JSON_FENCE_RE.sub("", text.strip())
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        optimized = data.get("optimized_prompt")
+        rationale = data.get("rationale")
+        checklist = data.get("checklist")
+        optimized = optimized if isinstance(optimized, str) else ""
+        rationale = rationale if isinstance(rationale, str) else ""
+        checklist = [str(item) for item in checklist] if isinstance(checklist, list) else []
+    else:
+        optimized, rationale = _json_field(candidate, "optimized_prompt"), _json_field(candidate, "rationale")
+        checklist = []
+    if not optimized.strip():
+        raise StructuredParseError("no optimized_prompt in JSON reply")
+    return {"optimized_prompt": optimized, "rationale": rationale, "checklist": checklist}
+
+
+def parse_lenient(text: str, json_mode: bool) -> Dict[str, Any]:
+    """Last-resort parse once repair has failed: keep whatever fields can be recovered."""
+    if json_mode and text.lstrip().startswith(("{", "```")):
+        return salvage_json_response(text)
+    return parse_structured_response(text)
+
+
+def repair_instruction(error: StructuredParseError, json_mode: bool) -> str:
+    if json_mode:
+        expected = 'a single JSON object with keys "optimized_prompt" (string), "rationale" (string) and "checklist" (array of strings)'
+    else:
+        expected = "the <optimized>, <rationale> and <checklist> sections exactly as specified"
+    return (
+        f"Your previous reply could not be parsed ({error}). "
+        f"Reply again with only {expected}, keeping the same content."
+    )
+
+
+JSON_FORMAT_SPEC = json.dumps(
+    {"optimized_prompt": "...", "rationale": "...", "checklist": ["item 1", "item 2"]},
+    indent=2,
+)
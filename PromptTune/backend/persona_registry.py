@@ -0,0 +1,176 @@
+"""File-backed catalogue of the built-in personas.
+
+The catalogue lives in ``personas.json`` (override with ``PERSONAS_FILE``). It
+is parsed once, then re-read only when the file's mtime changes; the mtime is
+checked at most every ``PERSONA_RELOAD_INTERVAL_S`` seconds. Each load gets a
+content hash as its version. Built-in ``Persona`` rows are synced to the
+database only when that version differs from the last one this process
+synced, so the request path costs a dictionary lookup rather than a query.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .prompting import compile_meta_prompt, estimate_tokens, instruction_hash
+
+PERSONAS_FILE = Path(os.getenv("PERSONAS_FILE", str(Path(__file__).resolve().parent / "personas.json")))
+PERSONA_RELOAD_INTERVAL_S = float(os.getenv("PERSONA_RELOAD_INTERVAL_S", "2"))
+
+
+@dataclass(frozen=True)
+class PersonaSpec:
+    slug: str
+    name: str
+    description: Optional[str]
+    instructions: str
+    tags: Tuple[str, ...]
+    instruction_hash: str
+    instruction_tokens: int
+
+
+@dataclass(frozen=True)
+class PersonaCatalog:
+    version: str
+    personas: Tuple[PersonaSpec, ...]
+    by_slug: Dict[str, PersonaSpec]
+
+
+def _load(path: Path) -> PersonaCatalog:
+    raw = path.read_bytes()
+    entries = json.loads(raw)["personas"]
+    specs: List[PersonaSpec] = []
+    for entry in entries:
+        instructions = entry["instructions"].strip()
+        specs.append(
+            PersonaSpec(
+                slug=entry["slug"],
+                name=entry["name"],
+                description=entry.get("description"),
+                instructions=instructions,
+                tags=tuple(entry.get("tags") or ()),
+                instruction_hash=instruction_hash(instructions),
+                instruction_tokens=estimate_tokens(instructions),
+            )
+        )
+    slugs = [spec.slug for spec in specs]
+    if len(set(slugs)) != len(slugs):
+        raise ValueError(f"Duplicate persona slug in {path}")
+    return PersonaCatalog(
+        version=hashlib.sha256(raw).hexdigest()[:12],
+        personas=tuple(specs),
+        by_slug={spec.slug: spec for spec in specs},
+    )
+
+
+class PersonaRegistry:
+    def __init__(self, path: Path = PERSONAS_FILE, reload_interval_s: float = PERSONA_RELOAD_INTERVAL_S) -> None:
+        self.path = path
+        self.reload_interval_s = reload_interval_s
+        self._lock = threading.Lock()
+        self._catalog: Optional[PersonaCatalog] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._synced_version: Optional[str] = None
+
+    def current(self) -> PersonaCatalog:
+        now = time.monotonic()
+        if self._catalog is not None and now - self._checked_at < self.reload_interval_s:
+            return self._catalog
+        with self._lock:
+            if self._catalog is not None and now - self._checked_at < self.reload_interval_s:
+                return self._catalog
+            self._checked_at = now
+            try:
+                mtime = self.path.stat().st_mtime
+            except OSError as e:
+                if self._catalog is None:
+                    raise
+                # Missing for a moment, e.g. mid atomic rename; retry after the next interval.
+                print(f"Persona catalogue unavailable, keeping version {self._catalog.version}: {e}")
+                return self._catalog
+            if self._catalog is None or mtime != self._mtime:
+                try:
+                    catalog = _load(self.path)
+                except (OSError, ValueError, KeyError) as e:
+                    if self._catalog is None:
+                        raise
+                    # Keep serving the last good catalogue while the file is mid-edit or invalid.
+                    print(f"Persona catalogue reload failed, keeping version {self._catalog.version}: {e}")
+                else:
+                    self._catalog = catalog
+                    for spec in catalog.personas:
+                        # Pre-compile meta-prompt templates so the first request per persona is not a miss.
+                        for json_mode in (False, True):
+                            compile_meta_prompt(spec.name, spec.instructions, json_mode, spec.instruction_hash)
+                self._mtime = mtime
+            return self._catalog
+
+    def spec(self, slug: Optional[str]) -> Optional[PersonaSpec]:
+        return self.current().by_slug.get(slug) if slug else None
+
+    def instruction_hash(self, persona: Optional[models.Persona]) -> Optional[str]:
+        """Catalogue hash for a synced built-in persona row; None for user personas."""
+        if persona is None or not persona.is_default:
+            return None
+        spec = self.spec(persona.slug)
+        # A row synced from an older catalogue version has different instructions.
+        return spec.instruction_hash if spec is not None and self._synced_version == self.current().version else None
+
+    def sync(self, db: Session) -> None:
+        """Bring built-in ``Persona`` rows in line with the catalogue if its version changed."""
+        catalog = self.current()
+        if self._synced_version == catalog.version:
+            return
+        with self._lock:
+            if self._synced_version == catalog.version:
+                return
+            try:
+                self._apply(db, catalog)
+            except IntegrityError:
+                # Another worker inserted the same slugs first; its rows are now visible, so re-apply.
+                db.rollback()
+                self._apply(db, catalog)
+            self._synced_version = catalog.version
+
+    def _apply(self, db: Session, catalog: PersonaCatalog) -> None:
+        rows = {
+            persona.slug: persona
+            for persona in db.query(models.Persona).filter(models.Persona.slug.isnot(None)).all()
+        }
+        changed = False
+        for spec in catalog.personas:
+            values = {
+                "name": spec.name,
+                "description": spec.description,
+                "instructions": spec.instructions,
+                "tags": list(spec.tags),
+                "is_default": True,
+            }
+            row = rows.get(spec.slug)
+            if row is None:
+                db.add(models.Persona(slug=spec.slug, **values))
+                changed = True
+            elif any(getattr(row, key) != value for key, value in values.items()):
+                for key, value in values.items():
+                    setattr(row, key, value)
+                changed = True
+        # Personas dropped from the file are retired rather than deleted: profiles that point at
+        # them keep working, but they no longer appear in the shared list.
+        for slug, row in rows.items():
+            if slug not in catalog.by_slug and row.is_default:
+                row.is_default = False
+                changed = True
+        if changed:
+            db.commit()
+
+
+registry = PersonaRegistry()
@@ -0,0 +1,168 @@
+"""Compiled meta-prompt templates.
+
+The optimizer prompt is split into a static prefix (framework, deliverables,
+output format, persona guidance) and a dynamic suffix (retrieved patterns,
+intent, raw prompt). The prefix is byte-identical for every request with the
+same persona and output mode, so provider-side prefix caching can reuse it, and
+it is compiled once per persona instead of rebuilt per request.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .parsing import JSON_FORMAT_SPEC
+
+PATTERN_TOKEN_BUDGET = int(os.getenv("PATTERN_TOKEN_BUDGET", "1200"))
+
+# Rough BPE approximation: one token per word piece or punctuation mark.
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+FRAMEWORK_SEGMENT = (
+    "You are an expert prompt engineer optimizing a raw user prompt using a rigorous 5-step framework: "
+    "Task, Context, References, Evaluate, Iterate. Improve clarity, constraints, and correctness. "
+    "Use the retrieved examples provided after these instructions as inspiration; do not copy verbatim."
+)
+
+DELIVERABLES_SEGMENT = """Deliverables:
+1) Optimized Prompt (ready to paste)
+2) Rationale (why these changes)
+3) Checklist (3-6 bullet items to self-evaluate outputs)"""
+
+TAG_FORMAT_SEGMENT = """Format strictly as:
+<optimized> ... </optimized>
+<rationale> ... </rationale>
+<checklist>
+- item 1
+- item 2
+...
+</checklist>"""
+
+JSON_FORMAT_SEGMENT = f"Respond with a single JSON object only, exactly in this shape:\n{JSON_FORMAT_SPEC}"
+
+class CompiledMetaPrompt:
+    def __init__(self, persona_name: Optional[str], persona_instructions: Optional[str], json_mode: bool) -> None:
+        persona_segment = (
+            "Persona Guidance:\n"
+            f"- Persona: {persona_name or 'Generalist'}\n"
+            f"- Instructions: {persona_instructions or 'n/a'}"
+        )
+        self.prefix = "\n\n".join([
+            FRAMEWORK_SEGMENT,
+            DELIVERABLES_SEGMENT,
+            JSON_FORMAT_SEGMENT if json_mode else TAG_FORMAT_SEGMENT,
+            persona_segment,
+        ])
+        # Exported on the build_meta_prompt span, to watch the cacheable share of each prompt.
+        self.prefix_tokens = estimate_tokens(self.prefix)
+
+    def render(
+        self,
+        raw: str,
+        goal: Optional[str],
+        audience: Optional[str],
+        style: Optional[str],
+        patterns: List[Dict[str, Any]],
+        pattern_budget: int = PATTERN_TOKEN_BUDGET,
+    ) -> str:
+        pattern_text, _ = fit_patterns(patterns, pattern_budget)
+        return f"""{self.prefix}
+
+Retrieved Prompt Patterns & Examples:
+{pattern_text or 'n/a'}
+
+Intent:
+- Goal: {goal or 'n/a'}
+- Audience/Tone: {audience or 'n/a'}
+- Style Prefs: {style or 'n/a'}
+
+Raw Prompt:
+{raw.strip()}"""
+
+
+def instruction_hash(instructions: Optional[str]) -> str:
+    """Short content hash of persona instructions; the template cache is keyed on it."""
+    return hashlib.sha256((instructions or "").encode("utf-8")).hexdigest()[:16]
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+_TEMPLATE_CACHE_SIZE = 256
+_templates: "OrderedDict[Tuple[Optional[str], str, bool], CompiledMetaPrompt]" = OrderedDict()
+_templates_lock = threading.Lock()
+_template_hits = 0
+_template_misses = 0
+
+
+def compile_meta_prompt(
+    persona_name: Optional[str],
+    persona_instructions: Optional[str],
+    json_mode: bool = False,
+    instructions_hash: Optional[str] = None,
+) -> CompiledMetaPrompt:
+    """Compiled template for a persona, LRU-cached on (name, instruction hash, mode).
+
+    Built-in personas pass the hash precomputed by the catalogue, so the request
+    path neither re-hashes nor keys the cache on their full instruction text.
+    """
+    global _template_hits, _template_misses
+    key = (persona_name, instructions_hash or instruction_hash(persona_instructions), json_mode)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            _template_hits += 1
+            return template
+        _template_misses += 1
+    template = CompiledMetaPrompt(persona_name, persona_instructions, json_mode)
+    with _templates_lock:
+        _templates[key] = template
+        while len(_templates) > _TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+
+def template_cache_info() -> CacheInfo:
+    return CacheInfo(_template_hits, _template_misses, _TEMPLATE_CACHE_SIZE, len(_templates))
+
+
+def fit_patterns(patterns: List[Dict[str, Any]], budget: int) -> Tuple[str, int]:
+    """Render retrieved patterns in rank order until ``budget`` tokens are used.
+
+    The pattern that crosses the budget is truncated rather than dropped so the
+    budget is filled; everything after it is skipped. Returns the text and the
+    estimated tokens it uses.
+    """
+    blocks: List[str] = []
+    used = 0
+    for p in patterns:
+        block = f"Source: {p.get('source', 'unknown')}\nExample/Notes: {p.get('snippet', '')}"
+        cost = estimate_tokens(block)
+        remaining = budget - used
+        if cost > remaining:
+            if remaining < 16:
+                break
+            pieces = _TOKEN_RE.finditer(block)
+            cut = 0
+            for i, match in enumerate(pieces):
+                if i == remaining:
+                    break
+                cut = match.end()
+            blocks.append(block[:cut] + " …")
+            used += remaining
+            break
+        blocks.append(block)
+        used += cost
+    return "\n\n".join(blocks), used
@@ -0,0 +1,208 @@
+"""Per-user/per-endpoint token-bucket rate limiting and LLM admission control.
+
+Buckets live in-process by default. Set ``REDIS_URL`` to share them across
+workers; the Redis backend runs the same refill/take logic atomically in a Lua
+script, and falls back to in-process buckets while Redis is unreachable.
+Admission control caps concurrent upstream LLM work per process and sheds load
+with ``429 Retry-After`` instead of letting requests queue up. It waits on the
+event loop, so queued requests do not hold threadpool workers.
+"""
+import math
+import os
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Tuple
+
+import anyio
+from fastapi import Depends, HTTPException, status
+
+from . import models
+from .auth import get_current_user
+
+REDIS_URL = os.getenv("REDIS_URL")
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "2.0"))
+REDIS_TIMEOUT_S = float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_S", "0.25"))
+# While Redis is down, how long to use the in-process buckets before trying it again.
+_REDIS_RETRY_S = 5.0
+_SWEEP_INTERVAL_S = 60.0
+
+
+def _parse_limit(value: str) -> Tuple[float, float]:
+    """``"<capacity>/<seconds>"`` -> (capacity, refill tokens per second)."""
+    capacity, _, per = value.partition("/")
+    return float(capacity), float(capacity) / float(per or 60)
+
+
+# Default budgets per endpoint; override with e.g. RATE_LIMIT_OPTIMIZE="20/60".
+ENDPOINT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "optimize": _parse_limit(os.getenv("RATE_LIMIT_OPTIMIZE", "10/60")),
+    "chat": _parse_limit(os.getenv("RATE_LIMIT_CHAT", "30/60")),
+}
+
+
+class InMemoryBucketBackend:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # key -> (tokens, updated, time the bucket is full again)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._swept_at = time.monotonic()
+
+    def _sweep(self, now: float) -> None:
+        # A bucket that has refilled is the same as a missing one, so idle keys can go.
+        self._swept_at = now
+        self._buckets = {key: state for key, state in self._buckets.items() if state[2] > now}
+
+    def take(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; returns 0 on success or the seconds until they are available."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at > _SWEEP_INTERVAL_S:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / refill_rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+            return wait
+
+
+_TAKE_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBucketBackend:
+    """Shared buckets for multi-worker deployments (any Redis-protocol server)."""
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, socket_timeout=REDIS_TIMEOUT_S, socket_connect_timeout=REDIS_TIMEOUT_S)
+        self._take = self._client.register_script(_TAKE_LUA)
+        self._fallback = InMemoryBucketBackend()
+        self._down_until = 0.0
+
+    def take(self, key: str, capacity: float, refill_rate: float, cost: float = 1.0) -> float:
+        if time.monotonic() >= self._down_until:
+            try:
+                return float(self._take(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate, cost]))
+            except self._errors as e:
+                # An outage degrades to per-process limits instead of failing every request.
+                print(f"Rate limit Redis unavailable, using in-memory buckets for {_REDIS_RETRY_S:g}s: {e}")
+                self._down_until = time.monotonic() + _REDIS_RETRY_S
+        return self._fallback.take(key, capacity, refill_rate, cost)
+
+
+def _build_backend():
+    if REDIS_URL:
+        try:
+            return RedisBucketBackend(REDIS_URL)
+        except ImportError:
+            print("REDIS_URL set but redis package missing; using in-memory rate limits")
+    return InMemoryBucketBackend()
+
+
+bucket_backend = _build_backend()
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def rate_limit(endpoint: str) -> Callable[..., models.User]:
+    """Dependency enforcing the ``endpoint`` budget for the authenticated user."""
+    capacity, refill_rate = ENDPOINT_LIMITS[endpoint]
+
+    def dependency(current_user: models.User = Depends(get_current_user)) -> models.User:
+        if RATE_LIMIT_ENABLED:
+            wait = bucket_backend.take(f"{current_user.id}:{endpoint}", capacity, refill_rate)
+            if wait > 0:
+                raise _too_many(f"Rate limit exceeded for {endpoint}", wait)
+        return current_user
+
+    return dependency
+
+
+class AdmissionController:
+    """Bounds concurrent LLM calls and the number of requests waiting for a slot.
+
+    Runs on the event loop only, so the counters need no lock.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout_s: float) -> None:
+        self._slots = anyio.Semaphore(max_concurrency, max_value=max_concurrency)
+        self._waiting = 0
+        self._active = 0
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.rejected = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    async def acquire(self) -> None:
+        try:
+            self._slots.acquire_nowait()
+        except anyio.WouldBlock:
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise _too_many("Server busy, retry shortly", self.queue_timeout_s)
+            self._waiting += 1
+            try:
+                with anyio.fail_after(self.queue_timeout_s):
+                    await self._slots.acquire()
+            except TimeoutError:
+                self.rejected += 1
+                raise _too_many("Server busy, retry shortly", self.queue_timeout_s)
+            finally:
+                self._waiting -= 1
+        self._active += 1
+
+    def release(self) -> None:
+        self._active -= 1
+        self._slots.release()
+
+
+llm_admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_S)
+
+
+async def admit_llm_request() -> AsyncIterator[None]:
+    """Yield-dependency holding an LLM slot for the lifetime of the request."""
+    await llm_admission.acquire()
+    try:
+        yield
+    finally:
+        llm_admission.release()
@@ -0,0 +1,169 @@
+"""Deadline-bounded hybrid retrieval of prompt patterns.
+
+Dense (query embedding -> vector search) and lexical (in-process BM25 over the
+``sources/`` corpus) lookups are started on a shared executor as soon as a
+request arrives, so they overlap with the handler's database work. Collecting
+them waits at most until the retrieval deadline; whatever finished by then is
+fused with reciprocal-rank fusion and the rest is dropped.
+"""
+import contextvars
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter as TermCounter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .telemetry import record_cache, span
+
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "1") == "1"
+RETRIEVAL_DEADLINE_MS = float(os.getenv("RETRIEVAL_DEADLINE_MS", "350"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+SOURCES_DIR = Path(__file__).resolve().parents[1] / "sources"
+SNIPPET_CHARS = 800
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+
+def _terms(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall(text.lower()) if len(w) > 2]
+
+
+class LexicalIndex:
+    """BM25 over paragraph chunks of the local RAG sources."""
+
+    def __init__(self, chunks: List[Tuple[str, str]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.chunks = chunks
+        self.k1, self.b = k1, b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for doc_id, (_, text) in enumerate(chunks):
+            counts = TermCounter(_terms(text))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_len = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    @classmethod
+    def from_sources(cls, root: Path = SOURCES_DIR) -> "LexicalIndex":
+        chunks: List[Tuple[str, str]] = []
+        for path in sorted(root.rglob("*.md")):
+            text = path.read_text(encoding="utf-8", errors="ignore")
+            for block in re.split(r"\n\s*\n", text):
+                block = block.strip()
+                if len(block) >= 80:
+                    chunks.append((str(path.relative_to(root)), block[:SNIPPET_CHARS]))
+        return cls(chunks)
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[Dict[str, Any]]:
+        n_docs = len(self.chunks)
+        scores: Dict[int, float] = {}
+        for term in set(_terms(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / (self._avg_len or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [{"source": self.chunks[i][0], "snippet": self.chunks[i][1]} for i, _ in ranked]
+
+
+_lexical_index: Optional[LexicalIndex] = None
+_lexical_lock = threading.Lock()
+
+
+def get_lexical_index() -> LexicalIndex:
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_lock:
+            if _lexical_index is None:
+                _lexical_index = LexicalIndex.from_sources()
+    return _lexical_index
+
+
+def _dense_search(query: str, get_vectorstore: Callable[[], Any], k: int) -> List[Dict[str, Any]]:
+    vectorstore = get_vectorstore()
+    embeddings = getattr(vectorstore, "embeddings", None)
+    if embeddings is not None:
+        with span("embed_query"):
+            vector = embeddings.embed_query(query)
+        with span("vector_search"):
+            docs = vectorstore.similarity_search_by_vector(vector, k=k)
+    else:
+        with span("vector_search"):
+            docs = vectorstore.similarity_search(query, k=k)
+    return [
+        {"source": (doc.metadata or {}).get("source", "unknown"), "snippet": doc.page_content[:SNIPPET_CHARS]}
+        for doc in docs
+    ]
+
+
+def _lexical_search(query: str, k: int) -> List[Dict[str, Any]]:
+    with span("lexical_search"):
+        return get_lexical_index().search(query, k=k)
+
+
+def _fuse(result_lists: List[List[Dict[str, Any]]], k: int, rrf_k: int = 60) -> List[Dict[str, Any]]:
+    scored: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    for results in result_lists:
+        for rank, pattern in enumerate(results):
+            key = pattern["snippet"][:200]
+            score, _ = scored.get(key, (0.0, pattern))
+            scored[key] = (score + 1.0 / (rrf_k + rank + 1), pattern)
+    ranked = sorted(scored.values(), key=lambda item: -item[0])
+    return [pattern for _, pattern in ranked[:k]]
+
+
+class PendingRetrieval:
+    def __init__(self, futures: Dict[str, Future], started: float, k: int) -> None:
+        self._futures = futures
+        self._started = started
+        self._k = k
+
+    def collect(self, deadline_ms: float = RETRIEVAL_DEADLINE_MS) -> List[Dict[str, Any]]:
+        """Wait until every search finished or the deadline (measured from start) passed."""
+        with span("retrieval_wait") as attrs:
+            deadline = self._started + deadline_ms / 1000
+            pending = set(self._futures.values())
+            while pending:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                _, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            ready: List[List[Dict[str, Any]]] = []
+            for name, future in self._futures.items():
+                on_time = future.done() and future.exception() is None
+                attrs[name] = "ok" if on_time else ("error" if future.done() else "late")
+                record_cache(f"retrieval_{name}_on_time", on_time)
+                if on_time:
+                    ready.append(future.result())
+            return _fuse(ready, self._k)
+
+
+def start_retrieval(query: str, get_vectorstore: Callable[[], Any], k: int = RETRIEVAL_TOP_K) -> Optional[PendingRetrieval]:
+    if not RETRIEVAL_ENABLED or not query.strip():
+        return None
+    # Run each search in a copy of the request context so its spans join the request trace.
+    futures = {
+        "dense": _executor.submit(contextvars.copy_context().run, _dense_search, query, get_vectorstore, k),
+        "lexical": _executor.submit(contextvars.copy_context().run, _lexical_search, query, k),
+    }
+    return PendingRetrieval(futures, time.perf_counter(), k)
+
+
+def warm_up(get_vectorstore: Callable[[], Any], get_llm_client: Callable[[], Any]) -> None:
+    """Build the lexical index and initialise upstream clients off the request path."""
+    for name, fn in (("lexical_index", get_lexical_index), ("vectorstore", get_vectorstore), ("llm_client", get_llm_client)):
+        try:
+            with span(f"warm_up_{name}"):
+                fn()
+        except Exception as e:
+            print(f"Warm-up of {name} skipped: {e}")
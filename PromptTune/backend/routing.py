@@ -0,0 +1,94 @@
+"""Per-request model routing and per-model usage accounting.
+
+Requests are scored with a cheap heuristic; easy ones go to a small model and
+hard ones straight to the large model. ``/optimize`` escalates to the large
+model when the small model's reply fails structured-output validation.
+"""
+import os
+import re
+import threading
+from typing import Any, Dict, Optional
+
+from .prompting import estimate_tokens
+
+SMALL_MODEL = os.getenv("ROUTER_SMALL_MODEL", "llama-3.1-8b-instant")
+LARGE_MODEL = os.getenv("ROUTER_LARGE_MODEL", "llama-3.3-70b-versatile")
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+ROUTER_THRESHOLD = float(os.getenv("ROUTER_THRESHOLD", "0.45"))
+
+# USD per million (input, output) tokens; unknown models are tracked with zero cost.
+MODEL_PRICING: Dict[str, tuple] = {
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+}
+
+_CONSTRAINT_RE = re.compile(
+    r"\b(must|exactly|at least|at most|json|schema|format|table|step[- ]by[- ]step|constraints?|"
+    r"compliance|edge cases?|cite|citations?|evaluate|compare)\b",
+    re.IGNORECASE,
+)
+_STRUCTURE_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+", re.MULTILINE)
+
+
+def complexity_score(text: str, persona_instructions: Optional[str] = None, history_turns: int = 0) -> float:
+    """Score in [0, 1]; higher means the request needs the large model."""
+    tokens = estimate_tokens(text)
+    score = min(tokens / 600.0, 1.0) * 0.45
+    score += min(len(_CONSTRAINT_RE.findall(text)) / 6.0, 1.0) * 0.2
+    score += min(len(_STRUCTURE_RE.findall(text)) / 8.0, 1.0) * 0.1
+    if "```" in text:
+        score += 0.15
+    if persona_instructions:
+        score += 0.05
+    score += min(history_turns / 20.0, 1.0) * 0.1
+    return min(score, 1.0)
+
+
+def choose_model(text: str, persona_instructions: Optional[str] = None, history_turns: int = 0) -> str:
+    if not ROUTER_ENABLED:
+        return LARGE_MODEL
+    score = complexity_score(text, persona_instructions, history_turns)
+    return LARGE_MODEL if score >= ROUTER_THRESHOLD else SMALL_MODEL
+
+
+class ModelStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _entry(self, model: str) -> Dict[str, float]:
+        return self._stats.setdefault(model, {
+            "calls": 0,
+            "errors": 0,
+            "escalations": 0,
+            "latency_ms_total": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0,
+        })
+
+    def record(self, model: str, latency_s: float, prompt_tokens: int = 0, completion_tokens: int = 0, error: bool = False) -> None:
+        input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+        with self._lock:
+            entry = self._entry(model)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["latency_ms_total"] += latency_s * 1000.0
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+    def record_escalation(self, model: str) -> None:
+        with self._lock:
+            self._entry(model)["escalations"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for model, entry in self._stats.items():
+                calls = entry["calls"] or 1
+                out[model] = {**entry, "avg_latency_ms": round(entry["latency_ms_total"] / calls, 2)}
+            return out
+
+
+MODEL_STATS = ModelStats()
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 from uuid import UUID
 
@@ -58,6 +58,20 @@ class PersonaRead(PersonaBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PersonaSpecRead(BaseModel):
+    slug: str
+    name: str
+    description: Optional[str] = None
+    tags: List[str] = []
+    instruction_hash: str
+    instruction_tokens: int
+
+
+class PersonaCatalogRead(BaseModel):
+    version: str
+    personas: List[PersonaSpecRead]
+
+
 class ProfilePreferences(BaseModel):
     industry: Optional[str] = None
     tone_preference: Optional[str] = None
@@ -84,6 +98,7 @@ class PromptCreate(PromptBase):
 
 class PromptUpdate(BaseModel):
     title: Optional[str] = None
+    optimized_prompt: Optional[str] = None
     rationale: Optional[str] = None
     tags: Optional[List[str]] = None
 
@@ -96,8 +111,40 @@ class PromptRead(PromptBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class SimilarPrompt(BaseModel):
+    id: UUID
+    title: str
+    similarity: float
+
+
+class PromptCreateResult(PromptRead):
+    near_duplicates: List[SimilarPrompt] = []
+    merged: bool = Field(False, description="True when the payload was merged into an existing near-duplicate")
+
+
+class PromptVersionRead(BaseModel):
+    version: int
+    is_keyframe: bool
+    stored_bytes: int
+    title: str
+    rationale: Optional[str] = None
+    tags: Optional[List[str]] = None
+    created_at: datetime
+
+
+class PromptVersionDetail(PromptVersionRead):
+    optimized_prompt: str
+
+
+class PromptDiff(BaseModel):
+    from_version: int
+    to_version: int
+    diff: str
+
+
 class AnalyticsCreate(BaseModel):
     prompt_id: Optional[UUID] = None
+    persona_id: Optional[UUID] = None
     rating: Optional[int] = Field(default=None, ge=1, le=5)
     metrics: Optional[dict] = None
     note: Optional[str] = None
@@ -109,6 +156,35 @@ class AnalyticsRead(AnalyticsCreate):
 
     model_config = ConfigDict(from_attributes=True)
 
+
+class AnalyticsBucket(BaseModel):
+    bucket_start: date
+    key: Optional[str] = Field(None, description="Prompt or persona id when grouped")
+    events: int
+    rated: int
+    avg_rating: Optional[float] = None
+
+
+class AnalyticsSummary(BaseModel):
+    bucket: str
+    group_by: str
+    start: date
+    end: date
+    buckets: List[AnalyticsBucket]
+
+
+class ImportCounts(BaseModel):
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+
+
+class ImportResult(BaseModel):
+    persona: ImportCounts
+    prompt: ImportCounts
+    analytics: ImportCounts
+
+
 class OptimizeRequest(BaseModel):
     raw_prompt: str = Field(..., min_length=1, description="The user's raw prompt to optimize")
     goal: Optional[str] = Field(None, description="Goal or task this prompt should achieve")
@@ -138,3 +214,15 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     reply: str
     messages: List[ChatMessage]
+
+
+class ChatMessageRead(ChatMessage):
+    id: int
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ChatMessagePage(BaseModel):
+    messages: List[ChatMessageRead]
+    next_cursor: Optional[int] = Field(None, description="Pass as `after` to fetch the next page; null when exhausted")
@@ -0,0 +1,106 @@
+"""Single-flight de-duplication of identical in-flight upstream calls.
+
+Concurrent callers with the same key wait for one leader's result instead of
+each issuing their own LLM request. With ``SINGLEFLIGHT_SHARED=1`` and
+``REDIS_URL`` set, the leader also takes a short-lived lock in Redis and
+publishes its (JSON-serialisable) result there, so followers on other workers
+reuse it too.
+
+This is de-duplication, not a result cache. The only reuse after a call has
+finished is the Redis handoff: the result is kept for ``_RESULT_HANDOFF_S`` so
+followers polling from other workers can collect it.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+REDIS_URL = os.getenv("REDIS_URL")
+SINGLEFLIGHT_SHARED = os.getenv("SINGLEFLIGHT_SHARED", "0") == "1"
+SINGLEFLIGHT_LOCK_TTL_S = float(os.getenv("SINGLEFLIGHT_LOCK_TTL_S", "60"))
+_POLL_INTERVAL_S = 0.05
+# Long enough for polling followers to see the result, short enough not to serve stale output.
+_RESULT_HANDOFF_S = 1.0
+
+
+def make_key(*parts: Any) -> str:
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self, redis_client=None) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._redis = redis_client
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run ``fn`` once per key among concurrent callers; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout=SINGLEFLIGHT_LOCK_TTL_S):
+                # Leader looks stuck; stop pinning this thread and do the work ourselves.
+                return fn(), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_shared(key, fn) if self._redis is not None else (fn(), False)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_shared(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        lock_key, result_key = f"singleflight:lock:{key}", f"singleflight:result:{key}"
+        deadline = time.monotonic() + SINGLEFLIGHT_LOCK_TTL_S
+        while True:
+            cached = self._redis.get(result_key)
+            if cached is not None:
+                return json.loads(cached), True
+            if self._redis.set(lock_key, "1", nx=True, px=int(SINGLEFLIGHT_LOCK_TTL_S * 1000)):
+                break
+            if time.monotonic() > deadline:
+                # Leader on another worker looks stuck; stop waiting and do the work ourselves.
+                return fn(), False
+            time.sleep(_POLL_INTERVAL_S)
+
+        try:
+            result = fn()
+            self._redis.set(result_key, json.dumps(result), px=int(_RESULT_HANDOFF_S * 1000))
+            return result, False
+        finally:
+            self._redis.delete(lock_key)
+
+
+def _build_flight() -> SingleFlight:
+    if SINGLEFLIGHT_SHARED and REDIS_URL:
+        try:
+            import redis
+
+            return SingleFlight(redis.Redis.from_url(REDIS_URL))
+        except ImportError:
+            print("SINGLEFLIGHT_SHARED set but redis package missing; de-duplicating within this process only")
+    return SingleFlight()
+
+
+optimize_flight = _build_flight()
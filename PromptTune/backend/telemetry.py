@@ -0,0 +1,255 @@
+"""In-process tracing and Prometheus-format metrics.
+
+``span("stage")`` times a block the way an OpenTelemetry span would (trace id,
+parent span, attributes). Finished spans go to a bounded in-memory exporter and
+to the per-stage latency histogram. ``TelemetryMiddleware`` opens a trace per
+request and adds a ``Server-Timing`` header summarising the stages that ran.
+Nothing leaves the process; ``/metrics`` and ``/debug/traces`` read from here.
+"""
+import contextvars
+import functools
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2000"))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            # Layout: one cumulative count per bucket, then +Inf count, then sum.
+            series = self._series.setdefault(label_values, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, inf)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[str]]) -> None:
+        """Collectors render metrics owned elsewhere (e.g. router stats) at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+REQUEST_LATENCY = REGISTRY.histogram(
+    "prompttune_request_duration_seconds", "End-to-end HTTP request latency", ("handler", "method", "status")
+)
+STAGE_LATENCY = REGISTRY.histogram("prompttune_stage_duration_seconds", "Latency of traced hot-path stages", ("stage",))
+CACHE_REQUESTS = REGISTRY.counter("prompttune_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+# -----------------------------
+# Tracing
+# -----------------------------
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None) -> None:
+        self.trace_id = trace_id or secrets.token_hex(16)
+        # Set once the request is authenticated; /debug/traces only shows a user their own spans.
+        self.user_id: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, duration_s: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + duration_s
+
+    def server_timing(self, total_s: float) -> str:
+        with self._lock:
+            parts = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.stages.items()]
+        parts.append(f"total;dur={total_s * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class InMemorySpanExporter:
+    def __init__(self, maxlen: int) -> None:
+        self._spans: deque = deque(maxlen=maxlen)
+
+    def export(self, span_record: Dict[str, Any]) -> None:
+        self._spans.append(span_record)
+
+    def recent(self, limit: int = 100, trace_id: Optional[str] = None, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        spans = list(self._spans)
+        if user_id is not None:
+            spans = [s for s in spans if s["user_id"] == user_id]
+        if trace_id:
+            spans = [s for s in spans if s["trace_id"] == trace_id]
+        return spans[-limit:]
+
+
+EXPORTER = InMemorySpanExporter(TRACE_BUFFER_SIZE)
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("prompttune_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("prompttune_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def set_trace_user(user_id: str) -> None:
+    """Attribute the current request's spans to ``user_id``."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.user_id = user_id
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Time a stage; yields the attribute dict so callers can annotate the span."""
+    trace = _current_trace.get()
+    span_id = secrets.token_hex(8)
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    started_wall = time.time()
+    started = time.perf_counter()
+    error: Optional[str] = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _current_span.reset(token)
+        STAGE_LATENCY.observe(duration, name)
+        if trace is not None:
+            trace.add_stage(name, duration)
+        EXPORTER.export({
+            "name": name,
+            "trace_id": trace.trace_id if trace else None,
+            "user_id": trace.user_id if trace else None,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "start": started_wall,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": attributes,
+            "error": error,
+        })
+
+
+def traced(name: str) -> Callable:
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TelemetryMiddleware:
+    """Pure ASGI middleware: opens a trace per request and emits ``Server-Timing``."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current_trace.set(trace)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing(time.perf_counter() - started).encode("latin-1")))
+                headers.append((b"x-trace-id", trace.trace_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            REQUEST_LATENCY.observe(time.perf_counter() - started, handler, scope.get("method", ""), str(status_code))
+            _current_trace.reset(token)
@@ -0,0 +1,381 @@
+"""Streaming export and import of a user's prompt library.
+
+Export writes one JSON object per line (NDJSON), optionally gzip-compressed,
+as rows come off a server-side cursor; nothing is materialised beyond one
+fetch batch. Import reads the request body incrementally and upserts records in
+batches, so memory stays flat whatever the library size. The whole import is
+one transaction: an invalid record anywhere rolls back every batch before it.
+
+Ids are remapped deterministically rather than through an in-memory table: a
+record keeps its original id unless that id already belongs to another user, in
+which case it becomes ``uuid5(user_id, original_id)``. Re-importing the same
+file is therefore idempotent and references between records stay consistent.
+"""
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import analytics, models, schemas, versioning
+from .db import SessionLocal, dialect_insert
+from .dedup import registry as dedup_registry
+
+EXPORT_FORMAT = "prompttune-export"
+EXPORT_VERSION = 1
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+_GZIP_FLUSH_BYTES = 64 * 1024
+
+# Export order matters: analytics reference prompts, so prompts are written (and imported) first.
+_KINDS: List[Tuple[str, Any, Tuple[str, ...]]] = [
+    ("persona", models.Persona, ("id", "name", "description", "instructions", "tags", "created_at", "updated_at")),
+    ("prompt", models.Prompt, ("id", "title", "optimized_prompt", "rationale", "tags", "created_at", "updated_at")),
+    ("analytics", models.Analytics, ("prompt_id", "persona_id", "rating", "metrics", "note", "created_at")),
+]
+_VALIDATORS = {
+    "persona": schemas.PersonaCreate,
+    "prompt": schemas.PromptCreate,
+    "analytics": schemas.AnalyticsCreate,
+}
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def export_lines(user_id: uuid.UUID) -> Iterator[bytes]:
+    """Yield the library as NDJSON lines, streaming each table with a server-side cursor."""
+    # Own session: the request-scoped one is closed before a streamed body is sent.
+    db = SessionLocal()
+    try:
+        header = {
+            "type": "header",
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_VERSION,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+        }
+        yield (json.dumps(header) + "\n").encode("utf-8")
+        for kind, model, fields in _KINDS:
+            # Plain column tuples: no ORM identity map to grow while streaming.
+            query = (
+                db.query(*(getattr(model, field) for field in fields))
+                .filter(model.user_id == user_id)
+                .order_by(model.created_at.asc(), model.id.asc())
+                .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+            )
+            for row in query:
+                record = {"type": kind, **{field: _encode(value) for field, value in zip(fields, row)}}
+                yield (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+    finally:
+        db.close()
+
+
+def gzip_stream(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            pending.append(out)
+            size += len(out)
+        if size >= _GZIP_FLUSH_BYTES:
+            yield b"".join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
+
+
+# -----------------------------
+# Import
+# -----------------------------
+def _split_lines(buffer: bytes, data: bytes, line_no: int) -> Tuple[List[bytes], bytes]:
+    """Complete lines in ``buffer + data`` and the unfinished tail, which must stay under the line limit."""
+    *lines, buffer = (buffer + data).split(b"\n")
+    if len(buffer) > IMPORT_MAX_LINE_BYTES:
+        raise HTTPException(status_code=400, detail=f"Line {line_no + len(lines) + 1} exceeds {IMPORT_MAX_LINE_BYTES} bytes")
+    return lines, buffer
+
+
+async def iter_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """Decode (optionally gzipped) NDJSON from a byte stream, one record at a time.
+
+    Gzip input is inflated at most ``IMPORT_MAX_LINE_BYTES`` at a time, so a
+    highly compressed body is rejected by the line limit before it is expanded.
+    """
+    decompressor = None
+    buffer = b""
+    line_no = 0
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(47)
+        while True:
+            if decompressor is not None:
+                data = decompressor.decompress(chunk, IMPORT_MAX_LINE_BYTES)
+                chunk = decompressor.unconsumed_tail
+            else:
+                data, chunk = chunk, b""
+            lines, buffer = _split_lines(buffer, data, line_no)
+            for line in lines:
+                line_no += 1
+                if line.strip():
+                    yield line_no, _parse_line(line, line_no)
+            if not chunk:
+                break
+    if decompressor is not None:
+        lines, buffer = _split_lines(buffer, decompressor.flush(), line_no)
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, _parse_line(line, line_no)
+    if buffer.strip():
+        yield line_no + 1, _parse_line(buffer, line_no + 1)
+
+
+def _parse_line(line: bytes, line_no: int) -> Dict[str, Any]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Line {line_no}: invalid JSON")
+    if not isinstance(record, dict) or "type" not in record:
+        raise HTTPException(status_code=400, detail=f"Line {line_no}: missing record type")
+    return record
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _check_datetimes(record: Dict[str, Any], line_no: int) -> None:
+    for field in ("created_at", "updated_at"):
+        try:
+            _parse_datetime(record.get(field))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: invalid {field}")
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _upsert(db: Session, model, rows: List[Dict[str, Any]], user_id: uuid.UUID) -> None:
+    """Insert ``rows`` or update them in place; a conflicting row owned by anyone else is left untouched."""
+    insert = dialect_insert(db)
+    if insert is None:
+        for row in rows:
+            db.merge(model(**row))
+        return
+    stmt = insert(model.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.__table__.c.id],
+        set_={key: stmt.excluded[key] for key in rows[0] if key != "id"},
+        where=model.__table__.c.user_id == user_id,
+    )
+    db.execute(stmt)
+
+
+class LibraryImporter:
+    """Accumulates parsed records and writes them in batches of ``IMPORT_BATCH_SIZE``."""
+
+    def __init__(self, db: Session, user_id: uuid.UUID) -> None:
+        self.db = db
+        self.user_id = user_id
+        self.counts = {kind: {"created": 0, "updated": 0, "skipped": 0} for kind, _, _ in _KINDS}
+        self._pending: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind, _, _ in _KINDS}
+        self._kind: Optional[str] = None
+
+    def add(self, line_no: int, record: Dict[str, Any]) -> bool:
+        """Queue a record; returns True when a flush is due."""
+        kind = record.get("type")
+        if kind == "header":
+            if record.get("format") != EXPORT_FORMAT or record.get("version", 0) > EXPORT_VERSION:
+                raise HTTPException(status_code=400, detail="Unsupported export format or version")
+            return False
+        if kind not in _VALIDATORS:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: unknown record type {kind!r}")
+        try:
+            _VALIDATORS[kind].model_validate(record)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: {e.errors()[0]['msg']}")
+        if kind != "analytics":
+            try:
+                uuid.UUID(str(record.get("id")))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Line {line_no}: invalid id")
+        _check_datetimes(record, line_no)
+        # A new kind means the previous one is complete; flush it first so references resolve.
+        due = self._kind is not None and kind != self._kind
+        self._kind = kind
+        self._pending[kind].append(record)
+        return due or len(self._pending[kind]) >= IMPORT_BATCH_SIZE
+
+    def flush(self) -> None:
+        """Write pending batches to the open transaction; ``import_stream`` commits once at the end."""
+        for kind, model, _ in _KINDS:
+            batch = self._pending[kind]
+            if not batch:
+                continue
+            self._pending[kind] = []
+            getattr(self, f"_write_{kind}")(model, batch)
+            self.db.flush()
+            self.db.expunge_all()
+
+    def _remap(self, model, ids: List[uuid.UUID]) -> Dict[uuid.UUID, Tuple[uuid.UUID, bool]]:
+        """Map original ids to (target id, already exists for this user).
+
+        Any existing row the importer does not own is foreign, including built-in
+        personas (no owner), and gets a per-user uuid5 id instead.
+        """
+        owners = dict(self.db.query(model.id, model.user_id).filter(model.id.in_(ids)).all())
+        mapping: Dict[uuid.UUID, Tuple[uuid.UUID, bool]] = {}
+        foreign = []
+        for original in ids:
+            if original not in owners:
+                mapping[original] = (original, False)
+            elif owners[original] == self.user_id:
+                mapping[original] = (original, True)
+            else:
+                foreign.append(original)
+        if foreign:
+            remapped = {original: uuid.uuid5(self.user_id, str(original)) for original in foreign}
+            existing = {
+                row_id
+                for (row_id,) in self.db.query(model.id).filter(
+                    model.id.in_(list(remapped.values())), model.user_id == self.user_id
+                ).all()
+            }
+            for original, target in remapped.items():
+                mapping[original] = (target, target in existing)
+        return mapping
+
+    def _rows(self, kind: str, model, batch: List[Dict[str, Any]], fields) -> List[Dict[str, Any]]:
+        mapping = self._remap(model, [uuid.UUID(record["id"]) for record in batch])
+        rows = []
+        for record in batch:
+            target, exists = mapping[uuid.UUID(record["id"])]
+            row = {field: record.get(field) for field in fields}
+            row.update(
+                id=target,
+                user_id=self.user_id,
+                created_at=_parse_datetime(record.get("created_at")) or datetime.utcnow(),
+                updated_at=_parse_datetime(record.get("updated_at")) or datetime.utcnow(),
+            )
+            rows.append(row)
+            self.counts[kind]["updated" if exists else "created"] += 1
+        return rows
+
+    def _write_persona(self, model, batch: List[Dict[str, Any]]) -> None:
+        rows = self._rows("persona", model, batch, ("name", "description", "instructions", "tags"))
+        for row in rows:
+            row.update(slug=None, is_default=False)
+        _upsert(self.db, model, rows, self.user_id)
+
+    def _write_prompt(self, model, batch: List[Dict[str, Any]]) -> None:
+        rows = self._rows("prompt", model, batch, ("title", "optimized_prompt", "rationale", "tags"))
+        ids = [row["id"] for row in rows]
+        previous = {
+            prompt_id: versioning.PromptState(text, title, rationale, tags)
+            for prompt_id, text, title, rationale, tags in self.db.query(
+                model.id, model.optimized_prompt, model.title, model.rationale, model.tags
+            ).filter(model.id.in_(ids))
+        }
+        latest = versioning.latest_versions(self.db, ids)
+        _upsert(self.db, model, rows, self.user_id)
+        for row in rows:
+            old = previous.get(row["id"])
+            if old is not None and old.text == row["optimized_prompt"]:
+                continue
+            # A transient copy of the upserted row; record_version only reads it, it never joins the session.
+            versioning.record_version(self.db, model(**row), previous=old, current=latest.get(row["id"], 0))
+
+    def _write_analytics(self, model, batch: List[Dict[str, Any]]) -> None:
+        created = [_naive_utc(_parse_datetime(record.get("created_at"))) or datetime.utcnow() for record in batch]
+        # Analytics rows have no portable id; (prompt, timestamp) identifies an event already imported.
+        seen = {
+            (str(prompt_id) if prompt_id else None, _naive_utc(ts))
+            for prompt_id, ts in self.db.query(model.prompt_id, model.created_at)
+            .filter(model.user_id == self.user_id, model.created_at >= min(created), model.created_at <= max(created))
+            .all()
+        }
+        prompt_ids = [uuid.UUID(record["prompt_id"]) for record in batch if record.get("prompt_id")]
+        prompt_map = self._remap(models.Prompt, prompt_ids) if prompt_ids else {}
+        persona_map = self._persona_targets(
+            [uuid.UUID(record["persona_id"]) for record in batch if record.get("persona_id")]
+        )
+        rows = []
+        for record, ts in zip(batch, created):
+            prompt_id = None
+            if record.get("prompt_id"):
+                target, exists = prompt_map[uuid.UUID(record["prompt_id"])]
+                prompt_id = target if exists else None
+            persona_id = persona_map.get(uuid.UUID(record["persona_id"])) if record.get("persona_id") else None
+            if (str(prompt_id) if prompt_id else None, ts) in seen:
+                self.counts["analytics"]["skipped"] += 1
+                continue
+            rows.append(
+                model(
+                    user_id=self.user_id,
+                    prompt_id=prompt_id,
+                    persona_id=persona_id,
+                    rating=record.get("rating"),
+                    metrics=record.get("metrics"),
+                    note=record.get("note"),
+                    created_at=ts,
+                )
+            )
+            self.counts["analytics"]["created"] += 1
+        analytics.record_events(self.db, rows)
+
+    def _persona_targets(self, ids: List[uuid.UUID]) -> Dict[uuid.UUID, uuid.UUID]:
+        """Built-in personas keep their id; the user's own go through the usual remap; unknown ids are dropped."""
+        if not ids:
+            return {}
+        builtin = {
+            row_id
+            for (row_id,) in self.db.query(models.Persona.id)
+            .filter(models.Persona.id.in_(ids), models.Persona.is_default.is_(True))
+            .all()
+        }
+        remapped = self._remap(models.Persona, [i for i in ids if i not in builtin])
+        targets = {i: i for i in builtin}
+        targets.update({original: target for original, (target, exists) in remapped.items() if exists})
+        return targets
+
+
+async def import_stream(chunks: AsyncIterator[bytes], user_id: uuid.UUID) -> Dict[str, Dict[str, int]]:
+    db = SessionLocal()
+    importer = LibraryImporter(db, user_id)
+    try:
+        async for line_no, record in iter_records(chunks):
+            if importer.add(line_no, record):
+                await run_in_threadpool(importer.flush)
+        await run_in_threadpool(importer.flush)
+        await run_in_threadpool(db.commit)
+    except Exception:
+        await run_in_threadpool(db.rollback)
+        raise
+    finally:
+        await run_in_threadpool(db.close)
+        # Prompts changed underneath the near-duplicate index; let it rebuild on next use.
+        dedup_registry.forget(user_id)
+    return importer.counts
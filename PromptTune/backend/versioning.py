@@ -0,0 +1,224 @@
+"""Prompt revision history stored as compressed deltas.
+
+Each revision of ``Prompt.optimized_prompt`` is stored either as a keyframe
+(the full text) or as a delta against the previous revision. A keyframe is
+written every ``PROMPT_KEYFRAME_INTERVAL`` revisions, or whenever the delta
+would not be smaller, so reconstructing any version replays at most one
+keyframe plus ``interval - 1`` deltas. Payloads are zlib-compressed JSON.
+"""
+import difflib
+import json
+import os
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+KEYFRAME_INTERVAL = int(os.getenv("PROMPT_KEYFRAME_INTERVAL", "10"))
+# Above this many characters a replaced line block is stored verbatim rather than char-diffed.
+_CHAR_DIFF_LIMIT = 4000
+
+Op = List[Union[str, int]]
+
+
+def _char_ops(old: str, new: str) -> List[Op]:
+    ops: List[Op] = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i2 - i1])
+        else:
+            if i2 > i1:
+                ops.append(["d", i2 - i1])
+            if j2 > j1:
+                ops.append(["i", new[j1:j2]])
+    return ops
+
+
+def compute_delta(old: str, new: str) -> List[Op]:
+    """Copy/insert/delete ops (in characters) that turn ``old`` into ``new``.
+
+    Diffs line by line first and only character-diffs the replaced blocks, which
+    keeps SequenceMatcher's cost proportional to the edit rather than the document.
+    """
+    old_lines, new_lines = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops: List[Op] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        old_block, new_block = "".join(old_lines[i1:i2]), "".join(new_lines[j1:j2])
+        if tag == "equal":
+            ops.append(["c", len(old_block)])
+        elif tag == "replace" and len(old_block) + len(new_block) <= _CHAR_DIFF_LIMIT:
+            ops.extend(_char_ops(old_block, new_block))
+        else:
+            if old_block:
+                ops.append(["d", len(old_block)])
+            if new_block:
+                ops.append(["i", new_block])
+    return _merge(ops)
+
+
+def _merge(ops: List[Op]) -> List[Op]:
+    merged: List[Op] = []
+    for op in ops:
+        if merged and merged[-1][0] == op[0]:
+            merged[-1][1] += op[1]
+        else:
+            merged.append(list(op))
+    return merged
+
+
+def apply_delta(old: str, ops: List[Op]) -> str:
+    out: List[str] = []
+    cursor = 0
+    for kind, arg in ops:
+        if kind == "c":
+            out.append(old[cursor:cursor + arg])
+            cursor += arg
+        elif kind == "d":
+            cursor += arg
+        else:
+            out.append(arg)
+    return "".join(out)
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _unpack(payload: bytes):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class PromptState(NamedTuple):
+    """A prompt's versioned fields as they were before an edit."""
+
+    text: str
+    title: str
+    rationale: Optional[str]
+    tags: Optional[List[str]]
+
+
+def snapshot(prompt: models.Prompt) -> PromptState:
+    return PromptState(prompt.optimized_prompt, prompt.title, prompt.rationale, list(prompt.tags) if prompt.tags else prompt.tags)
+
+
+def latest_version(db: Session, prompt_id) -> int:
+    return db.query(func.max(models.PromptVersion.version)).filter(models.PromptVersion.prompt_id == prompt_id).scalar() or 0
+
+
+def latest_versions(db: Session, prompt_ids: List) -> Dict:
+    """``latest_version`` for many prompts in one query; prompts without history are absent."""
+    return dict(
+        db.query(models.PromptVersion.prompt_id, func.max(models.PromptVersion.version))
+        .filter(models.PromptVersion.prompt_id.in_(prompt_ids))
+        .group_by(models.PromptVersion.prompt_id)
+        .all()
+    )
+
+
+def record_version(
+    db: Session, prompt: models.Prompt, previous: Optional[PromptState], current: Optional[int] = None
+) -> models.PromptVersion:
+    """Append a revision for ``prompt``'s current state; ``previous`` is the state it replaces.
+
+    Prompts created before history existed get their pre-edit state recorded as
+    version 1 first, so the first diff has something to point at. Callers editing
+    an existing prompt should load it ``FOR UPDATE`` before taking ``previous``, so
+    concurrent edits are numbered, and diffed, one after the other. Batch callers
+    pass ``current`` (from ``latest_versions``) to skip the per-prompt lookup.
+    """
+    previous_text = previous.text if previous is not None else None
+    if current is None:
+        current = latest_version(db, prompt.id)
+    if current == 0 and previous is not None:
+        db.add(
+            models.PromptVersion(
+                prompt_id=prompt.id,
+                version=1,
+                is_keyframe=True,
+                payload=_pack(previous.text),
+                title=previous.title,
+                rationale=previous.rationale,
+                tags=previous.tags,
+            )
+        )
+        current = 1
+
+    version = current + 1
+    full = _pack(prompt.optimized_prompt)
+    if previous_text is None or (version - 1) % KEYFRAME_INTERVAL == 0:
+        row = _keyframe(prompt, version, full)
+    else:
+        delta = _pack(compute_delta(previous_text, prompt.optimized_prompt))
+        if len(delta) >= len(full):
+            row = _keyframe(prompt, version, full)
+        else:
+            row = models.PromptVersion(
+                prompt_id=prompt.id,
+                version=version,
+                is_keyframe=False,
+                payload=delta,
+                title=prompt.title,
+                rationale=prompt.rationale,
+                tags=prompt.tags,
+            )
+    db.add(row)
+    return row
+
+
+def _keyframe(prompt: models.Prompt, version: int, packed: bytes) -> models.PromptVersion:
+    return models.PromptVersion(
+        prompt_id=prompt.id,
+        version=version,
+        is_keyframe=True,
+        payload=packed,
+        title=prompt.title,
+        rationale=prompt.rationale,
+        tags=prompt.tags,
+    )
+
+
+def reconstruct(db: Session, prompt_id, version: int) -> str:
+    keyframe = (
+        db.query(func.max(models.PromptVersion.version))
+        .filter(
+            models.PromptVersion.prompt_id == prompt_id,
+            models.PromptVersion.is_keyframe.is_(True),
+            models.PromptVersion.version <= version,
+        )
+        .scalar()
+    )
+    if keyframe is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    rows = (
+        db.query(models.PromptVersion)
+        .filter(
+            models.PromptVersion.prompt_id == prompt_id,
+            models.PromptVersion.version >= keyframe,
+            models.PromptVersion.version <= version,
+        )
+        .order_by(models.PromptVersion.version.asc())
+        .all()
+    )
+    if not rows or rows[-1].version != version:
+        raise HTTPException(status_code=404, detail="Version not found")
+    text = _unpack(rows[0].payload)
+    for row in rows[1:]:
+        text = _unpack(row.payload) if row.is_keyframe else apply_delta(text, _unpack(row.payload))
+    return text
+
+
+def unified_diff(old: str, new: str, from_label: str, to_label: str) -> str:
+    return "".join(
+        difflib.unified_diff(
+            old.splitlines(keepends=True),
+            new.splitlines(keepends=True),
+            fromfile=from_label,
+            tofile=to_label,
+        )
+    )
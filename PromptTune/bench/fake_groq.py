@@ -0,0 +1,116 @@
+"""Local OpenAI/Groq-compatible chat completions server for benchmarks.
+
+Serves ``POST /openai/v1/chat/completions`` (the path the Groq SDK calls) with a
+configurable time-to-first-token and token rate, so PromptTune can be load
+tested without spending real quota. Point the backend at it with
+``GROQ_BASE_URL=http://127.0.0.1:<port>``.
+
+    python -m bench.fake_groq --port 9100 --ttft-ms 150 --tokens-per-sec 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TTFT_MS = float(os.getenv("FAKE_GROQ_TTFT_MS", "150"))
+TOKENS_PER_SEC = float(os.getenv("FAKE_GROQ_TOKENS_PER_SEC", "400"))
+COMPLETION_TOKENS = int(os.getenv("FAKE_GROQ_COMPLETION_TOKENS", "180"))
+JITTER = float(os.getenv("FAKE_GROQ_JITTER", "0.1"))
+# Fraction of replies returned without structure, to exercise repair/escalation paths.
+MALFORMED_RATE = float(os.getenv("FAKE_GROQ_MALFORMED_RATE", "0.0"))
+
+app = FastAPI(title="Fake Groq")
+_WORDS = "clarify constraints audience format examples evaluate iterate context scope output".split()
+
+
+def _approx_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4
+
+
+def _body(n_tokens: int, wants_json: bool, is_optimizer: bool) -> str:
+    words = " ".join(random.choice(_WORDS) for _ in range(max(n_tokens - 20, 1)))
+    if random.random() < MALFORMED_RATE:
+        return words
+    if not is_optimizer:
+        return words
+    if wants_json:
+        return json.dumps({"optimized_prompt": words, "rationale": "Adds structure.", "checklist": ["Clear task", "Explicit format", "Audience stated"]})
+    return (
+        f"<optimized>{words}</optimized>\n<rationale>Adds structure.</rationale>\n"
+        "<checklist>\n- Clear task\n- Explicit format\n- Audience stated\n</checklist>"
+    )
+
+
+def _delay(seconds: float) -> float:
+    return max(0.0, seconds * random.uniform(1 - JITTER, 1 + JITTER))
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    messages = payload.get("messages", [])
+    n_tokens = min(int(payload.get("max_tokens") or COMPLETION_TOKENS), COMPLETION_TOKENS)
+    wants_json = (payload.get("response_format") or {}).get("type") == "json_object"
+    is_optimizer = any("<optimized>" in str(m.get("content", "")) or "optimized_prompt" in str(m.get("content", "")) for m in messages)
+    text = _body(n_tokens, wants_json, is_optimizer)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    model = payload.get("model", "fake")
+    usage = {"prompt_tokens": _approx_tokens(messages), "completion_tokens": n_tokens, "total_tokens": _approx_tokens(messages) + n_tokens}
+
+    if payload.get("stream"):
+        async def events():
+            await asyncio.sleep(_delay(TTFT_MS / 1000))
+            pieces = text.split(" ")
+            per_piece = 1.0 / TOKENS_PER_SEC
+            for i, piece in enumerate(pieces):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece + (" " if i < len(pieces) - 1 else "")}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(per_piece)
+            done = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(TTFT_MS / 1000 + n_tokens / TOKENS_PER_SEC))
+    return JSONResponse({
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+def main() -> None:
+    global TTFT_MS, TOKENS_PER_SEC, COMPLETION_TOKENS, MALFORMED_RATE
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft-ms", type=float, default=TTFT_MS)
+    parser.add_argument("--tokens-per-sec", type=float, default=TOKENS_PER_SEC)
+    parser.add_argument("--completion-tokens", type=int, default=COMPLETION_TOKENS)
+    parser.add_argument("--malformed-rate", type=float, default=MALFORMED_RATE)
+    args = parser.parse_args()
+    TTFT_MS, TOKENS_PER_SEC = args.ttft_ms, args.tokens_per_sec
+    COMPLETION_TOKENS, MALFORMED_RATE = args.completion_tokens, args.malformed_rate
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""In-process stand-in for the Pinecone vector store used by benchmarks.
+
+Implements the slice of the LangChain ``VectorStore`` / ``Embeddings`` API that
+the backend calls, with hashed bag-of-words embeddings and a configurable
+per-query latency. Enable it with
+``VECTORSTORE_FACTORY=bench.fake_vectorstore:build``.
+"""
+import hashlib
+import math
+import os
+import re
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Tuple
+
+DIM = 384
+EMBED_LATENCY_MS = float(os.getenv("FAKE_EMBED_LATENCY_MS", "15"))
+SEARCH_LATENCY_MS = float(os.getenv("FAKE_SEARCH_LATENCY_MS", "40"))
+SOURCES_DIR = Path(__file__).resolve().parents[1] / "sources"
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbeddings:
+    def _embed(self, text: str) -> List[float]:
+        vec = [0.0] * DIM
+        for word in _WORD_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little")
+            vec[h % DIM] += 1.0 if h & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(EMBED_LATENCY_MS / 1000)
+        return self._embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+
+class FakeVectorStore:
+    def __init__(self, texts: List[Tuple[str, str]], embeddings: HashingEmbeddings) -> None:
+        self.embeddings = embeddings
+        self._docs = [SimpleNamespace(page_content=text, metadata={"source": source}) for source, text in texts]
+        self._vectors = embeddings.embed_documents([text for _, text in texts])
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        time.sleep(SEARCH_LATENCY_MS / 1000)
+        scored = sorted(
+            range(len(self._docs)),
+            key=lambda i: -sum(a * b for a, b in zip(embedding, self._vectors[i])),
+        )
+        return [self._docs[i] for i in scored[:k]]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k)
+
+
+def _load_corpus(limit: int = 500) -> List[Tuple[str, str]]:
+    chunks: List[Tuple[str, str]] = []
+    for path in sorted(SOURCES_DIR.rglob("*.md")):
+        for block in path.read_text(encoding="utf-8", errors="ignore").split("\n\n"):
+            block = block.strip()
+            if len(block) > 80:
+                chunks.append((str(path.relative_to(SOURCES_DIR)), block[:1000]))
+            if len(chunks) >= limit:
+                return chunks
+    return chunks or [("synthetic", "Specify the task, the audience, and the output format explicitly.")]
+
+
+def build():
+    embeddings = HashingEmbeddings()
+    return FakeVectorStore(_load_corpus(), embeddings), embeddings
@@ -0,0 +1,347 @@
+"""PromptTune load-test harness.
+
+Boots the fake Groq server and the real backend (uvicorn, SQLite by default,
+fake vector store), drives scripted scenarios over HTTP and reports
+p50/p95/p99 latency and RPS per endpoint. Results are written as JSON named
+after the current commit so runs can be diffed with ``--baseline``.
+
+    python -m bench.run                              # all scenarios
+    python -m bench.run --scenarios optimize_mix --concurrency 32
+    python -m bench.run --baseline bench/results/<older>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SHORT_PROMPTS = ["Summarize this article", "Write a tweet about our launch", "Explain recursion"]
+LONG_PROMPT = (
+    "You must draft a step-by-step onboarding guide for new data analysts. Include:\n"
+    + "\n".join(f"- requirement {i}: cover tooling, access requests and review etiquette" for i in range(12))
+    + "\nReturn the result as a table with exactly four columns and cite internal docs."
+)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.started = time.perf_counter()
+
+    async def timed(self, endpoint: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        elapsed = time.perf_counter() - started
+        self.samples.setdefault(endpoint, []).append(elapsed)
+        codes = self.statuses.setdefault(endpoint, {})
+        codes[str(response.status_code)] = codes.get(str(response.status_code), 0) + 1
+        if response.status_code >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+    def summary(self) -> Dict[str, Any]:
+        wall = time.perf_counter() - self.started
+        out = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            out[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(endpoint, 0),
+                "status_codes": self.statuses.get(endpoint, {}),
+                "rps": round(len(ordered) / wall, 2) if wall else 0.0,
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        return {"wall_s": round(wall, 3), "endpoints": out}
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+async def bounded(concurrency: int, jobs: List[Callable[[], Awaitable[Any]]]) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            await job()
+
+    await asyncio.gather(*(run(job) for job in jobs))
+
+
+# -----------------------------
+# Scenarios
+# -----------------------------
+async def create_users(client: httpx.AsyncClient, count: int) -> List[Dict[str, str]]:
+    users = []
+    for _ in range(count):
+        email = f"bench-{uuid.uuid4().hex[:10]}@example.com"
+        password = "bench-password"
+        await client.post("/auth/register", json={"email": email, "password": password})
+        res = await client.post("/auth/login", data={"username": email, "password": password})
+        res.raise_for_status()
+        users.append({"email": email, "password": password, "token": res.json()["access_token"]})
+    return users
+
+
+def auth(user: Dict[str, str]) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+async def login_storm(client, users, args) -> Recorder:
+    rec = Recorder()
+    jobs = [
+        (lambda u=random.choice(users): rec.timed(
+            "POST /auth/login", client.post("/auth/login", data={"username": u["email"], "password": u["password"]})
+        ))
+        for _ in range(args.requests)
+    ]
+    await bounded(args.concurrency, jobs)
+    return rec
+
+
+async def optimize_mix(client, users, args) -> Recorder:
+    rec = Recorder()
+    personas = (await client.get("/personas", headers=auth(users[0]))).json()
+    persona_ids = [p["id"] for p in personas] + [None]
+
+    def payload() -> Dict[str, Any]:
+        raw = LONG_PROMPT if random.random() < 0.3 else random.choice(SHORT_PROMPTS)
+        body: Dict[str, Any] = {"raw_prompt": raw, "goal": "Make it actionable"}
+        persona_id = random.choice(persona_ids)
+        if persona_id:
+            body["persona_id"] = persona_id
+        return body
+
+    jobs = [
+        (lambda u=random.choice(users), body=payload(): rec.timed(
+            "POST /optimize", client.post("/optimize", json=body, headers=auth(u))
+        ))
+        for _ in range(args.requests)
+    ]
+    await bounded(args.concurrency, jobs)
+    return rec
+
+
+async def long_chats(client, users, args) -> Recorder:
+    rec = Recorder()
+
+    async def conversation(user):
+        session_id = f"bench-{uuid.uuid4().hex[:12]}"
+        for turn in range(args.chat_turns):
+            body = {"session_id": session_id, "messages": [{"role": "user", "content": f"Turn {turn}: refine the draft"}]}
+            await rec.timed("POST /chat", client.post("/chat", json=body, headers=auth(user)))
+        await rec.timed("GET /sessions/{id}/messages", client.get(f"/sessions/{session_id}/messages", headers=auth(user)))
+
+    sessions = max(1, args.requests // args.chat_turns)
+    await bounded(args.concurrency, [lambda u=users[i % len(users)]: conversation(u) for i in range(sessions)])
+    return rec
+
+
+def seed_library(email: str, count: int) -> None:
+    from sqlalchemy import insert
+
+    from backend import models
+    from backend.db import SessionLocal
+
+    words = "launch churn onboarding pricing roadmap summary tweet legal audit retro".split()
+    with SessionLocal() as db:
+        user = db.query(models.User).filter(models.User.email == email).one()
+        for start in range(0, count, 1000):
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "user_id": user.id,
+                    "title": f"{random.choice(words)} prompt {i}",
+                    "optimized_prompt": " ".join(random.choice(words) for _ in range(120)),
+                    "tags": [random.choice(words)],
+                }
+                for i in range(start, min(start + 1000, count))
+            ]
+            db.execute(insert(models.Prompt), rows)
+            db.commit()
+
+
+async def library_search(client, users, args) -> Recorder:
+    rec = Recorder()
+    owner = users[0]
+    seed_library(owner["email"], args.library_size)
+    rec.started = time.perf_counter()
+    terms = ["launch", "pricing", "audit", "roadmap 1", "prompt 99"]
+    jobs = [
+        (lambda q=random.choice(terms): rec.timed("GET /prompts?q=", client.get("/prompts", params={"q": q}, headers=auth(owner))))
+        for _ in range(max(1, args.requests // 10))
+    ]
+    await bounded(args.concurrency, jobs)
+    return rec
+
+
+SCENARIOS = {
+    "login_storm": login_storm,
+    "optimize_mix": optimize_mix,
+    "long_chats": long_chats,
+    "library_search": library_search,
+}
+
+
+# -----------------------------
+# Process management
+# -----------------------------
+def spawn(cmd: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+
+
+def wait_ready(url: str, timeout_s: float = 60.0) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: Dict[str, Any], baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text())
+    print(f"\nDelta vs {baseline_path.name} ({baseline.get('revision')}):")
+    for scenario, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario, {}).get("endpoints", {})
+        for endpoint, stats in result["endpoints"].items():
+            if endpoint not in base:
+                continue
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+                before = base[endpoint][key] or 1e-9
+                deltas.append(f"{key} {(stats[key] - before) / before * 100:+.1f}%")
+            print(f"  {scenario:<15} {endpoint:<32} " + "  ".join(deltas))
+
+
+async def drive(args) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=args.backend_url, timeout=120.0) as client:
+        users = await create_users(client, args.users)
+        results = {}
+        for name in args.scenarios:
+            print(f"running {name} ...", flush=True)
+            rec = await SCENARIOS[name](client, users, args)
+            results[name] = rec.summary()
+        return results
+
+
+def print_table(results: Dict[str, Any]) -> None:
+    print(f"\n{'scenario':<15} {'endpoint':<32} {'n':>6} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for scenario, result in results.items():
+        for endpoint, s in result["endpoints"].items():
+            print(
+                f"{scenario:<15} {endpoint:<32} {s['requests']:>6} {s['errors']:>5} {s['rps']:>8} "
+                f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PromptTune load-test harness")
+    parser.add_argument("--scenarios", default="all", help=f"comma list of {', '.join(SCENARIOS)} or 'all'")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--chat-turns", type=int, default=10)
+    parser.add_argument("--library-size", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the backend")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file; pass an ephemeral Postgres URL to use one")
+    parser.add_argument("--backend-port", type=int, default=8765)
+    parser.add_argument("--fake-groq-port", type=int, default=9100)
+    parser.add_argument("--ttft-ms", type=float, default=150)
+    parser.add_argument("--tokens-per-sec", type=float, default=400)
+    parser.add_argument("--out", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--baseline", type=Path, default=None)
+    args = parser.parse_args()
+    args.scenarios = list(SCENARIOS) if args.scenarios == "all" else [s.strip() for s in args.scenarios.split(",")]
+
+    tmpdir = tempfile.mkdtemp(prefix="prompttune-bench-")
+    args.database_url = args.database_url or f"sqlite:///{Path(tmpdir) / 'bench.db'}"
+    args.backend_url = f"http://127.0.0.1:{args.backend_port}"
+
+    # Create the schema once up front so multiple workers don't race on create_all.
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, str(ROOT))
+    from backend import models
+    from backend.db import engine
+
+    models.Base.metadata.create_all(bind=engine)
+
+    fake = spawn(
+        [sys.executable, "-m", "bench.fake_groq", "--port", str(args.fake_groq_port),
+         "--ttft-ms", str(args.ttft_ms), "--tokens-per-sec", str(args.tokens_per_sec)],
+        {},
+    )
+    backend = spawn(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+         "--port", str(args.backend_port), "--workers", str(args.workers), "--log-level", "warning"],
+        {
+            "DATABASE_URL": args.database_url,
+            "JWT_SECRET": "bench-secret",
+            "GROQ_API_KEY": "bench",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{args.fake_groq_port}",
+            "VECTORSTORE_FACTORY": "bench.fake_vectorstore:build",
+            "RATE_LIMIT_ENABLED": "0",
+        },
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{args.fake_groq_port}/docs")
+        wait_ready(f"{args.backend_url}/health")
+        results = asyncio.run(drive(args))
+    finally:
+        backend.terminate()
+        fake.terminate()
+        backend.wait(10)
+        fake.wait(10)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "scenarios": results,
+    }
+    args.out.mkdir(parents=True, exist_ok=True)
+    out_path = args.out / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{report['revision']}.json"
+    out_path.write_text(json.dumps(report, indent=2))
+    print_table(results)
+    print(f"\nwrote {out_path}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()